@@ -0,0 +1,95 @@
+﻿"""
+Бенчмарк загрузки пакетов в packet_data.
+
+Сравнивает скорость (строк в секунду) прежней вставки через ORM
+(PacketData + session.add, flush каждые 1000 строк) и PacketBulkLoader
+(COPY ... FROM STDIN). Обе загрузки выполняются в транзакции, которая
+затем откатывается, поэтому данные в таблице не меняются.
+
+Запуск из корня проекта (пароль берется из DB_PASSWORD или --password):
+    python -m benchmarks.bench_bulk_load --rows 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from models.database import DatabaseManager
+from models.models import PacketData
+from services.file_parser import FileParser
+from services.bulk_loader import PacketBulkLoader
+from benchmarks.log_generator import write_synthetic_log
+
+
+def legacy_orm_load(session, packets):
+    """Прежний алгоритм insert_packet_data: ORM-объект на каждую строку"""
+    inserted_count = 0
+    batch_size = 1000
+    # Значения приводятся к типам колонок так же, как при массовой загрузке
+    loader = PacketBulkLoader(session)
+    for i in range(0, len(packets), batch_size):
+        for row in loader.iter_load_rows(packets[i:i + batch_size]):
+            if row is None:
+                continue
+            values = dict(zip(loader.columns, row))
+            if values['timestamp'] is not None:
+                values['timestamp'] = datetime.fromisoformat(values['timestamp'])
+            session.add(PacketData(**values))
+            inserted_count += 1
+        session.flush()
+    return inserted_count
+
+
+def copy_load(session, packets):
+    return PacketBulkLoader(session).load(packets)
+
+
+def measure(name, func, db_manager, packets):
+    session = db_manager.SessionLocal()
+    try:
+        start = time.perf_counter()
+        count = func(session, packets)
+        elapsed = time.perf_counter() - start
+    finally:
+        session.rollback()
+        session.close()
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    print(f"{name:<20} | {count:>10} строк | {elapsed:>8.2f} с | {rate:>12,.0f} строк/с")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк загрузки пакетов в PostgreSQL")
+    parser.add_argument('--rows', type=int, default=1000000, help="Количество пакетов")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--database', default='network_monitor')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default=os.getenv('DB_PASSWORD', ''))
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(host=args.host, database=args.database, user=args.user,
+                                 password=args.password, port=args.port)
+    success, message = db_manager.connect()
+    if not success:
+        print(message)
+        return
+    db_manager.create_tables()
+
+    fd, file_path = tempfile.mkstemp(suffix='.txt', prefix='bench_log_')
+    os.close(fd)
+    try:
+        write_synthetic_log(file_path, args.rows)
+        packets = FileParser.parse_log_file_batch(file_path)
+
+        legacy_rate = measure("ORM session.add", legacy_orm_load, db_manager, packets)
+        copy_rate = measure("COPY FROM STDIN", copy_load, db_manager, packets)
+        print(f"Ускорение: x{copy_rate / legacy_rate:.2f}")
+    finally:
+        os.remove(file_path)
+        db_manager.disconnect()
+
+
+if __name__ == '__main__':
+    main()
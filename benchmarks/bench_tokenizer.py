@@ -0,0 +1,88 @@
+﻿"""
+Микро-бенчмарк токенизатора строк пакетов.
+
+Сравнивает скорость (строк в секунду) прежнего разбора parse_log_file
+(split/strip/re.sub по каждому полю) и нового FileParser.tokenize_line
+на синтетическом логе в формате '║ ... │ ... ║'.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_tokenizer --rows 1000000
+"""
+import argparse
+import os
+import re
+import tempfile
+import time
+
+from services.file_parser import FileParser
+from benchmarks.log_generator import write_synthetic_log, parse_size
+
+
+def legacy_parse_lines(lines):
+    """Прежний алгоритм parse_log_file (до появления токенизатора)"""
+    packets = []
+    for line in lines:
+        if '║' in line and '│' in line:
+            if re.search(r'║\s*\d+\s*│', line):
+                clean_line = line.replace('║', '|').strip('|')
+                parts = [part.strip() for part in clean_line.split('│')]
+                if len(parts) >= 9:
+                    packets.append({
+                        'number': FileParser.clean_number(parts[0]),
+                        'timestamp': FileParser.clean_text(parts[1]),
+                        'source_ip': FileParser.clean_text(parts[2]),
+                        'destination_ip': FileParser.clean_text(parts[3]),
+                        'source_port': FileParser.parse_port(parts[4]),
+                        'destination_port': FileParser.parse_port(parts[5]),
+                        'size': FileParser.clean_number(parts[6]),
+                        'flags': FileParser.clean_text(parts[7]),
+                        'protocol': FileParser.clean_text(parts[8])
+                    })
+    return packets
+
+
+def tokenizer_parse_lines(lines):
+    packets = []
+    tokenize = FileParser.tokenize_line
+    for line in lines:
+        packet = tokenize(line)
+        if packet is not None:
+            packets.append(packet)
+    return packets
+
+
+def measure(name, func, lines):
+    start = time.perf_counter()
+    packets = func(lines)
+    elapsed = time.perf_counter() - start
+    rate = len(packets) / elapsed if elapsed > 0 else float('inf')
+    print(f"{name:<20} | {len(packets):>10} пакетов | {elapsed:>8.2f} с | {rate:>12,.0f} строк/с")
+    return packets, rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк токенизатора строк пакетов")
+    parser.add_argument('--rows', default='1m', help="Количество строк в синтетическом логе: 10k, 1m, 10m или число")
+    args = parser.parse_args()
+    rows = parse_size(args.rows)
+
+    fd, file_path = tempfile.mkstemp(suffix='.txt', prefix='bench_log_')
+    os.close(fd)
+    try:
+        write_synthetic_log(file_path, rows)
+        with open(file_path, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+
+        print(f"Синтетический лог: {rows} строк, {os.path.getsize(file_path) / 1024 / 1024:.1f} MB")
+        legacy_packets, legacy_rate = measure("parse_log_file", legacy_parse_lines, lines)
+        new_packets, new_rate = measure("tokenize_line", tokenizer_parse_lines, lines)
+
+        if legacy_packets != new_packets:
+            print("ВНИМАНИЕ: результаты разбора различаются!")
+        print(f"Ускорение: x{new_rate / legacy_rate:.2f}")
+    finally:
+        os.remove(file_path)
+
+
+if __name__ == '__main__':
+    main()
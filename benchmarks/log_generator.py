@@ -0,0 +1,121 @@
+﻿"""
+Генератор синтетических логов сетевого монитора для бенчмарков.
+
+Строки имеют формат '║ № │ время │ источник │ получатель │ порт │ порт │ размер │ флаги │ протокол ║',
+который разбирает FileParser, с рамкой таблицы сверху и снизу. Распределение
+протоколов, адресов и размеров пакетов повторяет реальную выборку
+network_stats_20251109_102517.txt (1027 пакетов).
+
+Запуск из корня проекта:
+    python -m benchmarks.log_generator --rows 1m --output capture_1m.txt
+"""
+import argparse
+import random
+
+# Стандартные размеры логов для бенчмарков
+SIZES = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+
+# Протокол: (вес по реальной выборке, порт назначения, диапазон размеров)
+PROTOCOLS = {
+    'TCP': (645, '443', (54, 1514)),
+    'TLSv1.2': (282, '443', (100, 1514)),
+    'TLSv1.3': (47, '443', (100, 1514)),
+    'DNS': (28, '53', (70, 180)),
+    'SSL': (13, '443', (60, 500)),
+    'SSDP': (4, '1900', (170, 250)),
+    'ARP': (4, '-', (42, 42)),
+    'TLSv1': (2, '443', (300, 800)),
+    'HTTP/JSO': (1, '80', (150, 400)),
+    'HTTP': (1, '80', (200, 8387)),
+}
+
+LOCAL_HOST = '10.179.45.141'
+# Внешние узлы из реальной выборки, остальные адреса генерируются
+KNOWN_HOSTS = ['213.180.193.234', '52.168.112.66', '23.35.105.184', '77.88.55.88', '150.171.28.11',
+               '52.123.245.96', '10.179.45.165', '155.133.252.69', '142.251.1.95']
+FLAGS = ['ACK', 'PSH ACK', 'SYN', 'SYN ACK', 'FIN ACK', 'RST', '-']
+
+HEADER = ('╔' + '═' * 118 + '╗\n'
+          '║ №      │ Время           │ Источник        │ Получатель      │ Порт  │ Порт  │ Размер │ Флаги   │ Протокол ║\n'
+          '╟' + '─' * 118 + '╢\n')
+FOOTER = '╚' + '═' * 118 + '╝\n'
+
+
+def parse_size(text):
+    """'10k', '1m', '10m' или число строк"""
+    text = str(text).strip().lower()
+    if text in SIZES:
+        return SIZES[text]
+    if text[-1:] in ('k', 'm'):
+        return int(float(text[:-1]) * (1000 if text[-1] == 'k' else 1000000))
+    return int(text)
+
+
+def iter_log_lines(rows, seed=42):
+    rnd = random.Random(seed)
+    names = list(PROTOCOLS)
+    weights = [PROTOCOLS[name][0] for name in names]
+    external_hosts = KNOWN_HOSTS + [f"{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}."
+                                    f"{rnd.randint(1, 254)}" for _ in range(200)]
+    # Горячие узлы встречаются чаще: первые адреса списка получают больший вес
+    host_weights = [400, 60, 30, 20, 20, 18, 14, 13, 13] + [1] * 200
+
+    block = 10000
+    number = 0
+    while number < rows:
+        count = min(block, rows - number)
+        protocols = rnd.choices(names, weights, k=count)
+        remotes = rnd.choices(external_hosts, host_weights, k=count)
+        for protocol, remote in zip(protocols, remotes):
+            number += 1
+            _, destination_port, (min_size, max_size) = PROTOCOLS[protocol]
+
+            # Примерно 1000 пакетов в секунду, начиная с 10:25:00
+            millis = 37500000 + number
+            timestamp = (f"{millis // 3600000 % 24:02d}:{millis // 60000 % 60:02d}:"
+                         f"{millis // 1000 % 60:02d}.{millis % 1000:03d}{rnd.randint(0, 999):03d}")
+
+            if rnd.random() < 0.6:
+                source, destination = remote, LOCAL_HOST
+                source_port, destination_port = destination_port, str(rnd.randint(49152, 65535))
+            else:
+                source, destination = LOCAL_HOST, remote
+                source_port = str(rnd.randint(49152, 65535))
+
+            if protocol == 'ARP':
+                source_port = destination_port = '-'
+            flags = rnd.choice(FLAGS) if protocol in ('TCP', 'TLSv1.2', 'TLSv1.3', 'SSL', 'TLSv1') else '-'
+            size = rnd.randint(min_size, max_size)
+
+            yield (f"║ {number:<6} │ {timestamp:<15} │ {source:<15} │ {destination:<15} │ "
+                   f"{source_port:<5} │ {destination_port:<5} │ {size:<6} │ {flags:<7} │ {protocol:<8} ║\n")
+
+
+def write_synthetic_log(file_path, rows, seed=42):
+    """Генерация синтетического лога в формате, который ожидает FileParser"""
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(HEADER)
+        lines = []
+        for line in iter_log_lines(rows, seed):
+            lines.append(line)
+            if len(lines) >= 10000:
+                f.writelines(lines)
+                lines = []
+        f.writelines(lines)
+        f.write(FOOTER)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетического лога сетевого монитора")
+    parser.add_argument('--rows', default='10k', help="Количество строк: 10k, 1m, 10m или число")
+    parser.add_argument('--output', required=True, help="Путь к создаваемому файлу")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rows = parse_size(args.rows)
+    write_synthetic_log(args.output, rows, args.seed)
+    print(f"Создан лог {args.output}: {rows} пакетов")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+﻿import io
+import re
+import csv
+import ipaddress
+from datetime import datetime, timedelta
+from typing import List, Dict, Iterator, Optional, Callable, Union
+
+from sqlalchemy import table, column
+from sqlalchemy.orm import Session
+
+from models.models import PacketData
+from services.packet_batch import PacketBatch
+from services.protocol_registry import ProtocolRegistry
+from services.packet_partitions import PacketPartitions
+from services.sketches import PacketSketches
+from services.task_scheduler import CancelToken, check_cancelled
+
+class TimestampResolver:
+    """
+    Перевод времени из лога в полную метку времени для колонки TIMESTAMPTZ.
+
+    Лог содержит только время суток ('10:25:01.000001'). Дата берется из опорного
+    момента - времени изменения файла: захват не может закончиться позже, поэтому
+    если первое время пакета больше опорного, захват начался накануне. При переходе
+    через полночь (время уменьшилось больше чем на 12 часов) дата увеличивается.
+    Значения, уже содержащие дату, передаются без изменений, остальные - None.
+    """
+
+    TIME_PATTERN = re.compile(r'^(\d{1,2}):(\d{2}):(\d{2})(\.\d{1,6})?$')
+    DATETIME_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}')
+
+    def __init__(self, reference: Optional[datetime] = None):
+        self.reference = reference or datetime.now()
+        self.current_date = None
+        self._date_text = ''
+        self._last_time = ''
+
+    def resolve(self, value: str) -> Optional[str]:
+        if not value:
+            return None
+        match = self.TIME_PATTERN.match(value)
+        if match is None:
+            return value if self.DATETIME_PATTERN.match(value) else None
+
+        # Время дополняется до 'ЧЧ:ММ:СС...', чтобы строки сравнивались как время
+        time_text = value if len(match.group(1)) == 2 else '0' + value
+        if self.current_date is None:
+            self.current_date = self.reference.date()
+            if time_text > self.reference.strftime('%H:%M:%S.%f'):
+                self.current_date -= timedelta(days=1)
+            self._date_text = self.current_date.isoformat()
+        elif time_text < self._last_time and int(self._last_time[:2]) - int(time_text[:2]) >= 12:
+            self.current_date += timedelta(days=1)
+            self._date_text = self.current_date.isoformat()
+
+        self._last_time = time_text
+        return f"{self._date_text} {time_text}"
+
+class PacketBulkLoader:
+    """
+    Массовая загрузка пакетов в packet_data.
+
+    Для PostgreSQL (psycopg2) строки порциями пишутся в CSV-буфер в памяти
+    и передаются командой COPY ... FROM STDIN через copy_expert - без ORM-объектов
+    и flush на каждую строку. Для других драйверов используется executemany
+    через Core insert. Загрузка идет в транзакции сессии, commit делает вызывающий код.
+    Время пакета дополняется датой (TimestampResolver), пустые и некорректные
+    адреса загружаются как NULL - колонки адресов имеют тип INET. Название
+    протокола заменяется id из справочника protocols (ProtocolRegistry).
+    Для секционированной packet_data перед записью порции создаются
+    недостающие секции (PacketPartitions.prepare_rows), а в режиме приблизительной
+    статистики порция дополняет эскизы (PacketSketches.add_rows).
+    Отмена cancel_token проверяется перед записью каждой порции (TaskCancelled),
+    откат транзакции остается за вызывающим кодом.
+    """
+
+    COLUMNS = ('packet_number', 'timestamp', 'source_ip', 'destination_ip',
+               'source_port', 'destination_port', 'packet_size', 'protocol_id')
+    FIELDS = ('number', 'timestamp', 'source_ip', 'destination_ip',
+              'source_port', 'destination_port', 'size', 'protocol')
+
+    CHUNK_ROWS = 50000
+
+    def __init__(self, session: Session, table_name: str = PacketData.__tablename__,
+                 chunk_rows: int = CHUNK_ROWS, capture_id: Optional[int] = None,
+                 reference_time: Optional[datetime] = None,
+                 protocol_registry: Optional[ProtocolRegistry] = None,
+                 partitions: Optional[PacketPartitions] = None,
+                 sketches: Optional[PacketSketches] = None,
+                 cancel_token: Optional[CancelToken] = None):
+        self.session = session
+        self.table_name = table_name
+        self.chunk_rows = chunk_rows
+        self.bytes_sent = 0
+        self.timestamps = TimestampResolver(reference_time)
+        self.protocols = protocol_registry or ProtocolRegistry()
+        self.partitions = partitions
+        self.sketches = sketches
+        self.cancel_token = cancel_token
+        # Адреса в логе сильно повторяются - результат проверки кэшируется
+        self._ip_cache: Dict[str, Optional[str]] = {}
+        
+        # Номер захвата одинаков для всех строк загрузки и дописывается в конец строки
+        self.columns = self.COLUMNS + ('capture_id',) if capture_id is not None else self.COLUMNS
+        self.extra_values = (capture_id,) if capture_id is not None else ()
+
+    @staticmethod
+    def iter_rows(packets: Union[List[Dict], PacketBatch]) -> Iterator[Optional[tuple]]:
+        """
+        Строки для загрузки в порядке COLUMNS. Вместо пакетов без протокола
+        отдается None, чтобы прогресс считался по всем пакетам
+        """
+        if isinstance(packets, PacketBatch):
+            rows = packets.iter_rows(PacketBulkLoader.FIELDS)
+        else:
+            fields = PacketBulkLoader.FIELDS
+            rows = (tuple(packet[field] for field in fields) for packet in packets)
+
+        for row in rows:
+            protocol = row[-1]
+            yield row if protocol and protocol != '-' else None
+
+    def iter_load_rows(self, packets: Union[List[Dict], PacketBatch]) -> Iterator[Optional[tuple]]:
+        """Строки iter_rows с приведенными к типам колонок значениями и номером захвата"""
+        if isinstance(packets, PacketBatch):
+            names = packets.protocols()
+        else:
+            names = {packet['protocol'] for packet in packets}
+        names.discard('-')
+        names.discard('')
+        protocol_ids = self.protocols.ids_for(self.session, names)
+        
+        resolve_timestamp = self.timestamps.resolve
+        ip_value = self._ip_value
+        extra_values = self.extra_values
+        for row in self.iter_rows(packets):
+            if row is None:
+                yield None
+                continue
+            number, timestamp, source_ip, destination_ip, source_port, destination_port, size, protocol = row
+            yield (number, resolve_timestamp(timestamp), ip_value(source_ip), ip_value(destination_ip),
+                   source_port, destination_port, size, protocol_ids[protocol]) + extra_values
+
+    def _ip_value(self, value: str) -> Optional[str]:
+        try:
+            return self._ip_cache[value]
+        except KeyError:
+            pass
+        try:
+            result = str(ipaddress.ip_address(value.strip()))
+        except ValueError:
+            result = None
+        self._ip_cache[value] = result
+        return result
+
+    def load(self, packets: Union[List[Dict], PacketBatch], progress_callback: Optional[Callable] = None) -> int:
+        """Загрузка пакетов, возвращает количество вставленных строк"""
+        total_packets = len(packets) or 1
+        cursor = self.session.connection().connection.cursor()
+        use_copy = hasattr(cursor, 'copy_expert')
+        if not use_copy:
+            cursor.close()
+
+        inserted_count = 0
+        processed_count = 0
+        chunk = []
+        try:
+            for row in self.iter_load_rows(packets):
+                processed_count += 1
+                if row is None:
+                    continue
+                chunk.append(row)
+                if len(chunk) >= self.chunk_rows:
+                    inserted_count += self._flush(cursor if use_copy else None, chunk)
+                    chunk = []
+                    self._report(progress_callback, processed_count, total_packets)
+
+            if chunk:
+                inserted_count += self._flush(cursor if use_copy else None, chunk)
+            self._report(progress_callback, processed_count, total_packets)
+        finally:
+            if use_copy:
+                cursor.close()
+
+        return inserted_count
+
+    def _flush(self, cursor, chunk: List[tuple]) -> int:
+        check_cancelled(self.cancel_token)
+        if self.partitions is not None:
+            self.partitions.prepare_rows(self.columns, chunk)
+        if self.sketches is not None:
+            self.sketches.add_rows(self.columns, chunk)
+        if cursor is not None:
+            self._copy_chunk(cursor, chunk)
+        else:
+            self._insert_chunk(chunk)
+        return len(chunk)
+
+    def _copy_chunk(self, cursor, chunk: List[tuple]):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(chunk)
+        data = buffer.getvalue().encode('utf-8')
+        self.bytes_sent += len(data)
+
+        # None записывается пустым полем без кавычек - в формате csv это NULL
+        cursor.copy_expert(
+            f"COPY {self.table_name} ({', '.join(self.columns)}) FROM STDIN WITH (FORMAT csv)",
+            io.BytesIO(data)
+        )
+
+    def _insert_chunk(self, chunk: List[tuple]):
+        columns = self.columns
+        target = table(self.table_name, *(column(name) for name in columns))
+        # Без типов колонок Core передает значения как есть - время переводится в datetime
+        rows = []
+        for row in chunk:
+            values = dict(zip(columns, row))
+            if values['timestamp'] is not None:
+                values['timestamp'] = datetime.fromisoformat(values['timestamp'])
+            rows.append(values)
+        self.session.execute(target.insert(), rows)
+
+    def _report(self, progress_callback: Optional[Callable], processed_count: int, total_packets: int):
+        if progress_callback:
+            progress_callback(min(processed_count / total_packets * 100, 100),
+                              f"Загружено {processed_count}/{total_packets} пакетов, "
+                              f"передано {self.bytes_sent / 1024 / 1024:.1f} MB")
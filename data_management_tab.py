@@ -1,12 +1,24 @@
 ﻿import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import ttk, filedialog, messagebox, simpledialog
 import os
+import threading
 from datetime import datetime
 
+from services.log_follower import LogFollower
+from services.ingest_pipeline import IngestPipeline
+from services.packet_partitions import PacketPartitions
+from services.task_scheduler import CancelToken
+
+from .virtual_tree import VirtualTreeview
+from .tree_feeder import TreeFeeder
+
 class DataManagementTab:
     def __init__(self, parent, app):
         self.app = app
         self.frame = ttk.Frame(parent)
+        self.follow_stop_event = None
+        # Вывод строк просматриваемой таблицы (show_table)
+        self.table_feeder = None
         self.setup_ui()
     
     def setup_ui(self):
@@ -61,6 +73,12 @@ class DataManagementTab:
                   command=self.create_tables).pack(side=tk.LEFT, padx=5)
         ttk.Button(db_frame, text="Пересоздать таблицы", 
                   command=self.recreate_tables).pack(side=tk.LEFT, padx=5)
+        
+        # Секционирование применяется при создании и пересоздании таблиц
+        ttk.Label(db_frame, text="Секционирование:").pack(side=tk.LEFT, padx=(5, 0))
+        self.partitioning_var = tk.StringVar(value=PacketPartitions.MODES['none'])
+        ttk.Combobox(db_frame, textvariable=self.partitioning_var, state='readonly', width=22,
+                     values=list(PacketPartitions.MODES.values())).pack(side=tk.LEFT, padx=5)
     
     def setup_info_section(self, parent, row):
         ttk.Label(parent, text="Информация о базе данных", 
@@ -75,6 +93,10 @@ class DataManagementTab:
                   command=self.show_table_sizes).pack(side=tk.LEFT, padx=5)
         ttk.Button(info_frame, text="Список таблиц", 
                   command=self.show_table_list).pack(side=tk.LEFT, padx=5)
+        ttk.Button(info_frame, text="Состояние индексов", 
+                  command=self.show_index_status).pack(side=tk.LEFT, padx=5)
+        ttk.Button(info_frame, text="Секции packet_data", 
+                  command=self.show_partitions).pack(side=tk.LEFT, padx=5)
     
     def setup_management_section(self, parent, row):
         ttk.Label(parent, text="Управление данными", 
@@ -89,6 +111,8 @@ class DataManagementTab:
                   command=self.clear_database).pack(side=tk.LEFT, padx=5)
         ttk.Button(management_frame, text="Удалить все таблицы", 
                   command=self.drop_tables).pack(side=tk.LEFT, padx=5)
+        ttk.Button(management_frame, text="Создать индексы", 
+                  command=self.ensure_indexes).pack(side=tk.LEFT, padx=5)
     
     def setup_backup_section(self, parent, row):
         """Секция резервного копирования базы данных"""
@@ -131,6 +155,8 @@ class DataManagementTab:
         self.progress_label = ttk.Label(self.progress_frame, text="Готов к работе")
         self.progress_label.pack()
         
+        ttk.Button(self.progress_frame, text="Отменить", command=self.cancel_operations).pack(pady=2)
+        
         self.progress_frame.grid_remove()
     
     def setup_processing_section(self, parent, row):
@@ -144,8 +170,18 @@ class DataManagementTab:
                   command=self.parse_file_threaded).pack(side=tk.LEFT, padx=5)
         ttk.Button(process_frame, text="Загрузить в БД (поток)", 
                   command=self.load_to_db_threaded).pack(side=tk.LEFT, padx=5)
+        ttk.Button(process_frame, text="Разобрать и загрузить (конвейер)", 
+                  command=self.pipeline_load_threaded).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(process_frame, text="Режим:").pack(side=tk.LEFT, padx=(5, 0))
+        self.load_mode_var = tk.StringVar(value=self.app.db_service.LOAD_MODES['replace'])
+        ttk.Combobox(process_frame, textvariable=self.load_mode_var, state='readonly', width=20,
+                     values=list(self.app.db_service.LOAD_MODES.values())).pack(side=tk.LEFT, padx=5)
         ttk.Button(process_frame, text="Обновить статистику", 
                   command=self.update_stats).pack(side=tk.LEFT, padx=5)
+        self.follow_button = ttk.Button(process_frame, text="Следить за файлом", 
+                                        command=self.toggle_follow)
+        self.follow_button.pack(side=tk.LEFT, padx=5)
     
     def setup_viewing_section(self, parent, row):
         ttk.Label(parent, text="Просмотр данных", 
@@ -165,16 +201,10 @@ class DataManagementTab:
         self.status_label = ttk.Label(parent, text="Готов к работе", font=("Arial", 10))
         self.status_label.grid(row=row, column=0, columnspan=3, pady=10)
         
-        self.tree = ttk.Treeview(parent, show='headings')
-        self.tree.grid(row=row+1, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
-        
-        v_scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.tree.yview)
-        v_scrollbar.grid(row=row+1, column=2, sticky=(tk.N, tk.S), pady=5)
-        self.tree.configure(yscrollcommand=v_scrollbar.set)
-        
-        h_scrollbar = ttk.Scrollbar(parent, orient=tk.HORIZONTAL, command=self.tree.xview)
-        h_scrollbar.grid(row=row+2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
-        self.tree.configure(xscrollcommand=h_scrollbar.set)
+        # Таблица создает элементы только для видимых строк, скроллбары - внутри VirtualTreeview
+        self.table_view = VirtualTreeview(parent, column_width=100, run_in_thread=self.app.run_in_thread,
+                                          call_in_main=self.app.call_in_main, on_error=self.update_status)
+        self.table_view.frame.grid(row=row+1, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
         
         parent.rowconfigure(row+1, weight=1)
     
@@ -193,6 +223,11 @@ class DataManagementTab:
         self.progress_bar['value'] = progress
         self.progress_label.config(text=text)
     
+    def cancel_operations(self):
+        """Отмена операции под прогрессом: загрузки и экспорт откатывают неполный результат"""
+        self.app.cancel_progress_task()
+        self.update_progress_text("Отмена операции...")
+    
     def update_progress_text(self, text):
         """Обновить только текст прогресса"""
         self.progress_label.config(text=text)
@@ -205,27 +240,39 @@ class DataManagementTab:
     def connect_db(self):
         def task():
             success, message = self.app.db_service.db_manager.connect()
+            if success:
+                # Новое подключение - фоновый пересчет статистики перезапускается на нем
+                self.app.db_service.start_stats_worker()
             self.app.progress_queue.put(('complete', (success, message)))
         
-        self.app.run_in_thread(task)
+        self.app.run_in_thread(task, category='ingest')
         self.update_status("Подключение к базе данных...")
     
+    def apply_partitioning(self):
+        """Передача выбранного режима секционирования в DatabaseService"""
+        labels = {label: code for code, label in PacketPartitions.MODES.items()}
+        self.app.db_service.packet_partitioning = labels.get(self.partitioning_var.get(), 'none')
+    
     def create_tables(self):
+        self.apply_partitioning()
+        
         def task():
             success, message = self.app.db_service.create_tables()
             self.app.progress_queue.put(('complete', (success, message)))
         
-        self.app.run_in_thread(task)
+        self.app.run_in_thread(task, category='ingest')
         self.update_status("Создание таблиц...")
     
     def recreate_tables(self):
         if messagebox.askyesno("Подтверждение", 
                               "Это удалит все существующие данные и пересоздаст таблицы. Продолжить?"):
+            self.apply_partitioning()
+            
             def task():
                 success, message = self.app.db_service.drop_and_recreate_tables()
                 self.app.progress_queue.put(('complete', (success, message)))
             
-            self.app.run_in_thread(task)
+            self.app.run_in_thread(task, category='ingest')
             self.update_status("Пересоздание таблиц...")
     
     def show_database_info(self):
@@ -280,6 +327,125 @@ class DataManagementTab:
         self.app.run_in_thread(task)
         self.update_status("Получение списка таблиц...")
     
+    def show_index_status(self):
+        def task():
+            success, result = self.app.db_service.get_index_status()
+            if success:
+                message = "Индексы packet_data:\n\n"
+                for index in result:
+                    if index['exists']:
+                        usage = f"{index['size']}, использований: {index['scans']}" if index['size'] else "есть"
+                    else:
+                        usage = "отсутствует"
+                    message += f"• {index['name']}: {usage}\n    {index['purpose']}\n"
+                self.app.progress_queue.put(('complete', (True, message)))
+            else:
+                self.app.progress_queue.put(('complete', (False, result)))
+        
+        self.app.run_in_thread(task)
+        self.update_status("Получение состояния индексов...")
+    
+    def show_partitions(self):
+        """Окно секций packet_data с отсоединением и удалением старых секций"""
+        try:
+            success, result = self.app.db_service.get_packet_partitions()
+            if not success:
+                messagebox.showerror("Ошибка", result)
+                return
+            if result['mode'] == 'none':
+                messagebox.showinfo("Секции packet_data",
+                                    "Таблица packet_data не секционирована.\n\n"
+                                    "Выберите режим секционирования и создайте или пересоздайте таблицы")
+                return
+            
+            dialog = tk.Toplevel(self.frame)
+            dialog.title(f"Секции packet_data ({PacketPartitions.MODES[result['mode']].lower()})")
+            dialog.geometry("900x400")
+            dialog.transient(self.frame)
+            dialog.grab_set()
+            
+            tree = ttk.Treeview(dialog, columns=('name', 'bounds', 'rows', 'size'), show='headings')
+            tree.heading('name', text='Секция')
+            tree.heading('bounds', text='Границы')
+            tree.heading('rows', text='Строк (оценка)')
+            tree.heading('size', text='Размер')
+            
+            tree.column('name', width=200)
+            tree.column('bounds', width=450)
+            tree.column('rows', width=100)
+            tree.column('size', width=100)
+            tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+            
+            def refresh():
+                tree.delete(*tree.get_children())
+                success, result = self.app.db_service.get_packet_partitions()
+                if not success:
+                    messagebox.showerror("Ошибка", result, parent=dialog)
+                    return
+                for partition in result['partitions']:
+                    tree.insert('', tk.END, values=(
+                        partition['name'],
+                        partition['bounds'],
+                        partition['rows'],
+                        f"{partition['size'] / (1024 * 1024):.2f} MB"
+                    ))
+            
+            def run_action(action, question):
+                selection = tree.selection()
+                if not selection:
+                    messagebox.showwarning("Предупреждение", "Выберите секцию", parent=dialog)
+                    return
+                name = tree.item(selection[0], 'values')[0]
+                if not messagebox.askyesno("Подтверждение", question.format(name=name), parent=dialog):
+                    return
+                success, message = action(name)
+                if success:
+                    messagebox.showinfo("Секции packet_data", message, parent=dialog)
+                else:
+                    messagebox.showerror("Ошибка", message, parent=dialog)
+                refresh()
+            
+            def drop_old():
+                keep_days = simpledialog.askinteger("Удаление старых секций",
+                                                    "Оставить данные за последние N дней:",
+                                                    parent=dialog, minvalue=0, initialvalue=30)
+                if keep_days is None:
+                    return
+                success, message = self.app.db_service.drop_old_partitions(keep_days)
+                if success:
+                    messagebox.showinfo("Секции packet_data", message, parent=dialog)
+                else:
+                    messagebox.showerror("Ошибка", message, parent=dialog)
+                refresh()
+            
+            refresh()
+            
+            button_frame = ttk.Frame(dialog)
+            button_frame.pack(pady=10)
+            
+            ttk.Button(button_frame, text="Отсоединить",
+                      command=lambda: run_action(self.app.db_service.detach_packet_partition,
+                                                 "Отсоединить секцию {name}?\n\n"
+                                                 "Ее данные останутся в отдельной таблице")).pack(side=tk.LEFT, padx=5)
+            ttk.Button(button_frame, text="Удалить",
+                      command=lambda: run_action(self.app.db_service.drop_packet_partition,
+                                                 "Удалить секцию {name} вместе с данными?")).pack(side=tk.LEFT, padx=5)
+            ttk.Button(button_frame, text="Удалить старые...",
+                      command=drop_old).pack(side=tk.LEFT, padx=5)
+            ttk.Button(button_frame, text="Закрыть",
+                      command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+            
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось загрузить секции packet_data: {e}")
+    
+    def ensure_indexes(self):
+        def task():
+            success, message = self.app.db_service.ensure_indexes()
+            self.app.progress_queue.put(('complete', (success, message)))
+        
+        self.app.run_in_thread(task, category='maintenance')
+        self.update_status("Создание индексов...")
+    
     def clear_database(self):
         if not messagebox.askyesno("Подтверждение полной очистки", 
                                   "ВНИМАНИЕ: Это удалит ВСЕ данные из ВСЕХ таблиц!\n\n"
@@ -291,7 +457,7 @@ class DataManagementTab:
             success, message = self.app.db_service.clear_database()
             self.app.progress_queue.put(('complete', (success, message)))
         
-        self.app.run_in_thread(task)
+        self.app.run_in_thread(task, category='ingest')
         self.update_status("Полная очистка базы данных...")
     
     def clear_tables(self):
@@ -304,7 +470,7 @@ class DataManagementTab:
             success, message = self.app.db_service.clear_tables()
             self.app.progress_queue.put(('complete', (success, message)))
         
-        self.app.run_in_thread(task)
+        self.app.run_in_thread(task, category='ingest')
         self.update_status("Очистка таблиц...")
     
     def drop_tables(self):
@@ -317,31 +483,33 @@ class DataManagementTab:
             success, message = self.app.db_service.drop_tables()
             self.app.progress_queue.put(('complete', (success, message)))
         
-        self.app.run_in_thread(task)
+        self.app.run_in_thread(task, category='ingest')
         self.update_status("Удаление таблиц...")
 
     def create_sql_backup(self):
         """Создание SQL резервной копии"""
+        token = CancelToken()
+        
         def task():
-            self.show_progress()
-            self.update_progress_text("Создание SQL резервной копии...")
-            
-            success, message = self.app.db_service.create_sql_backup_manual()
+            success, message = self.app.db_service.create_sql_backup_manual(cancel_token=token)
             self.app.progress_queue.put(('complete', (success, message)))
         
-        self.app.run_in_thread(task)
+        self.show_progress()
+        self.update_progress_text("Создание SQL резервной копии...")
+        self.app.run_in_thread(task, category='maintenance', token=token, progress=True)
         self.update_status("Создание SQL резервной копии...")
     
     def auto_backup(self):
         """Автоматическое создание резервной копии"""
+        token = CancelToken()
+        
         def task():
-            self.show_progress()
-            self.update_progress_text("Автоматическое создание резервной копии...")
-            
-            success, message = self.app.db_service.auto_create_backup()
+            success, message = self.app.db_service.auto_create_backup(cancel_token=token)
             self.app.progress_queue.put(('complete', (success, message)))
         
-        self.app.run_in_thread(task)
+        self.show_progress()
+        self.update_progress_text("Автоматическое создание резервной копии...")
+        self.app.run_in_thread(task, category='maintenance', token=token, progress=True)
         self.update_status("Автоматическое создание резервной копии...")
     
     def show_backup_history(self):
@@ -403,13 +571,12 @@ class DataManagementTab:
         
         if backup_path:
             def task():
-                self.show_progress()
-                self.update_progress_text("Восстановление из резервной копии...")
-                
                 success, message = self.app.db_service.restore_from_sql_backup(backup_path)
                 self.app.progress_queue.put(('complete', (success, message)))
             
-            self.app.run_in_thread(task)
+            self.show_progress()
+            self.update_progress_text("Восстановление из резервной копии...")
+            self.app.run_in_thread(task, category='ingest', progress=True)
             self.update_status("Восстановление из резервной копии...")
     
     def open_backup_folder(self):
@@ -441,22 +608,26 @@ class DataManagementTab:
             messagebox.showerror("Ошибка", "Сначала выберите файл!")
             return
         
+        file_path = self.file_label.cget('text')
+        token = CancelToken()
+        
         def task():
-            self.show_progress()
-            self.update_progress_text("Начало разбора файла...")
-            
-            file_path = self.file_label.cget('text')
-            packets = self.app.file_parser.parse_log_file(file_path, progress_callback=self.app.update_progress)
+            # Пакеты хранятся в колоночном буфере; большие файлы разбираются параллельно.
+            # Отмена прерывает разбор исключением - задача завершается как отмененная
+            packets = self.app.file_parser.parse_log_file_batch(file_path, progress_callback=self.app.update_progress,
+                                                                cancel_token=token)
             
             if packets:
                 self.app.packets = packets
-                protocols = set(p['protocol'] for p in packets if p['protocol'])
+                protocols = packets.protocols()
                 message = f"Разбор завершен. Найдено {len(packets)} пакетов. Протоколы: {', '.join(protocols)}"
                 self.app.progress_queue.put(('complete', (True, message)))
             else:
                 self.app.progress_queue.put(('complete', (False, "Не удалось разобрать файл")))
         
-        self.app.run_in_thread(task)
+        self.show_progress()
+        self.update_progress_text("Начало разбора файла...")
+        self.app.run_in_thread(task, category='ingest', token=token, progress=True)
         self.update_status("Разбор файла...")
     
     def load_to_db_threaded(self):
@@ -464,18 +635,22 @@ class DataManagementTab:
             messagebox.showerror("Ошибка", "Сначала разберите файл!")
             return
         
+        load_mode = self._selected_load_mode()
+        source_file = self.file_label.cget('text')
+        token = CancelToken()
+        
         def task():
-            self.show_progress()
-            self.update_progress_text("Начало загрузки в БД...")
-            
             success, message = self.app.db_service.insert_packet_data(
                 self.app.packets, 
-                progress_callback=self.app.update_progress
+                progress_callback=self.app.update_progress,
+                load_mode=load_mode,
+                source_file=source_file,
+                cancel_token=token
             )
             
             if success:
                 # Автоматически создаем резервную копию после загрузки данных
-                self.app.db_service.auto_create_backup()
+                self.app.db_service.auto_create_backup(cancel_token=token)
                 
                 final_message = f"{message}\n\nАвтоматическая статистика включена!\n"
                 final_message += "Статистика автоматически сохраняется в файлы в папке C:\\Users\\Assa\\source\\repos\\network_stats"
@@ -483,14 +658,92 @@ class DataManagementTab:
             else:
                 self.app.progress_queue.put(('complete', (False, message)))
         
-        self.app.run_in_thread(task)
+        self.show_progress()
+        self.update_progress_text("Начало загрузки в БД...")
+        self.app.run_in_thread(task, category='ingest', token=token, progress=True)
         self.update_status("Загрузка данных в БД...")
     
-    def update_stats(self):
+    def toggle_follow(self):
+        """Включение/выключение слежения за дописываемым файлом лога"""
+        if self.follow_stop_event is not None:
+            self.follow_stop_event.set()
+            self.follow_stop_event = None
+            self.follow_button.config(text="Следить за файлом")
+            self.update_status("Слежение за файлом остановлено")
+            return
+        
+        if not self.file_label.cget('text') or self.file_label.cget('text') == "Файл не выбран":
+            messagebox.showerror("Ошибка", "Сначала выберите файл!")
+            return
+        
+        # Пакеты, которые уже есть в БД, повторно не вставляются
+        file_path = self.file_label.cget('text')
+        success, last_number = self.app.db_service.get_last_packet_number(source_file=file_path)
+        if not success:
+            messagebox.showerror("Ошибка", "Не удалось определить последний загруженный пакет")
+            return
+        
+        # Файл догружается с начала: пакеты до last_number уже в БД и пропускаются по номеру
+        follower = LogFollower(file_path, last_packet_number=last_number, offset=0)
+        stop_event = threading.Event()
+        # Захват текущего поколения файла: после ротации номера пакетов начинаются заново
+        capture = {'generation': 0, 'id': None}
+        
+        def on_batch(batch):
+            if follower.generation != capture['generation']:
+                success, capture_id = self.app.db_service.create_capture(file_path)
+                if not success:
+                    raise RuntimeError(capture_id)
+                capture.update(generation=follower.generation, id=capture_id)
+            success, message = self.app.db_service.append_packet_data(batch, source_file=file_path,
+                                                                      capture_id=capture['id'])
+            if not success:
+                raise RuntimeError(message)
+            self.app.progress_queue.put(('status', f"Слежение: {message}, последний пакет №{batch.numbers[-1]}"))
+        
+        def on_error(error):
+            self.app.progress_queue.put(('status', f"Ошибка слежения: {error}"))
+        
+        # Слежение работает отдельно от run_in_thread, чтобы не блокировать остальные операции
+        thread = threading.Thread(target=follower.follow, args=(on_batch, stop_event, on_error))
+        thread.daemon = True
+        thread.start()
+        
+        self.follow_stop_event = stop_event
+        self.follow_button.config(text="Остановить слежение")
+        self.update_status(f"Слежение за файлом: {file_path} (после пакета №{last_number})")
+    
+    def _selected_load_mode(self):
+        """Подпись режима в комбобоксе -> код режима загрузки"""
+        return next(mode for mode, label in self.app.db_service.LOAD_MODES.items()
+                    if label == self.load_mode_var.get())
+    
+    def pipeline_load_threaded(self):
+        if not self.file_label.cget('text') or self.file_label.cget('text') == "Файл не выбран":
+            messagebox.showerror("Ошибка", "Сначала выберите файл!")
+            return
+        
+        file_path = self.file_label.cget('text')
+        load_mode = self._selected_load_mode()
+        token = CancelToken()
+        
         def task():
-            self.show_progress()
-            self.update_progress_text("Обновление статистики...")
+            # Пакеты не накапливаются в app.packets: память ограничена глубиной очереди
+            pipeline = IngestPipeline(self.app.db_service)
+            success, message = pipeline.run(file_path, progress_callback=self.app.update_progress,
+                                            load_mode=load_mode, cancel_token=token)
             
+            if success:
+                self.app.db_service.auto_create_backup(cancel_token=token)
+            self.app.progress_queue.put(('complete', (success, message)))
+        
+        self.show_progress()
+        self.update_progress_text("Начало конвейерной загрузки...")
+        self.app.run_in_thread(task, category='ingest', token=token, progress=True)
+        self.update_status("Конвейерная загрузка файла в БД...")
+    
+    def update_stats(self):
+        def task():
             success_proto, message_proto = self.app.db_service.update_protocol_stats()
             success_ip, message_ip = self.app.db_service.update_ip_stats()
             
@@ -500,20 +753,42 @@ class DataManagementTab:
             else:
                 self.app.progress_queue.put(('complete', (False, f"Ошибка обновления статистики: {message_proto} {message_ip}")))
         
-        self.app.run_in_thread(task)
+        self.show_progress()
+        self.update_progress_text("Обновление статистики...")
+        self.app.run_in_thread(task, category='maintenance', progress=True)
         self.update_status("Обновление статистики...")
     
     def show_table(self, table_name):
-        columns, data = self.app.db_service.get_table_data(table_name)
+        """
+        Просмотр таблицы: запрос в рабочем потоке, строки выводит TreeFeeder
+        порциями по тикам главного цикла
+        """
+        feeder = TreeFeeder(self.app.root, self.table_view)
+        token = CancelToken()
         
-        self.tree.delete(*self.tree.get_children())
-        self.tree["columns"] = columns
-        
-        for col in columns:
-            self.tree.heading(col, text=col)
-            self.tree.column(col, width=100, minwidth=50, stretch=True)
-        
-        for row in data:
-            self.tree.insert("", tk.END, values=row)
-        
-        self.update_status(f"Отображена таблица: {table_name} (записей: {len(data)})")
\ No newline at end of file
+        def task():
+            if table_name == 'packet_data':
+                # Пакеты не загружаются целиком: таблица читает из PacketRange только видимое окно
+                success, result = self.app.db_service.open_packet_range(table_view=True, cancel_token=token)
+                if not success:
+                    # Отмененный запрос завершает задачу как отмененную, без окна ошибки
+                    token.raise_if_cancelled()
+                    self.app.progress_queue.put(('complete', (False, result)))
+                    return
+                feeder.set_source(result.columns, result)
+                count = len(result)
+            else:
+                columns, data = self.app.db_service.get_table_data(table_name)
+                feeder.set_source(columns)
+                feeder.put_rows(data)
+                count = len(data)
+            feeder.finish(self.app.progress_queue.put, ('hide_progress', None))
+            self.app.progress_queue.put(('status', f"Отображена таблица: {table_name} (записей: {count})"))
+        
+        self.show_progress()
+        self.update_progress_text(f"Загрузка таблицы {table_name}...")
+        # Вывод предыдущей таблицы прекращается, ее запрос дорабатывает впустую
+        if self.table_feeder is not None:
+            self.table_feeder.cancel()
+        self.table_feeder = feeder
+        feeder.start(self.app.run_in_thread(task, token=token, progress=True))
\ No newline at end of file
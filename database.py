@@ -1,5 +1,5 @@
 ﻿from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
 from sqlalchemy.pool import StaticPool
 import os
 import getpass
@@ -9,15 +9,18 @@ Base = declarative_base()
 
 class DatabaseManager:
     def __init__(self, host='localhost', database='network_monitor', 
-                 user='postgres', password=None, port=5432):
-        # Получаем пароль из переменных окружения или запрашиваем у пользователя
-        if password is None:
-            password = self.get_password()
-        
-        self.connection_string = f"postgresql://{user}:{password}@{host}:{port}/{database}"
+                 user='postgres', password=None, port=5432, url=None):
+        # Готовая строка подключения (например, sqlite:///bench.db для бенчмарков) заменяет параметры PostgreSQL
+        if url is not None:
+            self.connection_string = url
+        else:
+            # Получаем пароль из переменных окружения или запрашиваем у пользователя
+            if password is None:
+                password = self.get_password()
+            
+            self.connection_string = f"postgresql://{user}:{password}@{host}:{port}/{database}"
         self.engine = None
         self.SessionLocal = None
-        self.current_session = None
     
     def get_password(self):
         """
@@ -54,13 +57,20 @@ class DatabaseManager:
     
     def connect(self):
         try:
+            # Задачи GUI выполняются в нескольких рабочих потоках одновременно (TaskScheduler):
+            # у каждого потока своя сессия и свое соединение из пула.
+            # Только БД SQLite в памяти живет в единственном соединении (StaticPool)
+            engine_args = {}
+            if self.connection_string.startswith('sqlite'):
+                engine_args['connect_args'] = {'check_same_thread': False}
+                if self.connection_string in ('sqlite://', 'sqlite:///:memory:'):
+                    engine_args['poolclass'] = StaticPool
             self.engine = create_engine(
                 self.connection_string,
-                poolclass=StaticPool,
-                echo=False
+                echo=False,
+                **engine_args
             )
-            self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
-            self.current_session = self.SessionLocal()
+            self.SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=self.engine))
          
             with self.engine.connect() as conn:
                 pass
@@ -76,8 +86,8 @@ class DatabaseManager:
                 return False, f"Ошибка подключения: {e}"
     
     def disconnect(self):
-        if self.current_session:
-            self.current_session.close()
+        if self.SessionLocal:
+            self.SessionLocal.remove()
         if self.engine:
             self.engine.dispose()
     
@@ -96,6 +106,12 @@ class DatabaseManager:
             return False, f"Ошибка удаления таблиц: {e}"
     
     def get_session(self):
-        if not self.current_session:
+        """Сессия текущего потока: рабочие потоки не делят транзакцию и соединение"""
+        if not self.SessionLocal:
             self.connect()
-        return self.current_session
+        return self.SessionLocal()
+    
+    def release_session(self):
+        """Закрыть сессию текущего потока и вернуть соединение в пул (после задачи рабочего потока)"""
+        if self.SessionLocal:
+            self.SessionLocal.remove()
@@ -1,17 +1,107 @@
-﻿from sqlalchemy import text, func, and_, or_
+﻿from sqlalchemy import create_engine, text, func, and_, or_, inspect, cast, String, true, desc, select, tuple_
+from sqlalchemy.dialects.postgresql import INET
 from sqlalchemy.orm import Session
-from models.models import PacketData, ProtocolStats, IPStats
+from sqlalchemy.pool import NullPool
+from models.models import PacketData, ProtocolStats, IPStats, Capture, SchemaVersion, Protocol, StatsSketch
 from models.database import DatabaseManager
+from services.packet_batch import PacketBatch
+from services.bulk_loader import PacketBulkLoader
+from services.protocol_registry import ProtocolRegistry
+from services.packet_partitions import PacketPartitions
+from services.stats_engine import StatsEngine
+from services.stats_rollups import StatsRollups
+from services.stats_views import StatsViews
+from services.stats_worker import StatsWorker
+from services.sketches import PacketSketches
+from services.packet_range import PacketRange
+from services.task_scheduler import CancelToken, Task, TaskScheduler, check_cancelled, is_cancelled
 import re
-from typing import List, Tuple, Optional, Dict, Any
+import json
+import ipaddress
+from typing import Callable, List, Tuple, Optional, Dict, Any, Union, Iterable
 import os
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 import subprocess
 import shutil
+from functools import partial
+from contextlib import contextmanager
 
 class DatabaseService:
+    # Режимы загрузки пакетов: код -> подпись в интерфейсе.
+    # replace в PostgreSQL очищает packet_data через TRUNCATE в транзакции загрузки:
+    # блокировка ACCESS EXCLUSIVE держится до коммита, и все чтения packet_data
+    # (вкладки, StatsWorker, экспорт) ждут конца COPY. Для загрузки рядом с
+    # работающими читателями - append или upsert
+    LOAD_MODES = {
+        'replace': 'Замена',
+        'append': 'Добавление',
+        'upsert': 'Обновление (upsert)'
+    }
+    
+    # Версия схемы БД: номер -> описание миграции (migrate_schema)
+    SCHEMA_VERSION = 6
+    SCHEMA_MIGRATIONS = {
+        1: 'захваты (captures) и ключ (capture_id, packet_number)',
+        2: 'INET для адресов, TIMESTAMPTZ для времени пакета, проверка диапазона портов',
+        3: 'справочник протоколов (protocols) и packet_data.protocol_id',
+        4: 'уникальные ключи и BIGINT-счетчики сводок protocol_stats и ip_stats',
+        5: 'триггер статистики только уведомляет StatsWorker (NOTIFY) вместо пересчета',
+        6: 'материализованное представление packet_stats_mv для панели статистики'
+    }
+    
+    # Индексы packet_data под запросы вкладки фильтров и статистики:
+    # имя -> (метод, столбцы, для каких запросов). BRIN и GIN создаются только в PostgreSQL
+    PACKET_INDEXES = {
+        'ix_packet_data_protocol_size': ('btree', '(protocol_id, packet_size)',
+                                         "протокол равно/в списке, вместе с условием на размер"),
+        'ix_packet_data_source_ip': ('btree', '(source_ip)',
+                                     "исходный IP равно/в подсети, группировка по источникам"),
+        'ix_packet_data_destination_ip': ('btree', '(destination_ip)',
+                                          "целевой IP равно/в подсети, группировка по получателям"),
+        'ix_packet_data_source_port': ('btree', '(source_port)', "условия на исходный порт"),
+        'ix_packet_data_destination_port': ('btree', '(destination_port)', "условия на целевой порт"),
+        'ix_packet_data_packet_size': ('btree', '(packet_size)', "размер больше/меньше/между"),
+        'ix_packet_data_number_id': ('btree', '(packet_number, id)',
+                                     "страницы по ключу (packet_number, id) и окна PacketRange без сортировки"),
+        # Строки пишутся в порядке захвата, поэтому BRIN по времени в сотни раз меньше B-tree
+        'brin_packet_data_timestamp': ('brin', '(timestamp)', "диапазоны времени"),
+        'trgm_packet_data_source_host': ('gin', '(host(source_ip) gin_trgm_ops)',
+                                         "исходный IP содержит/начинается с/заканчивается на"),
+        'trgm_packet_data_destination_host': ('gin', '(host(destination_ip) gin_trgm_ops)',
+                                              "целевой IP содержит/начинается с/заканчивается на")
+    }
+    
+    # Колонки выборок пакетов для вкладок фильтров и экспорта
+    PACKET_COLUMNS = ['номер_пакета', 'время', 'исходный_ip', 'целевой_ip',
+                      'исходный_порт', 'целевой_порт', 'размер', 'протокол']
+    
+    # Строк в порции потоковой выборки (stream_filtered_data)
+    STREAM_BATCH_ROWS = 10000
+    
+    # Строк в порции чтения страницы get_filtered_page, которая передается в on_rows
+    PAGE_BATCH_ROWS = 1000
+    
+    # Шаг якорей PacketRange: чтение окна пропускает не больше стольких строк
+    RANGE_ANCHOR_ROWS = 1000
+    
     def __init__(self, db_manager: DatabaseManager):
         self.db_manager = db_manager
+        # Секционирование packet_data при создании таблиц (PacketPartitions.MODES)
+        self.packet_partitioning = 'none'
+        # Кэш справочника протоколов для загрузки: сбрасывается при откате и очистке таблиц
+        self.protocol_registry = ProtocolRegistry()
+        # Последний снимок StatsEngine: общий для автосохранения, экспорта и вкладки экспорта,
+        # сбрасывается операциями, которые меняют packet_data
+        self.stats_snapshot = None
+        # Фоновый пересчет снимка (start_stats_worker); без него снимок считается сразу после загрузки
+        self.stats_worker = None
+        # Приблизительная сводка по эскизам PacketSketches (set_approximate_stats)
+        self.approximate_stats = False
+        # Планировщик GUI: недостающие эскизы пересчитываются его задачей 'maintenance'
+        self.scheduler: Optional[TaskScheduler] = None
+        self._sketch_task: Optional[Task] = None
+        self._sketch_lock = threading.Lock()
         # Автоматически создаем директорию для статистики
         self.stats_dir = 'C:\\Users\\Assa\\source\\repos\\network_stats'
         self.backup_dir = 'C:\\Users\\Assa\\source\\repos\\db_backups'
@@ -22,9 +112,110 @@ class DatabaseService:
         return self.db_manager.get_session()
     
     def create_tables(self) -> Tuple[bool, str]:
-        return self.db_manager.create_tables()
+        # create_all не меняет существующие таблицы - их схема обновляется миграциями,
+        # а секционирование packet_data включается переносом данных в новую таблицу
+        try:
+            existing_tables = inspect(self.db_manager.engine).has_table(PacketData.__tablename__)
+        except Exception:
+            existing_tables = False
+        
+        if not existing_tables and self.packet_partitioning != 'none':
+            success, message = self._create_partitioned_packet_data()
+            if not success:
+                return success, message
+        
+        success, message = self.db_manager.create_tables()
+        if not success:
+            return success, message
+        
+        if existing_tables:
+            success_migrate, message_migrate = self.migrate_schema()
+            if success_migrate and self.packet_partitioning != 'none':
+                success_migrate, message_partition = self._convert_packet_data()
+                if message_partition:
+                    message += f". {message_partition}"
+        else:
+            success_migrate, message_migrate = self._set_schema_version(self.SCHEMA_VERSION)
+            if success_migrate:
+                success_migrate, message_migrate = self.create_stats_views()
+        if not success_migrate:
+            return False, message_migrate if message_migrate else message
+        return success, message
+    
+    def _create_partitioned_packet_data(self) -> Tuple[bool, str]:
+        """Создание packet_data с секционированием packet_partitioning вместо create_all"""
+        try:
+            session = self.get_session()
+            if not self._is_postgresql(session):
+                print("Секционирование доступно только в PostgreSQL - packet_data создается без секций")
+                return True, ""
+            
+            # Таблицы, на которые ссылается packet_data, создаются раньше нее
+            connection = session.connection()
+            Capture.__table__.create(bind=connection, checkfirst=True)
+            Protocol.__table__.create(bind=connection, checkfirst=True)
+            PacketPartitions(session).create_table(self.packet_partitioning)
+            session.commit()
+            return True, ""
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка создания секционированной таблицы packet_data: {e}"
+        finally:
+            session.close()
+    
+    def _convert_packet_data(self) -> Tuple[bool, str]:
+        """Перевод существующей packet_data на секционирование packet_partitioning"""
+        mode = self.packet_partitioning
+        try:
+            session = self.get_session()
+            if not self._is_postgresql(session):
+                return True, ""
+            
+            partitions = PacketPartitions(session)
+            if partitions.mode == mode:
+                return True, ""
+            if partitions.enabled:
+                return True, (f"packet_data уже секционирована ({PacketPartitions.MODES[partitions.mode].lower()}), "
+                              f"для смены режима пересоздайте таблицы")
+            
+            existing_indexes = {index['name'] for index in inspect(session.connection()).get_indexes(PacketData.__tablename__)}
+            trigger_installed = session.execute(text(
+                "SELECT 1 FROM pg_trigger WHERE tgname = 'auto_update_stats_trigger'")).first() is not None
+            
+            print(f"Перенос packet_data в секционированную таблицу: {PacketPartitions.MODES[mode].lower()}")
+            # Представление статистики ссылается на переименовываемую таблицу - строим его заново
+            views = StatsViews(session)
+            views_installed = views.exists()
+            if views_installed:
+                views.drop()
+            partitions.convert(mode)
+            if views_installed:
+                views.create()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка секционирования packet_data: {e}"
+        finally:
+            session.close()
+        
+        # Индексы и триггер остались на удаленной таблице - создаем их заново
+        if existing_indexes & set(self.PACKET_INDEXES):
+            success, message = self.ensure_indexes()
+            if not success:
+                return False, message
+        if trigger_installed:
+            success, message = self.setup_auto_stats_trigger()
+            if not success:
+                return False, message
+        return True, f"packet_data секционирована: {PacketPartitions.MODES[mode].lower()}"
     
     def drop_tables(self) -> Tuple[bool, str]:
+        self.protocol_registry.clear()
+        self.stats_snapshot = None
+        # drop_all не знает о материализованном представлении, а оно не дает удалить packet_data
+        success, message = self.drop_stats_views()
+        if not success:
+            return False, message
         return self.db_manager.drop_tables()
     
     def drop_and_recreate_tables(self) -> Tuple[bool, str]:
@@ -37,14 +228,13 @@ class DatabaseService:
         try:
             session = self.get_session()
             
-            session.query(IPStats).delete()
-            session.query(ProtocolStats).delete()
-            session.query(PacketData).delete()
+            self._truncate_packet_data(session, PacketPartitions(session), reference_tables=True)
             
             session.commit()
+            self.protocol_registry.clear()
             
             # Автоматически создаем статистику после очистки
-            self.auto_save_stats()
+            self._stats_changed()
             
             return True, "Все таблицы успешно очищены"
         except Exception as e:
@@ -79,9 +269,10 @@ class DatabaseService:
             session.execute(text("SET session_replication_role = DEFAULT;"))
             
             session.commit()
+            self.protocol_registry.clear()
             
             # Автоматически создаем статистику после очистки
-            self.auto_save_stats()
+            self._stats_changed()
             
             return True, f"База данных полностью очищена. Затронуто таблиц: {len(tables)}"
         except Exception as e:
@@ -90,10 +281,11 @@ class DatabaseService:
         finally:
             session.close()
     
-    def auto_save_stats(self):
-        """Автоматическое сохранение статистики в TXT файл"""
+    def auto_save_stats(self, stats: Optional[dict] = None):
+        """Автоматическое сохранение статистики (готового снимка или текущей) в TXT файл"""
         try:
-            stats = self.get_stats_summary()
+            if stats is None:
+                stats = self.get_stats_summary()
             if 'error' not in stats:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 filename = f"auto_stats_{timestamp}.txt"
@@ -111,6 +303,93 @@ class DatabaseService:
             print(f"Ошибка автоматического сохранения статистики: {e}")
             return False, str(e)
     
+    def _stats_changed(self, auto_save: bool = True):
+        """
+        Реакция на изменение packet_data: снимок сбрасывается, при запущенном
+        StatsWorker обновление представления и пересчет откладываются ему,
+        иначе (auto_save) представление обновляется и файл статистики сохраняется сразу
+        """
+        self.stats_snapshot = None
+        if self.stats_worker is not None:
+            self.stats_worker.mark_dirty()
+        elif auto_save:
+            success, message = self.refresh_stats_views()
+            if not success:
+                print(message)
+            self.auto_save_stats()
+    
+    def create_stats_views(self) -> Tuple[bool, str]:
+        """Создание материализованного представления статистики StatsViews (только PostgreSQL)"""
+        try:
+            session = self.get_session()
+            if not self._is_postgresql(session):
+                return True, "Представления статистики доступны только в PostgreSQL"
+            StatsViews(session).create()
+            session.commit()
+            self.stats_snapshot = None
+            return True, f"Представление статистики {StatsViews.NAME} создано"
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка создания представления статистики: {e}"
+        finally:
+            session.close()
+    
+    def refresh_stats_views(self) -> Tuple[bool, str]:
+        """Обновление представления статистики без блокировки читателей (CONCURRENTLY)"""
+        try:
+            session = self.get_session()
+            if not self._is_postgresql(session):
+                return True, ""
+            views = StatsViews(session)
+            if not views.exists():
+                return True, ""
+            views.refresh()
+            session.commit()
+            self.stats_snapshot = None
+            return True, f"Представление статистики {StatsViews.NAME} обновлено"
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка обновления представления статистики: {e}"
+        finally:
+            session.close()
+    
+    def drop_stats_views(self) -> Tuple[bool, str]:
+        """Удаление представления статистики - сводка снова считается проходом по packet_data"""
+        try:
+            session = self.get_session()
+            if not self._is_postgresql(session):
+                return True, ""
+            StatsViews(session).drop()
+            session.commit()
+            self.stats_snapshot = None
+            return True, f"Представление статистики {StatsViews.NAME} удалено"
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка удаления представления статистики: {e}"
+        finally:
+            session.close()
+    
+    def start_stats_worker(self, interval: float = StatsWorker.INTERVAL) -> Tuple[bool, str]:
+        """Запуск фонового пересчета статистики не чаще раза в interval секунд"""
+        if self.db_manager.engine is None:
+            return False, "Нет подключения к базе данных"
+        self.stop_stats_worker()
+        self.stats_worker = StatsWorker(self.db_manager.engine, self._on_stats_snapshot, interval)
+        self.stats_worker.start()
+        return True, f"Фоновый пересчет статистики: не чаще раза в {interval:g} с"
+    
+    def stop_stats_worker(self):
+        if self.stats_worker is not None:
+            self.stats_worker.stop()
+            self.stats_worker = None
+    
+    def _on_stats_snapshot(self, stats: dict):
+        """Снимок из StatsWorker: кэшируется, если за время пересчета данные не менялись"""
+        worker = self.stats_worker
+        if worker is not None and not worker.dirty and not self.approximate_stats:
+            self.stats_snapshot = stats
+        self.auto_save_stats(stats)
+    
     def _format_stats_for_file(self, stats: dict) -> str:
         """Форматирование статистики для сохранения в файл"""
         stats_text = "АВТОМАТИЧЕСКАЯ СТАТИСТИКА СЕТЕВЫХ ДАННЫХ\n"
@@ -120,6 +399,8 @@ class DatabaseService:
         stats_text += f"Уникальных протоколов: {stats.get('unique_protocols', 0)}\n"
         stats_text += f"Уникальных IP-адресов: {stats.get('unique_ips', 0)}\n"
         stats_text += f"Общий объем трафика: {stats.get('total_traffic', 0):,} байт\n\n"
+        if stats.get('approximate'):
+            stats_text += "Значения приблизительные: оценки эскизов HyperLogLog и Space-Saving\n\n"
         
         stats_text += "ТОП-5 ПРОТОКОЛОВ:\n"
         stats_text += "-" * 40 + "\n"
@@ -206,11 +487,9 @@ class DatabaseService:
     def get_available_protocols(self) -> Tuple[bool, List[str]]:
         try:
             session = self.get_session()
-            protocols = session.query(PacketData.protocol).filter(
-                PacketData.protocol.isnot(None),
-                PacketData.protocol != '',
-                PacketData.protocol != '-'
-            ).distinct().order_by(PacketData.protocol).all()
+            # Справочник мал: для каждого протокола достаточно одной проверки по индексу protocol_id
+            used = session.query(PacketData.id).filter(PacketData.protocol_id == Protocol.id).exists()
+            protocols = session.query(Protocol.name).filter(used).order_by(Protocol.name).all()
             
             return True, [p[0] for p in protocols]
         except Exception as e:
@@ -220,21 +499,15 @@ class DatabaseService:
         try:
             session = self.get_session()
             
-            source_ips = session.query(PacketData.source_ip).filter(
-                PacketData.source_ip.isnot(None),
-                PacketData.source_ip != '',
-                PacketData.source_ip != '-'
-            ).distinct()
-            
-            dest_ips = session.query(PacketData.destination_ip).filter(
-                PacketData.destination_ip.isnot(None),
-                PacketData.destination_ip != '',
-                PacketData.destination_ip != '-'
-            ).distinct()
-            
-            # Combine and sort
-            all_ips = set([ip[0] for ip in source_ips] + [ip[0] for ip in dest_ips])
-            sorted_ips = sorted(list(all_ips))
+            if self._is_postgresql(session):
+                # Сводка ip_stats ведется при загрузке и уже содержит все адреса источников и получателей
+                ips = session.execute(text(
+                    'SELECT ip_address FROM ip_stats GROUP BY ip_address ORDER BY ip_address COLLATE "C"'))
+            else:
+                ips = session.query(PacketData.source_ip).filter(PacketData.source_ip.isnot(None)).union(
+                    session.query(PacketData.destination_ip).filter(PacketData.destination_ip.isnot(None))
+                ).order_by(PacketData.source_ip)
+            sorted_ips = [str(row[0]) for row in ips]
             
             return True, sorted_ips
         except Exception as e:
@@ -249,72 +522,7 @@ class DatabaseService:
         try:
             session = self.get_session()
             
-            query = session.query(
-                PacketData.packet_number.label('номер_пакета'),
-                PacketData.timestamp.label('время'),
-                PacketData.source_ip.label('исходный_ip'),
-                PacketData.destination_ip.label('целевой_ip'),
-                PacketData.source_port.label('исходный_порт'),
-                PacketData.destination_port.label('целевой_порт'),
-                PacketData.packet_size.label('размер'),
-                PacketData.protocol.label('протокол')
-            )
-            
-            # Apply filters
-            for field, condition, value in filters:
-                if value is not None and value != '':
-                    model_field = getattr(PacketData, field)
-                    
-                    if condition == 'равно':
-                        query = query.filter(model_field == value)
-                    elif condition == 'содержит':
-                        query = query.filter(model_field.ilike(f'%{value}%'))
-                    elif condition == 'больше':
-                        try:
-                            numeric_value = float(value)
-                            query = query.filter(model_field > numeric_value)
-                        except ValueError:
-                            # Если не число, сравниваем как строку
-                            query = query.filter(model_field > value)
-                    elif condition == 'меньше':
-                        try:
-                            numeric_value = float(value)
-                            query = query.filter(model_field < numeric_value)
-                        except ValueError:
-                            query = query.filter(model_field < value)
-                    elif condition == 'больше или равно':
-                        try:
-                            numeric_value = float(value)
-                            query = query.filter(model_field >= numeric_value)
-                        except ValueError:
-                            query = query.filter(model_field >= value)
-                    elif condition == 'меньше или равно':
-                        try:
-                            numeric_value = float(value)
-                            query = query.filter(model_field <= numeric_value)
-                        except ValueError:
-                            query = query.filter(model_field <= value)
-                    elif condition == 'не равно':
-                        query = query.filter(model_field != value)
-                    elif condition == 'в списке':
-                        values_list = [v.strip() for v in value.split(',')]
-                        query = query.filter(model_field.in_(values_list))
-                    elif condition == 'между':
-                        range_values = [v.strip() for v in value.split(',')]
-                        if len(range_values) == 2:
-                            try:
-                                start_val = float(range_values[0])
-                                end_val = float(range_values[1])
-                                query = query.filter(model_field.between(start_val, end_val))
-                            except ValueError:
-                                query = query.filter(model_field.between(range_values[0], range_values[1]))
-                    elif condition == 'начинается с':
-                        query = query.filter(model_field.ilike(f'{value}%'))
-                    elif condition == 'заканчивается на':
-                        query = query.filter(model_field.ilike(f'%{value}'))
-            
-            # Apply ordering
-            query = query.order_by(PacketData.packet_number)
+            query = self._build_filtered_query(session, filters)
             
             # ИЗМЕНЕНИЕ: Убрано ограничение по умолчанию в 1000 записей
             # Применяем лимит и оффсет только если они указаны
@@ -324,37 +532,350 @@ class DatabaseService:
             
             # Execute query
             data = query.all()
-            columns = ['номер_пакета', 'время', 'исходный_ip', 'целевой_ip', 
-                      'исходный_порт', 'целевой_порт', 'размер', 'протокол']
             
-            return True, (columns, data, str(query), [])
+            return True, (list(self.PACKET_COLUMNS), data, str(query), [])
+            
+        except Exception as e:
+            return False, f"Ошибка выполнения фильтрованного запроса: {e}"
+    
+    def get_filtered_page(self, filters: List[Tuple[str, str, str]], limit_records: int,
+                          after: Optional[Tuple[int, int]] = None, before: Optional[Tuple[int, int]] = None,
+                          offset: int = 0, cancel_token: Optional[CancelToken] = None,
+                          on_rows: Optional[Callable[[List[tuple]], None]] = None) -> Tuple[bool, Any]:
+        """
+        Страница отфильтрованных данных по ключу (keyset) вместо OFFSET.
+        after/before - курсоры (packet_number, id) последней или первой строки соседней
+        страницы: следующая страница - строки с ключом больше after, предыдущая - меньше
+        before. Чтение начинается по индексу packet_number прямо с курсора, поэтому
+        далекая страница загружается так же быстро, как первая. Без курсора страница
+        начинается с offset (переход к произвольной позиции).
+        Возвращает (columns, data, sql, params, cursors): cursors - словарь с ключами
+        first/last (курсоры первой и последней строки) и has_prev/has_next.
+        on_rows(rows) получает строки страницы порциями PAGE_BATCH_ROWS по мере чтения -
+        таблица выводит их, не дожидаясь конца запроса.
+        Отмена cancel_token прерывает выполняющийся запрос (_interrupt_on_cancel)
+        """
+        session = None
+        try:
+            session = self.get_session()
+            
+            query = self._build_filtered_query(session, filters).add_columns(PacketData.id)
+            has_prev = after is not None or offset > 0
+            with self._interrupt_on_cancel(session, cancel_token):
+                if after is not None:
+                    query = self._seek_filter(query, after, '>')
+                elif before is not None:
+                    # Предыдущая страница тоже читается по возрастанию ключа, в порядке вывода:
+                    # ее первая строка - limit_records-я назад от курсора, строка перед ней - признак has_prev
+                    keys = self._seek_filter(self._build_filtered_query(session, filters), before, '<').order_by(None).order_by(
+                        PacketData.packet_number.desc(), PacketData.id.desc()
+                    ).with_entities(PacketData.packet_number, PacketData.id).offset(limit_records - 1).limit(2).all()
+                    has_prev = len(keys) > 1
+                    query = self._seek_filter(query, before, '<')
+                    if keys:
+                        query = self._seek_filter(query, tuple(keys[0]), '>=')
+                elif offset:
+                    query = query.offset(offset)
+                
+                # Лишняя строка показывает, есть ли данные после страницы
+                result = session.execute(query.limit(limit_records + 1).statement.execution_options(
+                    yield_per=self.PAGE_BATCH_ROWS))
+                data, first, last, fetched = [], None, None, 0
+                for partition in result.partitions():
+                    fetched += len(partition)
+                    rows = partition[:limit_records - len(data)]
+                    if not rows:
+                        continue
+                    first = first or (rows[0][0], rows[0][-1])
+                    last = (rows[-1][0], rows[-1][-1])
+                    rows = [tuple(row[:-1]) for row in rows]
+                    data.extend(rows)
+                    if on_rows is not None:
+                        on_rows(rows)
+            
+            cursors = {
+                'first': first,
+                'last': last,
+                'has_prev': has_prev,
+                'has_next': True if before is not None else fetched > limit_records
+            }
+            
+            return True, (list(self.PACKET_COLUMNS), data, str(query), [], cursors)
             
         except Exception as e:
+            if is_cancelled(cancel_token):
+                session.rollback()
+                return False, "Запрос отменен"
             return False, f"Ошибка выполнения фильтрованного запроса: {e}"
     
+    @staticmethod
+    def _seek_filter(query, key: Tuple[int, int], op: str):
+        """
+        Условие keyset (packet_number, id) op key. Условие только на packet_number
+        дублирует сравнение ключей: по нему поиск начинается в индексе
+        ix_packet_data_number_id, который сразу отдает строки в порядке ключа
+        """
+        packet_key = tuple_(PacketData.packet_number, PacketData.id)
+        if op == '<':
+            return query.filter(PacketData.packet_number <= key[0], packet_key < tuple_(*key))
+        condition = packet_key >= tuple_(*key) if op == '>=' else packet_key > tuple_(*key)
+        return query.filter(PacketData.packet_number >= key[0], condition)
+    
+    def open_packet_range(self, filters: Optional[List[Tuple[str, str, str]]] = None, table_view: bool = False,
+                          step: int = RANGE_ANCHOR_ROWS, cancel_token: Optional[CancelToken] = None) -> Tuple[bool, Any]:
+        """
+        Выборка с фильтрами для просмотра по позиции (PacketRange). При открытии
+        выполняется только count(*): ключи каждой step-й строки (якоря) PacketRange
+        запоминает по ходу чтения окон. table_view - все столбцы packet_data
+        (просмотр таблицы), иначе колонки PACKET_COLUMNS вкладки фильтров.
+        Подсчет строк большой выборки прерывается отменой cancel_token
+        """
+        session = None
+        try:
+            session = self.get_session()
+            filters = filters or []
+            
+            with self._interrupt_on_cancel(session, cancel_token):
+                total = self._build_filtered_query(session, filters).order_by(None).count()
+            
+            columns = self.get_available_fields() if table_view else list(self.PACKET_COLUMNS)
+            sql = str(self._range_query(session, filters, table_view))
+            return True, PacketRange(partial(self._packet_range_rows, filters, table_view),
+                                     columns, total, step, sql)
+            
+        except Exception as e:
+            if is_cancelled(cancel_token):
+                session.rollback()
+                return False, "Запрос отменен"
+            return False, f"Ошибка открытия выборки: {e}"
+    
+    def _range_query(self, session: Session, filters: List[Tuple[str, str, str]], table_view: bool):
+        base = self._packet_table_query(session) if table_view else None
+        return self._build_filtered_query(session, filters, base)
+    
+    def _packet_range_rows(self, filters: List[Tuple[str, str, str]], table_view: bool,
+                           anchor: Optional[Tuple[int, int]], skip: int, count: int) -> List[Tuple[Tuple[int, int], tuple]]:
+        """
+        Строки PacketRange: count строк после пропуска skip строк от ключа anchor
+        (None - от начала выборки) вместе с их ключами (packet_number, id)
+        """
+        session = self.get_session()
+        query = self._range_query(session, filters, table_view).add_columns(PacketData.packet_number, PacketData.id)
+        if anchor is not None:
+            query = self._seek_filter(query, anchor, '>=')
+        return [(tuple(row[-2:]), tuple(row[:-2])) for row in query.offset(skip).limit(count)]
+    
+    def stream_filtered_data(self, filters: List[Tuple[str, str, str]],
+                             batch_size: int = STREAM_BATCH_ROWS) -> Tuple[bool, Any]:
+        """
+        Потоковая выборка отфильтрованных данных: (columns, batches), где batches -
+        итератор списков строк по batch_size. В памяти одновременно только одна порция:
+        в PostgreSQL строки читаются именованным (серверным) курсором на отдельном
+        соединении, и коммиты сессии потока во время чтения его не закрывают.
+        Итератор нужно дочитать или закрыть (batches.close()), чтобы освободить соединение
+        """
+        session = None
+        try:
+            session = self._stream_session()
+            query = self._build_filtered_query(session, filters)
+            result = session.execute(query.statement.execution_options(yield_per=batch_size))
+            return True, (list(self.PACKET_COLUMNS), self._stream_batches(session, result))
+        except Exception as e:
+            if session is not None:
+                self._close_stream_session(session)
+            return False, f"Ошибка потоковой выборки: {e}"
+    
+    def stream_all_data(self, batch_size: int = STREAM_BATCH_ROWS) -> Tuple[bool, Any]:
+        """Потоковая выборка всех пакетов (см. stream_filtered_data)"""
+        return self.stream_filtered_data([], batch_size)
+    
+    @contextmanager
+    def _interrupt_on_cancel(self, session: Session, cancel_token: Optional[CancelToken]):
+        """
+        Пока выполняется блок, отмена cancel_token прерывает текущую команду
+        соединения сессии из потока, вызвавшего отмену: psycopg2 отправляет серверу
+        запрос отмены (то же, что pg_cancel_backend для процесса соединения),
+        sqlite3 - interrupt(). Прерванная команда завершается ошибкой драйвера,
+        транзакцию откатывает вызывающий код. Уже отмененный токен - TaskCancelled сразу
+        """
+        if cancel_token is None:
+            yield
+            return
+        check_cancelled(cancel_token)
+        dbapi_connection = session.connection().connection.dbapi_connection
+        interrupt = getattr(dbapi_connection, 'cancel', None) or getattr(dbapi_connection, 'interrupt', None)
+        if interrupt is None:
+            yield
+            return
+        cancel_token.add_callback(interrupt)
+        try:
+            yield
+        finally:
+            cancel_token.remove_callback(interrupt)
+    
+    def _stream_session(self) -> Session:
+        """
+        Сессия потоковой выборки. В PostgreSQL - на собственном соединении (NullPool):
+        серверный курсор живет до конца транзакции, а сессию потока в это время
+        коммитят другие методы сервиса. В SQLite курсор и так читает строки
+        по мере выборки, используется сессия потока
+        """
+        engine = self.db_manager.engine
+        if engine.dialect.name != 'postgresql':
+            return self.get_session()
+        return Session(bind=create_engine(engine.url, poolclass=NullPool))
+    
+    def _close_stream_session(self, session: Session):
+        bind = session.get_bind()
+        if bind is self.db_manager.engine:
+            return
+        session.close()
+        bind.dispose()
+    
+    def _stream_batches(self, session: Session, result):
+        try:
+            for partition in result.partitions():
+                yield partition
+        finally:
+            result.close()
+            self._close_stream_session(session)
+    
+    def _packet_table_query(self, session: Session):
+        """Все столбцы packet_data в порядке get_available_fields: protocol_id заменен названием протокола"""
+        return session.query(*[Protocol.name.label('protocol') if column.name == 'protocol_id' else column
+                               for column in PacketData.__table__.columns]
+                             ).outerjoin(Protocol, PacketData.protocol_id == Protocol.id)
+    
+    def _packet_rows_query(self, session: Session):
+        """Строки packet_data с названием протокола в колонках PACKET_COLUMNS, без сортировки"""
+        return session.query(
+            PacketData.packet_number.label('номер_пакета'),
+            PacketData.timestamp.label('время'),
+            PacketData.source_ip.label('исходный_ip'),
+            PacketData.destination_ip.label('целевой_ip'),
+            PacketData.source_port.label('исходный_порт'),
+            PacketData.destination_port.label('целевой_порт'),
+            PacketData.packet_size.label('размер'),
+            Protocol.name.label('протокол')
+        ).outerjoin(Protocol, PacketData.protocol_id == Protocol.id)
+    
+    def _build_filtered_query(self, session: Session, filters: List[Tuple[str, str, str]], query=None):
+        """
+        Запрос packet_data с условиями фильтров вкладки фильтров, упорядоченный по номеру пакета.
+        query - столбцы выборки (по умолчанию _packet_rows_query)
+        """
+        if query is None:
+            query = self._packet_rows_query(session)
+        
+        # Apply filters
+        for field, condition, value in filters:
+            if value is not None and value != '':
+                # Протокол хранится id из справочника - фильтр идет по названию в protocols
+                model_field = Protocol.name if field == 'protocol' else getattr(PacketData, field)
+                # Вкладка фильтров использует подписи 'больше чем' и 'меньше чем'
+                condition = {'больше чем': 'больше', 'меньше чем': 'меньше'}.get(condition, condition)
+                
+                if condition == 'равно':
+                    query = query.filter(model_field == value)
+                elif condition == 'содержит':
+                    query = query.filter(self._text_expression(session, model_field).ilike(f'%{value}%'))
+                elif condition == 'больше':
+                    try:
+                        numeric_value = self._filter_number(value)
+                        query = query.filter(model_field > numeric_value)
+                    except ValueError:
+                        # Если не число, сравниваем как строку
+                        query = query.filter(model_field > value)
+                elif condition == 'меньше':
+                    try:
+                        numeric_value = self._filter_number(value)
+                        query = query.filter(model_field < numeric_value)
+                    except ValueError:
+                        query = query.filter(model_field < value)
+                elif condition == 'больше или равно':
+                    try:
+                        numeric_value = self._filter_number(value)
+                        query = query.filter(model_field >= numeric_value)
+                    except ValueError:
+                        query = query.filter(model_field >= value)
+                elif condition == 'меньше или равно':
+                    try:
+                        numeric_value = self._filter_number(value)
+                        query = query.filter(model_field <= numeric_value)
+                    except ValueError:
+                        query = query.filter(model_field <= value)
+                elif condition == 'не равно':
+                    query = query.filter(model_field != value)
+                elif condition == 'в списке':
+                    values_list = [v.strip() for v in value.split(',')]
+                    query = query.filter(model_field.in_(values_list))
+                elif condition == 'между':
+                    range_values = [v.strip() for v in value.split(',')]
+                    if len(range_values) == 2:
+                        try:
+                            start_val = self._filter_number(range_values[0])
+                            end_val = self._filter_number(range_values[1])
+                            query = query.filter(model_field.between(start_val, end_val))
+                        except ValueError:
+                            query = query.filter(model_field.between(range_values[0], range_values[1]))
+                elif condition == 'начинается с':
+                    query = query.filter(self._text_expression(session, model_field).ilike(f'{value}%'))
+                elif condition == 'заканчивается на':
+                    query = query.filter(self._text_expression(session, model_field).ilike(f'%{value}'))
+                elif condition == 'в подсети':
+                    query = query.filter(self._subnet_condition(session, model_field, value))
+        
+        # Apply ordering: id различает пакеты с одним номером из разных захватов
+        return query.order_by(PacketData.packet_number, PacketData.id)
+    
+    @staticmethod
+    def _filter_number(value: str):
+        """
+        Число из значения фильтра. Целые передаются как int: сравнение integer-столбца
+        с numeric-параметром приводит столбец к numeric, и индекс по нему не используется
+        """
+        number = float(value)
+        return int(number) if number.is_integer() else number
+    
+    def _text_expression(self, session: Session, model_field):
+        """Столбец в виде текста для условий LIKE: адрес INET без маски, время - строкой"""
+        if model_field.key in ('source_ip', 'destination_ip') and self._is_postgresql(session):
+            return func.host(model_field)
+        if model_field.key == 'timestamp':
+            return cast(model_field, String)
+        return model_field
+    
+    def _subnet_condition(self, session: Session, model_field, value: str):
+        """
+        Условие 'в подсети' ('10.0.0.0/8', '192.168.1.0/24', адрес без маски).
+        В PostgreSQL - оператор INET <<=, в других СУБД адреса хранятся строками,
+        поэтому поддерживаются только маски IPv4, кратные 8 (сравнение по префиксу)
+        """
+        network = ipaddress.ip_network(value.strip(), strict=False)
+        if self._is_postgresql(session):
+            return model_field.op('<<=')(cast(str(network), INET))
+        
+        if network.version != 4 or network.prefixlen % 8:
+            raise ValueError(f"Подсеть {network} поддерживается только в PostgreSQL")
+        if network.prefixlen == 0:
+            return true()
+        octets = str(network.network_address).split('.')[:network.prefixlen // 8]
+        prefix = '.'.join(octets)
+        return model_field == prefix if network.prefixlen == 32 else model_field.like(f'{prefix}.%')
+    
     def get_all_data(self) -> Tuple[bool, Any]:
         """
-        Получение всех данных из таблицы packet_data без ограничений
+        Получение всех данных из таблицы packet_data без ограничений.
+        Для экспорта больших таблиц - stream_all_data
         """
         try:
             session = self.get_session()
             
-            query = session.query(
-                PacketData.packet_number.label('номер_пакета'),
-                PacketData.timestamp.label('время'),
-                PacketData.source_ip.label('исходный_ip'),
-                PacketData.destination_ip.label('целевой_ip'),
-                PacketData.source_port.label('исходный_порт'),
-                PacketData.destination_port.label('целевой_порт'),
-                PacketData.packet_size.label('размер'),
-                PacketData.protocol.label('протокол')
-            ).order_by(PacketData.packet_number)
+            query = self._packet_rows_query(session).order_by(PacketData.packet_number, PacketData.id)
             
             data = query.all()
-            columns = ['номер_пакета', 'время', 'исходный_ip', 'целевой_ip', 
-                      'исходный_порт', 'целевой_порт', 'размер', 'протокол']
             
-            return True, (columns, data)
+            return True, (list(self.PACKET_COLUMNS), data)
             
         except Exception as e:
             return False, f"Ошибка получения всех данных: {e}"
@@ -366,98 +887,807 @@ class DatabaseService:
         try:
             session = self.get_session()
             
-            query = session.query(
-                PacketData.packet_number.label('номер_пакета'),
-                PacketData.timestamp.label('время'),
-                PacketData.source_ip.label('исходный_ip'),
-                PacketData.destination_ip.label('целевой_ip'),
-                PacketData.source_port.label('исходный_порт'),
-                PacketData.destination_port.label('целевой_порт'),
-                PacketData.packet_size.label('размер'),
-                PacketData.protocol.label('протокол')
-            ).order_by(PacketData.packet_number)
+            query = self._packet_rows_query(session).order_by(PacketData.packet_number, PacketData.id)
             
             if limit is not None:
                 query = query.limit(limit).offset(offset)
             
             data = query.all()
-            columns = ['номер_пакета', 'время', 'исходный_ip', 'целевой_ip', 
-                      'исходный_порт', 'целевой_порт', 'размер', 'протокол']
             
-            return True, (columns, data)
+            return True, (list(self.PACKET_COLUMNS), data)
             
         except Exception as e:
             return False, f"Ошибка получения данных с лимитом: {e}"
     
-    def insert_packet_data(self, packets: List[Dict], progress_callback=None) -> Tuple[bool, str]:
+    def insert_packet_data(self, packets: Union[List[Dict], PacketBatch], progress_callback=None,
+                           load_mode: str = 'replace', source_file: Optional[str] = None,
+                           cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str]:
+        """
+        Загрузка пакетов в packet_data. Принимает список словарей парсера
+        или колоночный буфер PacketBatch (его срезы отдают те же словари).
+        
+        Режимы load_mode (LOAD_MODES):
+          replace - таблица очищается через TRUNCATE и заполняется заново
+                    (в PostgreSQL чтения packet_data ждут коммита загрузки);
+          append  - пакеты дописываются к уже загруженным;
+          upsert  - пакеты с тем же (захват, номер пакета) обновляются, остальные добавляются.
+        Захват (таблица captures) определяется по пути исходного файла source_file.
+        Отмена cancel_token проверяется между порциями и прерывает выполняющийся
+        COPY/INSERT; загрузка идет в одной транзакции, поэтому отмена откатывает ее целиком
+        """
+        if load_mode not in self.LOAD_MODES:
+            return False, f"Неизвестный режим загрузки: {load_mode}"
+        
         try:
             session = self.get_session()
             
-            # Clear existing data
-            session.query(PacketData).delete()
-            
-            inserted_count = 0
-            total_packets = len(packets)
-            
-            # ИЗМЕНЕНИЕ: Используем пакетную вставку для больших объемов данных
-            batch_size = 1000
-            for i in range(0, total_packets, batch_size):
-                batch = packets[i:i + batch_size]
-                
-                for packet in batch:
-                    if not packet.get('protocol') or packet['protocol'] == '-':
-                        continue
-                    
-                    packet_data = PacketData(
-                        packet_number=packet['number'],
-                        timestamp=packet['timestamp'],
-                        source_ip=packet['source_ip'],
-                        destination_ip=packet['destination_ip'],
-                        source_port=packet['source_port'],
-                        destination_port=packet['destination_port'],
-                        packet_size=packet['size'],
-                        protocol=packet['protocol']
-                    )
-                    
-                    session.add(packet_data)
-                    inserted_count += 1
-                
-                # Коммитим пакет
-                session.commit()
-                
-                if progress_callback:
-                    progress = min((i + len(batch)) / total_packets * 100, 100)
-                    progress_callback(progress, f"Загружено {i + len(batch)}/{total_packets} пакетов")
+            with self._interrupt_on_cancel(session, cancel_token):
+                inserted_count = self._load_packets(session, [packets], load_mode, source_file, progress_callback,
+                                                    cancel_token)
+            check_cancelled(cancel_token)
+            session.commit()
             
             # АВТОМАТИЧЕСКОЕ СОХРАНЕНИЕ СТАТИСТИКИ ПОСЛЕ ЗАГРУЗКИ ДАННЫХ
-            self.auto_save_stats()
+            self._stats_changed()
             
+            if load_mode == 'append':
+                return True, f"Добавлено {inserted_count} пакетов"
+            if load_mode == 'upsert':
+                return True, f"Добавлено или обновлено {inserted_count} пакетов"
             return True, f"Успешно загружено {inserted_count} пакетов"
             
         except Exception as e:
             session.rollback()
+            # Протоколы, добавленные в откаченной транзакции, удаляются из кэша
+            self.protocol_registry.clear()
+            if is_cancelled(cancel_token):
+                return False, "Загрузка отменена, изменения в базе данных откачены"
             return False, f"Ошибка вставки данных пакетов: {e}"
         finally:
             session.close()
     
+    def append_packet_data(self, packets: Union[List[Dict], PacketBatch], progress_callback=None,
+                           source_file: Optional[str] = None, capture_id: Optional[int] = None) -> Tuple[bool, str]:
+        """
+        Дописывание пакетов в packet_data без удаления уже загруженных.
+        Используется режимом слежения за файлом для микропакетов, поэтому
+        файл статистики здесь сразу не пересохраняется - только через StatsWorker.
+        capture_id - захват из create_capture (после ротации файла номера пакетов
+        начинаются заново), иначе захват определяется по source_file
+        """
+        try:
+            session = self.get_session()
+            inserted_count = self._load_packets(session, [packets], 'append', source_file, progress_callback,
+                                                capture_id=capture_id)
+            session.commit()
+            self._stats_changed(auto_save=False)
+            return True, f"Добавлено {inserted_count} пакетов"
+            
+        except Exception as e:
+            session.rollback()
+            # Протоколы, добавленные в откаченной транзакции, удаляются из кэша
+            self.protocol_registry.clear()
+            return False, f"Ошибка добавления данных пакетов: {e}"
+        finally:
+            session.close()
+    
+    def load_packet_stream(self, batches: Iterable[Union[List[Dict], PacketBatch]], progress_callback=None,
+                           load_mode: str = 'replace', source_file: Optional[str] = None,
+                           cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str]:
+        """
+        Загрузка потока порций пакетов (например, из IngestPipeline) в одной транзакции:
+        каждая порция записывается, как только поступила, без накопления всего файла в памяти.
+        Режимы load_mode и отмена - как у insert_packet_data
+        """
+        if load_mode not in self.LOAD_MODES:
+            return False, f"Неизвестный режим загрузки: {load_mode}"
+        
+        try:
+            session = self.get_session()
+            
+            with self._interrupt_on_cancel(session, cancel_token):
+                inserted_count = self._load_packets(session, batches, load_mode, source_file, progress_callback,
+                                                    cancel_token)
+            check_cancelled(cancel_token)
+            session.commit()
+            
+            self._stats_changed()
+            
+            return True, f"Загружено {inserted_count} пакетов ({self.LOAD_MODES[load_mode].lower()})"
+            
+        except Exception as e:
+            session.rollback()
+            # Протоколы, добавленные в откаченной транзакции, удаляются из кэша
+            self.protocol_registry.clear()
+            if is_cancelled(cancel_token):
+                return False, "Загрузка отменена, изменения в базе данных откачены"
+            return False, f"Ошибка потоковой загрузки пакетов: {e}"
+        finally:
+            session.close()
+    
+    def _load_packets(self, session: Session, batches: Iterable[Union[List[Dict], PacketBatch]], load_mode: str,
+                      source_file: Optional[str], progress_callback=None,
+                      cancel_token: Optional[CancelToken] = None, capture_id: Optional[int] = None) -> int:
+        """
+        Массовая вставка порций пакетов (COPY для PostgreSQL) в транзакции сессии, без коммита.
+        Без capture_id захват определяется по source_file
+        """
+        partitions = PacketPartitions(session)
+        if load_mode == 'replace':
+            self._truncate_packet_data(session, partitions)
+        
+        if capture_id is None:
+            capture_id = self._get_or_create_capture(session, source_file)
+        partitions.ensure_capture(capture_id)
+        reference_time = self._capture_reference_time(source_file)
+        
+        # Загрузки одного захвата (слежение и загрузка того же файла) идут по очереди до коммита
+        rollups = StatsRollups(session) if self._is_postgresql(session) else None
+        if rollups:
+            rollups.lock_capture(capture_id)
+        
+        if load_mode == 'upsert':
+            inserted_count = self._upsert_packets(session, batches, capture_id, progress_callback, reference_time,
+                                                  partitions, cancel_token)
+            # Эскизы не вычитают замененные строки - набор удаляется, его пересчитает schedule_sketch_rebuild
+            self._write_sketches(session, None)
+            return inserted_count
+        
+        sketches = self._read_sketches(session, load_mode)
+        # Сводки protocol_stats и ip_stats дополняются агрегатами только строк этой загрузки:
+        # захват тот же, id после отметки
+        watermark = rollups.watermark() if rollups else 0
+        
+        loader = PacketBulkLoader(session, capture_id=capture_id, reference_time=reference_time,
+                                  protocol_registry=self.protocol_registry,
+                                  partitions=partitions if partitions.enabled else None, sketches=sketches,
+                                  cancel_token=cancel_token)
+        inserted_count = sum(loader.load(packets, progress_callback) for packets in batches)
+        
+        if rollups and inserted_count:
+            rollups.merge_since(capture_id, watermark)
+        self._write_sketches(session, sketches)
+        return inserted_count
+    
+    def _read_sketches(self, session: Session, load_mode: str) -> Optional[PacketSketches]:
+        """
+        Эскизы, которые дополнит загрузка (None - не вести). После замены набор
+        начинается с нуля; если сохраненного набора нет, а пакеты есть, неполный
+        набор не ведется - его пересчитает schedule_sketch_rebuild
+        """
+        if not self.approximate_stats:
+            return None
+        if load_mode == 'replace':
+            return PacketSketches()
+        records = {sketch.name: sketch.data for sketch in session.query(StatsSketch)}
+        if records:
+            return PacketSketches.from_records(records)
+        return None if session.query(PacketData.id).first() else PacketSketches()
+    
+    def _write_sketches(self, session: Session, sketches: Optional[PacketSketches]):
+        """Сохранение эскизов в транзакции загрузки; без них сохраненный набор устарел и удаляется"""
+        session.query(StatsSketch).delete()
+        if sketches is not None:
+            session.add_all([StatsSketch(name=name, data=data) for name, data in sketches.to_records().items()])
+    
+    @staticmethod
+    def _capture_reference_time(source_file: Optional[str]) -> datetime:
+        """Опорный момент для дат пакетов: время изменения файла захвата, иначе текущее время"""
+        try:
+            if source_file and os.path.isfile(source_file):
+                return datetime.fromtimestamp(os.path.getmtime(source_file))
+        except OSError:
+            pass
+        return datetime.now()
+    
+    def _is_postgresql(self, session: Session) -> bool:
+        return session.get_bind().dialect.name == 'postgresql'
+    
+    def _truncate_packet_data(self, session: Session, partitions: PacketPartitions, reference_tables: bool = False):
+        """
+        Очистка пакетов и захватов: TRUNCATE вместо построчного DELETE, который раздувает таблицу.
+        В PostgreSQL вместе с ними очищаются сводки - их заполнит загрузка.
+        reference_tables - полная очистка (clear_tables): также эскизы и справочник протоколов
+        """
+        if self._is_postgresql(session):
+            # Секции удаляются: после RESTART IDENTITY секции старых захватов и дней не нужны
+            partitions.drop_all()
+            tables = ['packet_data', 'captures', 'protocol_stats', 'ip_stats']
+            if reference_tables:
+                tables += ['stats_sketches', 'protocols']
+            session.execute(text(f"TRUNCATE TABLE {', '.join(tables)} RESTART IDENTITY"))
+        else:
+            session.query(PacketData).delete()
+            session.query(Capture).delete()
+            if reference_tables:
+                for model in (ProtocolStats, IPStats, StatsSketch, Protocol):
+                    session.query(model).delete()
+    
+    def _get_or_create_capture(self, session: Session, source_file: Optional[str]) -> int:
+        """Номер захвата для исходного файла. Без имени файла создается новый захват"""
+        if source_file is None:
+            source_file = f"Загрузка {datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')}"
+        
+        capture = session.query(Capture).filter(Capture.source_file == source_file).first()
+        if capture is None:
+            capture = Capture(source_file=source_file)
+            session.add(capture)
+            session.flush()
+        return capture.id
+    
+    def create_capture(self, source_file: str) -> Tuple[bool, Union[int, str]]:
+        """
+        Новый захват того же файла (например, после ротации лога): пакеты в нем
+        нумеруются с начала и не конфликтуют с прежними по ключу (capture_id, packet_number).
+        Имя захвата уникально, поэтому к пути добавляется время создания
+        """
+        try:
+            session = self.get_session()
+            capture = Capture(source_file=f"{source_file} ({datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')})")
+            session.add(capture)
+            session.commit()
+            return True, capture.id
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка создания захвата: {e}"
+        finally:
+            session.close()
+    
+    def _upsert_packets(self, session: Session, batches: Iterable[Union[List[Dict], PacketBatch]], capture_id: int,
+                        progress_callback=None, reference_time: Optional[datetime] = None,
+                        partitions: Optional[PacketPartitions] = None,
+                        cancel_token: Optional[CancelToken] = None) -> int:
+        """
+        Upsert по ключу (capture_id, packet_number). В PostgreSQL пакеты загружаются COPY
+        во временную таблицу и переносятся одним INSERT ... ON CONFLICT DO UPDATE.
+        Из повторов номера в одной загрузке остается последний в файле.
+        При секционировании по дням ключ включает время пакета (PacketPartitions.conflict_columns)
+        """
+        columns = PacketBulkLoader.COLUMNS + ('capture_id',)
+        column_list = ', '.join(columns)
+        
+        if not self._is_postgresql(session):
+            # Другие СУБД: удаляем совпадающие пакеты захвата и вставляем заново
+            loader = PacketBulkLoader(session, capture_id=capture_id, reference_time=reference_time,
+                                      protocol_registry=self.protocol_registry, cancel_token=cancel_token)
+            inserted_count = 0
+            for packets in batches:
+                packets = self._last_versions(packets)
+                numbers = packets.numbers if isinstance(packets, PacketBatch) else (packet['number'] for packet in packets)
+                numbers = sorted(set(numbers))
+                for i in range(0, len(numbers), 500):
+                    session.query(PacketData).filter(
+                        PacketData.capture_id == capture_id,
+                        PacketData.packet_number.in_(numbers[i:i + 500])
+                    ).delete(synchronize_session=False)
+                inserted_count += loader.load(packets, progress_callback)
+            return inserted_count
+        
+        session.execute(text(f"""
+            CREATE TEMP TABLE packet_data_staging ON COMMIT DROP AS
+            SELECT {column_list} FROM packet_data WITH NO DATA
+        """))
+        # Порядковый номер строки в загрузке: COPY заполняет его в порядке следования пакетов
+        session.execute(text("ALTER TABLE packet_data_staging ADD COLUMN ord bigserial"))
+        
+        partitions = partitions or PacketPartitions(session)
+        loader = PacketBulkLoader(session, table_name='packet_data_staging', capture_id=capture_id,
+                                  reference_time=reference_time, protocol_registry=self.protocol_registry,
+                                  partitions=partitions if partitions.enabled else None,
+                                  cancel_token=cancel_token)
+        for packets in batches:
+            loader.load(packets, progress_callback)
+        check_cancelled(cancel_token)
+        
+        # DISTINCT ON: повторяющийся номер в одной загрузке не должен обновлять строку дважды,
+        # из повторов берется последняя версия (наибольший ord)
+        conflict_columns = partitions.conflict_columns()
+        conflict_list = ', '.join(conflict_columns)
+        update_list = ', '.join(f"{name} = EXCLUDED.{name}" for name in columns
+                                if name not in conflict_columns)
+        new_rows = f"""(
+            SELECT DISTINCT ON (packet_number) {column_list}
+            FROM packet_data_staging
+            ORDER BY packet_number, ord DESC
+        )"""
+        
+        # Заменяемые строки вычитаются из сводок, новые версии добавляются после переноса
+        rollups = StatsRollups(session)
+        rollups.merge(f"""(
+            SELECT p.protocol_id, p.source_ip, p.destination_ip, p.packet_size
+            FROM packet_data p
+            JOIN (SELECT DISTINCT {conflict_list} FROM packet_data_staging) changed USING ({conflict_list})
+        )""", sign=-1)
+        
+        result = session.execute(text(f"""
+            INSERT INTO packet_data ({column_list})
+            SELECT {column_list} FROM {new_rows} new_rows
+            ON CONFLICT ({conflict_list}) DO UPDATE SET {update_list}
+        """))
+        rollups.merge(new_rows)
+        return result.rowcount
+    
+    @staticmethod
+    def _last_versions(packets: Union[List[Dict], PacketBatch]) -> Union[List[Dict], PacketBatch]:
+        """Порция без повторов номера пакета: остается последняя версия, как у DISTINCT ON в PostgreSQL"""
+        numbers = packets.numbers if isinstance(packets, PacketBatch) else [packet['number'] for packet in packets]
+        last_rows = {number: row for row, number in enumerate(numbers)}
+        if len(last_rows) == len(numbers):
+            return packets
+        rows = sorted(last_rows.values())
+        if isinstance(packets, PacketBatch):
+            return PacketBatch.from_packets(packets[row] for row in rows)
+        return [packets[row] for row in rows]
+    
+    def get_packet_partitions(self) -> Tuple[bool, Any]:
+        """Режим секционирования packet_data и список секций (имя, границы, строки, размер)"""
+        try:
+            session = self.get_session()
+            partitions = PacketPartitions(session)
+            return True, {'mode': partitions.mode, 'partitions': partitions.list_partitions()}
+        except Exception as e:
+            return False, f"Ошибка получения секций packet_data: {e}"
+        finally:
+            session.close()
+    
+    def detach_packet_partition(self, name: str) -> Tuple[bool, str]:
+        """Отсоединение секции: ее строки пропадают из packet_data, но остаются в архивной таблице"""
+        try:
+            session = self.get_session()
+            partitions = PacketPartitions(session)
+            partitions.check_partition(name)
+            StatsRollups(session).merge(name, sign=-1)
+            session.query(StatsSketch).delete()
+            archive_name = partitions.detach(name)
+            session.commit()
+            self._stats_changed()
+            return True, f"Секция {name} отсоединена, ее данные сохранены в таблице {archive_name}"
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка отсоединения секции {name}: {e}"
+        finally:
+            session.close()
+    
+    def drop_packet_partition(self, name: str) -> Tuple[bool, str]:
+        try:
+            session = self.get_session()
+            partitions = PacketPartitions(session)
+            partitions.check_partition(name)
+            StatsRollups(session).merge(name, sign=-1)
+            session.query(StatsSketch).delete()
+            partitions.drop(name)
+            session.commit()
+            self._stats_changed()
+            return True, f"Секция {name} удалена"
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка удаления секции {name}: {e}"
+        finally:
+            session.close()
+    
+    def drop_old_partitions(self, keep_days: int) -> Tuple[bool, str]:
+        """Удаление секций с данными старше keep_days дней: по дню секции или дате захвата"""
+        try:
+            session = self.get_session()
+            partitions = PacketPartitions(session)
+            if not partitions.enabled:
+                return False, "Таблица packet_data не секционирована"
+            
+            before = datetime.now() - timedelta(days=keep_days)
+            names = partitions.old_partitions(before)
+            rollups = StatsRollups(session)
+            for name in names:
+                # Строки удаляемой секции вычитаются из сводок - без пересчета по всей таблице
+                rollups.merge(name, sign=-1)
+                partitions.drop(name)
+            # Эскизы не уменьшаются - удаляем, их пересчитает schedule_sketch_rebuild
+            session.query(StatsSketch).delete()
+            session.commit()
+            self._stats_changed()
+            return True, f"Удалено секций старше {keep_days} дн.: {len(names)}"
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка удаления старых секций: {e}"
+        finally:
+            session.close()
+    
+    def ensure_indexes(self) -> Tuple[bool, str]:
+        """
+        Создание недостающих индексов из PACKET_INDEXES и обновление статистики
+        планировщика (ANALYZE). Триграммные индексы требуют расширения pg_trgm:
+        если его нельзя установить, они пропускаются
+        """
+        try:
+            session = self.get_session()
+            postgresql = self._is_postgresql(session)
+            trigram = postgresql and self._enable_trigram(session)
+            existing = {index['name'] for index in inspect(session.connection()).get_indexes(PacketData.__tablename__)}
+            
+            created, skipped = [], []
+            for name, (method, columns, purpose) in self.PACKET_INDEXES.items():
+                if name in existing:
+                    continue
+                if (method != 'btree' and not postgresql) or (method == 'gin' and not trigram):
+                    skipped.append(name)
+                    continue
+                using = f" USING {method}" if postgresql else ''
+                session.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {PacketData.__tablename__}{using} {columns}"))
+                created.append(name)
+            
+            session.execute(text(f"ANALYZE {PacketData.__tablename__}"))
+            session.commit()
+            
+            message = f"Индексы packet_data: создано {len(created)}, уже были {len(existing & set(self.PACKET_INDEXES))}"
+            if skipped:
+                message += f", пропущено {len(skipped)} ({', '.join(skipped)})"
+            return True, message
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка создания индексов: {e}"
+        finally:
+            session.close()
+    
+    def _enable_trigram(self, session: Session) -> bool:
+        """Установка pg_trgm в точке сохранения: ошибка прав не прерывает транзакцию"""
+        available = session.execute(text(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first() is not None
+        if not available:
+            return False
+        try:
+            with session.begin_nested():
+                session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            return True
+        except Exception as e:
+            print(f"Расширение pg_trgm недоступно: {e}")
+            return False
+    
+    def get_index_status(self) -> Tuple[bool, Any]:
+        """
+        Состояние индексов packet_data: для каждого индекса из PACKET_INDEXES и созданных
+        моделью - есть ли он, размер и число использований с момента сброса статистики
+        """
+        try:
+            session = self.get_session()
+            if not self._is_postgresql(session):
+                existing = {index['name'] for index in inspect(session.connection()).get_indexes(PacketData.__tablename__)}
+                return True, [{'name': name, 'exists': name in existing, 'size': None, 'scans': None,
+                               'purpose': purpose} for name, (method, columns, purpose) in self.PACKET_INDEXES.items()]
+            
+            # Индекс секционированной таблицы хранится в секциях - размер и использования суммируются
+            # по дереву секций индекса (у обычного индекса дерево состоит из него самого)
+            rows = session.execute(text("""
+                SELECT i.indexname, pg_size_pretty(SUM(pg_relation_size(t.relid))::bigint), SUM(s.idx_scan)::bigint
+                FROM pg_indexes i
+                CROSS JOIN LATERAL pg_partition_tree(format('%I.%I', i.schemaname, i.indexname)::regclass) t
+                LEFT JOIN pg_stat_user_indexes s ON s.indexrelid = t.relid
+                WHERE i.schemaname = current_schema() AND i.tablename = :table_name
+                GROUP BY i.indexname
+                ORDER BY i.indexname
+            """), {'table_name': PacketData.__tablename__}).all()
+            existing = {name: (size, scans) for name, size, scans in rows}
+            
+            status = []
+            for name, (method, columns, purpose) in self.PACKET_INDEXES.items():
+                size, scans = existing.get(name, (None, None))
+                status.append({'name': name, 'exists': name in existing, 'size': size, 'scans': scans,
+                               'purpose': purpose})
+            for name, (size, scans) in existing.items():
+                if name not in self.PACKET_INDEXES:
+                    status.append({'name': name, 'exists': True, 'size': size, 'scans': scans,
+                                   'purpose': 'индекс модели'})
+            return True, status
+        except Exception as e:
+            return False, f"Ошибка получения состояния индексов: {e}"
+        finally:
+            session.close()
+    
+    def explain_filters(self, filters: List[Tuple[str, str, str]], limit_records: Optional[int] = None,
+                        analyze: bool = False) -> Tuple[bool, Any]:
+        """
+        План запроса get_filtered_data для набора фильтров (EXPLAIN, с analyze=True - EXPLAIN ANALYZE).
+        Возвращает словарь: indexes - использованные индексы, seq_scans - таблицы,
+        прочитанные целиком, plan - текст плана
+        """
+        try:
+            session = self.get_session()
+            if not self._is_postgresql(session):
+                return False, "План запроса с индексами поддерживается только для PostgreSQL"
+            
+            query = self._build_filtered_query(session, filters)
+            if limit_records is not None:
+                query = query.limit(limit_records)
+            compiled = query.statement.compile(dialect=session.get_bind().dialect,
+                                               compile_kwargs={'render_postcompile': True})
+            
+            options = "ANALYZE, FORMAT JSON" if analyze else "FORMAT JSON"
+            plan = session.connection().exec_driver_sql(
+                f"EXPLAIN ({options}) {compiled}", compiled.params).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            
+            indexes, seq_scans, lines = [], [], []
+            self._walk_plan(plan[0]['Plan'], 0, indexes, seq_scans, lines)
+            session.rollback()
+            return True, {'indexes': indexes, 'seq_scans': seq_scans, 'plan': '\n'.join(lines)}
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка получения плана запроса: {e}"
+        finally:
+            session.close()
+    
+    def _walk_plan(self, node: dict, depth: int, indexes: List[str], seq_scans: List[str], lines: List[str]):
+        description = node['Node Type']
+        if 'Index Name' in node:
+            description += f" по {node['Index Name']}"
+            if node['Index Name'] not in indexes:
+                indexes.append(node['Index Name'])
+        elif node['Node Type'] == 'Seq Scan':
+            description += f" {node['Relation Name']}"
+            if node['Relation Name'] not in seq_scans:
+                seq_scans.append(node['Relation Name'])
+        description += f" (строк: {node.get('Actual Rows', node.get('Plan Rows'))})"
+        lines.append('  ' * depth + description)
+        
+        for child in node.get('Plans', []):
+            self._walk_plan(child, depth + 1, indexes, seq_scans, lines)
+    
+    def get_schema_version(self) -> int:
+        """Номер примененной версии схемы, 0 - таблица версий пуста (база старее версий)"""
+        try:
+            session = self.get_session()
+            return session.query(func.max(SchemaVersion.version)).scalar() or 0
+        except Exception as e:
+            print(f"Ошибка получения версии схемы: {e}")
+            return 0
+        finally:
+            session.close()
+    
+    def _set_schema_version(self, version: int) -> Tuple[bool, str]:
+        try:
+            session = self.get_session()
+            if session.get(SchemaVersion, version) is None:
+                session.add(SchemaVersion(version=version))
+            session.commit()
+            return True, f"Версия схемы: {version}"
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка записи версии схемы: {e}"
+        finally:
+            session.close()
+    
+    def migrate_schema(self) -> Tuple[bool, str]:
+        """
+        Последовательное применение миграций SCHEMA_MIGRATIONS к таблицам,
+        созданным предыдущими версиями программы. Каждая миграция идет в своей
+        транзакции и записывается в schema_version
+        """
+        current_version = self.get_schema_version()
+        if current_version >= self.SCHEMA_VERSION:
+            return True, f"Схема актуальна (версия {current_version})"
+        
+        migrations = {1: self._migrate_captures, 2: self._migrate_native_types, 3: self._migrate_protocols,
+                      4: self._migrate_stats_keys, 5: self._migrate_stats_trigger, 6: self._migrate_stats_views}
+        trigger_installed = False
+        try:
+            session = self.get_session()
+            if not self._is_postgresql(session):
+                # Другие СУБД используются только для свежих баз (бенчмарки) - отмечаем версию
+                session.add(SchemaVersion(version=self.SCHEMA_VERSION))
+                session.commit()
+                return True, "Миграция не требуется"
+            
+            trigger_installed = session.execute(text(
+                "SELECT 1 FROM pg_proc WHERE proname IN ('update_stats_and_export', 'notify_packet_data_changed')"
+            )).first() is not None
+            
+            for version in range(current_version + 1, self.SCHEMA_VERSION + 1):
+                print(f"Миграция схемы до версии {version}: {self.SCHEMA_MIGRATIONS[version]}")
+                migrations[version](session)
+                session.add(SchemaVersion(version=version))
+                session.commit()
+        except Exception as e:
+            session.rollback()
+            self.protocol_registry.clear()
+            return False, f"Ошибка обновления схемы до версии {self.SCHEMA_VERSION}: {e}"
+        finally:
+            session.close()
+        
+        # Функция триггера сравнивает адреса со строками и пересчитывала сводки - пересоздаем
+        if trigger_installed:
+            success, message = self.setup_auto_stats_trigger()
+            if not success:
+                return False, message
+        return True, f"Схема обновлена до версии {self.SCHEMA_VERSION}"
+    
+    def _migrate_captures(self, session: Session):
+        """Версия 1: столбец capture_id и уникальный индекс в packet_data"""
+        session.execute(text("""
+            ALTER TABLE packet_data
+            ADD COLUMN IF NOT EXISTS capture_id INTEGER REFERENCES captures(id) ON DELETE CASCADE
+        """))
+        session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_packet_data_capture_id ON packet_data (capture_id)"))
+        session.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_packet_data_capture_number "
+            "ON packet_data (capture_id, packet_number)"))
+    
+    def _migrate_native_types(self, session: Session):
+        """
+        Версия 2: перевод столбцов packet_data на INET и TIMESTAMPTZ на месте.
+        Пустые, '-' и некорректные значения (в том числе порты вне 0..65535) становятся
+        NULL. Время без даты дополняется датой загрузки строки (created_at). Порты
+        остаются INTEGER с проверкой диапазона: SMALLINT знаковый и не вмещает порты выше 32767
+        """
+        session.execute(text("""
+            CREATE FUNCTION pg_temp.try_inet(value TEXT) RETURNS INET AS $$
+            BEGIN
+                IF value IS NULL OR btrim(value) IN ('', '-') THEN
+                    RETURN NULL;
+                END IF;
+                RETURN btrim(value)::INET;
+            EXCEPTION
+                WHEN OTHERS THEN RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql IMMUTABLE
+        """))
+        session.execute(text("""
+            CREATE FUNCTION pg_temp.try_timestamptz(value TEXT, loaded_at TIMESTAMPTZ) RETURNS TIMESTAMPTZ AS $$
+            BEGIN
+                IF value IS NULL OR btrim(value) IN ('', '-') THEN
+                    RETURN NULL;
+                END IF;
+                IF btrim(value) ~ '^[0-9]{1,2}[:][0-9]{2}' THEN
+                    RETURN COALESCE(loaded_at, NOW())::DATE + btrim(value)::TIME;
+                END IF;
+                RETURN btrim(value)::TIMESTAMPTZ;
+            EXCEPTION
+                WHEN OTHERS THEN RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql STABLE
+        """))
+        
+        # Столбцы, уже имеющие нужный тип (повторный запуск), не перезаписываются
+        column_types = dict(session.execute(text("""
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_name = 'packet_data' AND table_schema = current_schema()
+        """)).all())
+        
+        alterations = []
+        for name in ('source_ip', 'destination_ip'):
+            if column_types.get(name) != 'inet':
+                alterations.append(f"ALTER COLUMN {name} TYPE INET USING pg_temp.try_inet({name})")
+        if column_types.get('timestamp') != 'timestamp with time zone':
+            alterations.append("ALTER COLUMN timestamp TYPE TIMESTAMPTZ "
+                               "USING pg_temp.try_timestamptz(timestamp::TEXT, created_at)")
+        if alterations:
+            session.execute(text(f"ALTER TABLE packet_data {', '.join(alterations)}"))
+        
+        for name in ('source_port', 'destination_port'):
+            session.execute(text(f"""
+                UPDATE packet_data SET {name} = NULL WHERE {name} NOT BETWEEN 0 AND 65535;
+                ALTER TABLE packet_data DROP CONSTRAINT IF EXISTS ck_packet_data_{name};
+                ALTER TABLE packet_data ADD CONSTRAINT ck_packet_data_{name}
+                    CHECK ({name} BETWEEN 0 AND 65535)
+            """))
+        
+        # Адрес IPv6 длиннее 20 символов
+        session.execute(text("ALTER TABLE ip_stats ALTER COLUMN ip_address TYPE VARCHAR(45)"))
+    
+    def _migrate_protocols(self, session: Session):
+        """
+        Версия 3: названия протоколов переносятся в справочник protocols,
+        packet_data.protocol заменяется ссылкой protocol_id SMALLINT.
+        Пустой протокол и '-' (такие пакеты не загружаются) становятся NULL
+        """
+        session.execute(text("""
+            ALTER TABLE packet_data
+            ADD COLUMN IF NOT EXISTS protocol_id SMALLINT REFERENCES protocols(id)
+        """))
+        
+        has_protocol_text = session.execute(text("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'packet_data' AND table_schema = current_schema() AND column_name = 'protocol'
+        """)).first() is not None
+        if has_protocol_text:
+            session.execute(text("""
+                INSERT INTO protocols (name)
+                SELECT DISTINCT protocol FROM packet_data
+                WHERE protocol IS NOT NULL AND protocol NOT IN ('', '-')
+                ON CONFLICT (name) DO NOTHING
+            """))
+            session.execute(text("""
+                UPDATE packet_data p SET protocol_id = pr.id
+                FROM protocols pr
+                WHERE pr.name = p.protocol
+            """))
+            session.execute(text("ALTER TABLE packet_data DROP COLUMN protocol"))
+        
+        session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_packet_data_protocol_id ON packet_data (protocol_id)"))
+        self.protocol_registry.clear()
+    
+    def _migrate_stats_keys(self, session: Session):
+        """
+        Версия 4: сводки ведутся слиянием при загрузке (StatsRollups) - нужны уникальные
+        ключи для ON CONFLICT и BIGINT для накапливаемых счетчиков. Сводки пересчитываются
+        заново, это убирает и дубликаты, мешающие уникальным индексам
+        """
+        session.execute(text("""
+            DELETE FROM protocol_stats;
+            DELETE FROM ip_stats;
+            ALTER TABLE protocol_stats ALTER COLUMN packet_count TYPE BIGINT, ALTER COLUMN total_size TYPE BIGINT;
+            ALTER TABLE ip_stats ALTER COLUMN packet_count TYPE BIGINT, ALTER COLUMN total_traffic TYPE BIGINT;
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_protocol_stats_protocol_name ON protocol_stats (protocol_name);
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_ip_stats_address_role ON ip_stats (ip_address, role)
+        """))
+        StatsRollups(session).rebuild()
+    
+    def _migrate_stats_trigger(self, session: Session):
+        """
+        Версия 5: прежний триггер пересчитывал статистику на каждой вставке.
+        Удаляем его - установленный триггер пересоздается после миграций уже как NOTIFY
+        """
+        session.execute(text("""
+            DROP TRIGGER IF EXISTS auto_update_stats_trigger ON packet_data;
+            DROP FUNCTION IF EXISTS update_stats_and_export()
+        """))
+    
+    def _migrate_stats_views(self, session: Session):
+        """Версия 6: материализованное представление StatsViews для панели статистики и экспорта"""
+        StatsViews(session).create()
+    
+    def get_last_packet_number(self, source_file: Optional[str] = None) -> Tuple[bool, int]:
+        """Наибольший номер пакета в packet_data (0, если таблица пуста), с фильтром по захвату"""
+        try:
+            session = self.get_session()
+            query = session.query(func.max(PacketData.packet_number))
+            if source_file is not None:
+                query = query.join(Capture, PacketData.capture_id == Capture.id).filter(
+                    Capture.source_file == source_file)
+            last_number = query.scalar()
+            return True, last_number or 0
+        except Exception as e:
+            print(f"Ошибка получения номера последнего пакета: {e}")
+            return False, 0
+        finally:
+            session.close()
+    
+    def _protocol_totals(self, session: Session):
+        """
+        Запрос (протокол, количество, сумма и средний размер пакетов): группировка идет
+        по малому целому protocol_id, названия подставляются из справочника после нее
+        """
+        totals = session.query(
+            PacketData.protocol_id.label('protocol_id'),
+            func.count(PacketData.id).label('packet_count'),
+            func.sum(PacketData.packet_size).label('total_size'),
+            func.avg(PacketData.packet_size).label('avg_size')
+        ).filter(PacketData.protocol_id.isnot(None)).group_by(PacketData.protocol_id).subquery()
+        
+        return session.query(
+            Protocol.name, totals.c.packet_count, totals.c.total_size, totals.c.avg_size
+        ).join(totals, totals.c.protocol_id == Protocol.id)
+    
     def update_protocol_stats(self) -> Tuple[bool, str]:
+        """
+        Полный пересчет protocol_stats. В PostgreSQL сводка и так ведется при загрузке,
+        пересчет одним INSERT ... SELECT нужен только для ее сверки
+        """
         try:
             session = self.get_session()
             
+            if self._is_postgresql(session):
+                StatsRollups(session).rebuild_protocols()
+                session.commit()
+                count = session.query(func.count(ProtocolStats.id)).scalar()
+                self.auto_save_stats()
+                return True, f"Статистика протоколов обновлена ({count} записей)"
+            
             # Clear existing stats
             session.query(ProtocolStats).delete()
             
             # Calculate new stats
-            result = session.query(
-                PacketData.protocol,
-                func.count(PacketData.id).label('packet_count'),
-                func.sum(PacketData.packet_size).label('total_size'),
-                func.avg(PacketData.packet_size).label('avg_size')
-            ).filter(
-                PacketData.protocol.isnot(None),
-                PacketData.protocol != '',
-                PacketData.protocol != '-'
-            ).group_by(PacketData.protocol).all()
+            result = self._protocol_totals(session).all()
             
             for protocol, count, total_size, avg_size in result:
                 protocol_stat = ProtocolStats(
@@ -483,9 +1713,17 @@ class DatabaseService:
             session.close()
     
     def update_ip_stats(self) -> Tuple[bool, str]:
+        """Полный пересчет ip_stats (в PostgreSQL - одним INSERT ... SELECT, как update_protocol_stats)"""
         try:
             session = self.get_session()
             
+            if self._is_postgresql(session):
+                StatsRollups(session).rebuild_ips()
+                session.commit()
+                count = session.query(func.count(IPStats.id)).scalar()
+                self.auto_save_stats()
+                return True, f"Статистика IP обновлена ({count} записей)"
+            
             # Clear existing stats
             session.query(IPStats).delete()
             
@@ -495,9 +1733,7 @@ class DatabaseService:
                 func.count(PacketData.id).label('packet_count'),
                 func.sum(PacketData.packet_size).label('total_traffic')
             ).filter(
-                PacketData.source_ip.isnot(None),
-                PacketData.source_ip != '',
-                PacketData.source_ip != '-'
+                PacketData.source_ip.isnot(None)
             ).group_by(PacketData.source_ip).all()
             
             for ip, count, traffic in source_stats:
@@ -515,9 +1751,7 @@ class DatabaseService:
                 func.count(PacketData.id).label('packet_count'),
                 func.sum(PacketData.packet_size).label('total_traffic')
             ).filter(
-                PacketData.destination_ip.isnot(None),
-                PacketData.destination_ip != '',
-                PacketData.destination_ip != '-'
+                PacketData.destination_ip.isnot(None)
             ).group_by(PacketData.destination_ip).all()
             
             for ip, count, traffic in dest_stats:
@@ -551,12 +1785,14 @@ class DatabaseService:
             session = self.get_session()
             
             if table_name == 'packet_data':
-                query = session.query(PacketData)
+                query = session.query(PacketData, Protocol.name).outerjoin(
+                    Protocol, PacketData.protocol_id == Protocol.id)
                 if limit is not None:
                     query = query.limit(limit)
                 data = query.all()
-                columns = [column.name for column in PacketData.__table__.columns]
-                rows = [[getattr(row, col) for col in columns] for row in data]
+                # protocol_id показывается названием протокола
+                columns = self.get_available_fields()
+                rows = [[name if col == 'protocol' else getattr(row, col) for col in columns] for row, name in data]
             elif table_name == 'protocol_stats':
                 query = session.query(ProtocolStats)
                 if limit is not None:
@@ -589,7 +1825,9 @@ class DatabaseService:
         return self.get_table_data(table_name, limit=None)
     
     def get_available_fields(self) -> List[str]:
-        return [column.name for column in PacketData.__table__.columns]
+        # Вместо protocol_id фильтр задается названием протокола
+        return ['protocol' if column.name == 'protocol_id' else column.name
+                for column in PacketData.__table__.columns]
     
     def get_data_count_by_protocol(self) -> Tuple[bool, Any]:
         """
@@ -598,16 +1836,9 @@ class DatabaseService:
         try:
             session = self.get_session()
             
-            result = session.query(
-                PacketData.protocol,
-                func.count(PacketData.id).label('count')
-            ).filter(
-                PacketData.protocol.isnot(None),
-                PacketData.protocol != '',
-                PacketData.protocol != '-'
-            ).group_by(PacketData.protocol).order_by(func.count(PacketData.id).desc()).all()
+            result = self._protocol_totals(session).order_by(desc('packet_count')).all()
             
-            return True, [(protocol, count) for protocol, count in result]
+            return True, [(protocol, count) for protocol, count, total_size, avg_size in result]
         except Exception as e:
             return False, f"Ошибка получения статистики по протоколам: {e}"
     
@@ -624,240 +1855,40 @@ class DatabaseService:
 
     def setup_auto_stats_trigger(self) -> Tuple[bool, str]:
         """
-        Установка автоматического триггера для экспорта статистики
+        Установка триггера уведомлений об изменении packet_data.
+        Триггер только отправляет NOTIFY в канал StatsWorker.CHANNEL (одно на
+        оператор, повторы в транзакции склеиваются при коммите) - статистику
+        пересчитывает StatsWorker не чаще раза в свой интервал. Так замечаются
+        и загрузки из других процессов
         """
         try:
             session = self.get_session()
             
-            # Создаем функцию триггера
-            session.execute(text("""
-                CREATE OR REPLACE FUNCTION update_stats_and_export()
+            # Прежняя функция пересчитывала всю статистику на каждой вставке - удаляем
+            session.execute(text(f"""
+                DROP TRIGGER IF EXISTS auto_update_stats_trigger ON packet_data;
+                DROP FUNCTION IF EXISTS update_stats_and_export();
+                
+                CREATE OR REPLACE FUNCTION notify_packet_data_changed()
                 RETURNS TRIGGER AS $$
-                DECLARE
-                    stats_text TEXT;
-                    file_path TEXT;
-                    protocol_count INT;
-                    ip_count INT;
-                    total_packets INT;
-                    stats_timestamp TIMESTAMP;
-                    export_dir TEXT;
                 BEGIN
-                    -- Ждем небольшую задержку для завершения транзакции
-                    PERFORM pg_sleep(0.1);
-                    
-                    -- Получаем текущее время
-                    stats_timestamp := NOW();
-                    
-                    -- Получаем общее количество пакетов
-                    SELECT COUNT(*) INTO total_packets FROM packet_data;
-                    
-                    -- Получаем количество уникальных протоколов
-                    SELECT COUNT(DISTINCT protocol) INTO protocol_count 
-                    FROM packet_data 
-                    WHERE protocol IS NOT NULL AND protocol != '' AND protocol != '-';
-                    
-                    -- Получаем количество уникальных IP адресов
-                    SELECT COUNT(DISTINCT ip) INTO ip_count FROM (
-                        SELECT source_ip as ip FROM packet_data 
-                        WHERE source_ip IS NOT NULL AND source_ip != '' AND source_ip != '-'
-                        UNION 
-                        SELECT destination_ip as ip FROM packet_data 
-                        WHERE destination_ip IS NOT NULL AND destination_ip != '' AND destination_ip != '-'
-                    ) AS unique_ips;
-                    
-                    -- Формируем текст статистики
-                    stats_text := 'СТАТИСТИКА СЕТЕВЫХ ПАКЕТОВ' || E'\\n';
-                    stats_text := stats_text || '================================' || E'\\n';
-                    stats_text := stats_text || 'Время обновления: ' || TO_CHAR(stats_timestamp, 'YYYY-MM-DD HH24:MI:SS') || E'\\n';
-                    stats_text := stats_text || 'Общее количество пакетов: ' || total_packets || E'\\n';
-                    stats_text := stats_text || 'Уникальных протоколов: ' || protocol_count || E'\\n';
-                    stats_text := stats_text || 'Уникальных IP-адресов: ' || ip_count || E'\\n\\n';
-                    
-                    -- Статистика по протоколам (топ-10)
-                    stats_text := stats_text || 'ТОП-10 ПРОТОКОЛОВ:' || E'\\n';
-                    stats_text := stats_text || '------------------' || E'\\n';
-                    
-                    WITH protocol_stats AS (
-                        SELECT 
-                            protocol,
-                            COUNT(*) as packet_count,
-                            SUM(packet_size) as total_size,
-                            ROUND(AVG(packet_size)::numeric, 2) as avg_size
-                        FROM packet_data 
-                        WHERE protocol IS NOT NULL AND protocol != '' AND protocol != '-'
-                        GROUP BY protocol
-                        ORDER BY packet_count DESC
-                        LIMIT 10
-                    )
-                    SELECT 
-                        COALESCE(
-                            STRING_AGG(
-                                FORMAT('%-15s | %6s пакетов | %10s байт | %8s ср.размер', 
-                                      protocol, packet_count::text, total_size::text, avg_size::text),
-                                E'\\n'
-                            ),
-                            'Нет данных'
-                        )
-                    INTO stats_text
-                    FROM (SELECT stats_text as base_text) t, protocol_stats;
-                    
-                    stats_text := stats_text || E'\\n\\n';
-                    
-                    -- Статистика по IP (топ-10 источников)
-                    stats_text := stats_text || 'ТОП-10 ИСТОЧНИКОВ (по пакетам):' || E'\\n';
-                    stats_text := stats_text || '-------------------------------' || E'\\n';
-                    
-                    WITH source_stats AS (
-                        SELECT 
-                            source_ip as ip,
-                            COUNT(*) as packet_count,
-                            SUM(packet_size) as total_traffic
-                        FROM packet_data 
-                        WHERE source_ip IS NOT NULL AND source_ip != '' AND source_ip != '-'
-                        GROUP BY source_ip
-                        ORDER BY packet_count DESC
-                        LIMIT 10
-                    )
-                    SELECT 
-                        COALESCE(
-                            STRING_AGG(
-                                FORMAT('%-15s | %6s пакетов | %12s байт', 
-                                      ip, packet_count::text, total_traffic::text),
-                                E'\\n'
-                            ),
-                            'Нет данных'
-                        )
-                    INTO stats_text
-                    FROM (SELECT stats_text as base_text) t, source_stats;
-                    
-                    stats_text := stats_text || E'\\n\\n';
-                    
-                    -- Статистика по IP (топ-10 получателей)
-                    stats_text := stats_text || 'ТОП-10 ПОЛУЧАТЕЛЕЙ (по пакетов):' || E'\\n';
-                    stats_text := stats_text || '--------------------------------' || E'\\n';
-                    
-                    WITH dest_stats AS (
-                        SELECT 
-                            destination_ip as ip,
-                            COUNT(*) as packet_count,
-                            SUM(packet_size) as total_traffic
-                        FROM packet_data 
-                        WHERE destination_ip IS NOT NULL AND destination_ip != '' AND destination_ip != '-'
-                        GROUP BY destination_ip
-                        ORDER BY packet_count DESC
-                        LIMIT 10
-                    )
-                    SELECT 
-                        COALESCE(
-                            STRING_AGG(
-                                FORMAT('%-15s | %6s пакетов | %12s байт', 
-                                      ip, packet_count::text, total_traffic::text),
-                                E'\\n'
-                            ),
-                            'Нет данных'
-                        )
-                    INTO stats_text
-                    FROM (SELECT stats_text as base_text) t, dest_stats;
-                    
-                    -- Статистика по размерам пакетов
-                    stats_text := stats_text || E'\\nСТАТИСТИКА ПО РАЗМЕРАМ ПАКЕТОВ:' || E'\\n';
-                    stats_text := stats_text || '-------------------------------' || E'\\n';
-                    
-                    WITH size_stats AS (
-                        SELECT 
-                            COUNT(*) as total_count,
-                            SUM(packet_size) as total_bytes,
-                            ROUND(AVG(packet_size)::numeric, 2) as avg_size,
-                            MIN(packet_size) as min_size,
-                            MAX(packet_size) as max_size
-                        FROM packet_data
-                        WHERE packet_size > 0
-                    )
-                    SELECT 
-                        COALESCE(
-                            FORMAT('Всего пакетов: %s\\nОбщий объем: %s байт\\nСредний размер: %s байт\\nМин. размер: %s байт\\nМакс. размер: %s байт',
-                                  total_count::text, total_bytes::text, avg_size::text, min_size::text, max_size::text),
-                            'Нет данных'
-                        )
-                    INTO stats_text
-                    FROM (SELECT stats_text as base_text) t, size_stats;
-                    
-                    -- Определяем путь для сохранения файла
-                    export_dir := 'C:\\Users\\Assa\\source\\repos\\network_stats';
-                    file_path := export_dir || '\\network_stats_' || TO_CHAR(stats_timestamp, 'YYYYMMDD_HH24MISS') || '.txt';
-                    
-                    -- Сохраняем в файл (если есть права)
-                    BEGIN
-                        -- Создаем директорию если не существует
-                        PERFORM dblink_exec('dbname=' || current_database(), 
-                                          'CREATE DIRECTORY IF NOT EXISTS ' || quote_ident(export_dir));
-                        
-                        -- Сохраняем статистику
-                        PERFORM pg_catalog.pg_write_file(file_path, stats_text, false);
-                        RAISE NOTICE 'Статистика автоматически сохранена в файл: %', file_path;
-                    EXCEPTION
-                        WHEN OTHERS THEN
-                            -- Если не удалось сохранить в файл, просто логируем
-                            RAISE NOTICE 'Не удалось сохранить статистику в файл. Статистика собрана:%', E'\\n' || stats_text;
-                    END;
-                    
-                    -- Также обновляем таблицы статистики в БД
-                    DELETE FROM protocol_stats;
-                    
-                    INSERT INTO protocol_stats (protocol_name, packet_count, total_size, avg_size, created_at)
-                    SELECT 
-                        protocol,
-                        COUNT(*) as packet_count,
-                        SUM(packet_size) as total_size,
-                        AVG(packet_size) as avg_size,
-                        stats_timestamp
-                    FROM packet_data 
-                    WHERE protocol IS NOT NULL AND protocol != '' AND protocol != '-'
-                    GROUP BY protocol;
-                    
-                    -- Обновляем IP статистику
-                    DELETE FROM ip_stats;
-                    
-                    -- Источники
-                    INSERT INTO ip_stats (ip_address, role, packet_count, total_traffic, created_at)
-                    SELECT 
-                        source_ip,
-                        'src',
-                        COUNT(*) as packet_count,
-                        SUM(packet_size) as total_traffic,
-                        stats_timestamp
-                    FROM packet_data 
-                    WHERE source_ip IS NOT NULL AND source_ip != '' AND source_ip != '-'
-                    GROUP BY source_ip;
-                    
-                    -- Получатели
-                    INSERT INTO ip_stats (ip_address, role, packet_count, total_traffic, created_at)
-                    SELECT 
-                        destination_ip,
-                        'dst',
-                        COUNT(*) as packet_count,
-                        SUM(packet_size) as total_traffic,
-                        stats_timestamp
-                    FROM packet_data 
-                    WHERE destination_ip IS NOT NULL AND destination_ip != '' AND destination_ip != '-'
-                    GROUP BY destination_ip;
-                    
-                    RETURN NEW;
+                    PERFORM pg_notify('{StatsWorker.CHANNEL}', TG_OP);
+                    RETURN NULL;
                 END;
                 $$ LANGUAGE plpgsql;
             """))
             
             # Создаем триггер
             session.execute(text("""
-                DROP TRIGGER IF EXISTS auto_update_stats_trigger ON packet_data;
                 CREATE TRIGGER auto_update_stats_trigger
-                    AFTER INSERT ON packet_data
+                    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON packet_data
                     FOR EACH STATEMENT
-                    EXECUTE FUNCTION update_stats_and_export();
+                    EXECUTE FUNCTION notify_packet_data_changed();
             """))
             
             session.commit()
-            return True, "Автоматический триггер статистики установлен. Статистика будет сохраняться автоматически в C:\\Users\\Assa\\source\\repos\\network_stats"
+            return True, ("Триггер уведомлений установлен. Статистика пересчитывается фоновым потоком "
+                          "после изменений packet_data, в том числе из других программ")
             
         except Exception as e:
             session.rollback()
@@ -874,6 +1905,7 @@ class DatabaseService:
             
             session.execute(text("""
                 DROP TRIGGER IF EXISTS auto_update_stats_trigger ON packet_data;
+                DROP FUNCTION IF EXISTS notify_packet_data_changed();
                 DROP FUNCTION IF EXISTS update_stats_and_export();
             """))
             
@@ -899,92 +1931,52 @@ class DatabaseService:
             # Создаем директорию если не существует
             os.makedirs(export_dir, exist_ok=True)
             
-            session = self.get_session()
+            # Все разделы файла берутся из одного снимка StatsEngine - один проход по packet_data
+            stats = self.get_stats_summary()
+            if 'error' in stats:
+                return False, f"Ошибка экспорта статистики: {stats['error']}"
             
-            # Общее количество пакетов
-            total_packets = session.query(func.count(PacketData.id)).scalar() or 0
+            total_packets = stats['total_packets']
             
             # Если нет данных, не создаем файл
             if total_packets == 0:
                 return True, "Нет данных для экспорта статистики"
             
-            # Статистика по протоколам
-            protocol_stats = session.query(
-                PacketData.protocol,
-                func.count(PacketData.id).label('count'),
-                func.sum(PacketData.packet_size).label('total_size'),
-                func.avg(PacketData.packet_size).label('avg_size')
-            ).filter(
-                PacketData.protocol.isnot(None),
-                PacketData.protocol != '',
-                PacketData.protocol != '-'
-            ).group_by(PacketData.protocol).order_by(func.count(PacketData.id).desc()).limit(10).all()
-            
-            # Статистика по IP источникам
-            source_ip_stats = session.query(
-                PacketData.source_ip,
-                func.count(PacketData.id).label('count'),
-                func.sum(PacketData.packet_size).label('total_traffic')
-            ).filter(
-                PacketData.source_ip.isnot(None),
-                PacketData.source_ip != '',
-                PacketData.source_ip != '-'
-            ).group_by(PacketData.source_ip).order_by(func.count(PacketData.id).desc()).limit(10).all()
-            
-            # Статистика по IP получателям
-            dest_ip_stats = session.query(
-                PacketData.destination_ip,
-                func.count(PacketData.id).label('count'),
-                func.sum(PacketData.packet_size).label('total_traffic')
-            ).filter(
-                PacketData.destination_ip.isnot(None),
-                PacketData.destination_ip != '',
-                PacketData.destination_ip != '-'
-            ).group_by(PacketData.destination_ip).order_by(func.count(PacketData.id).desc()).limit(10).all()
-            
-            # Статистика по размерам пакетов
-            size_stats = session.query(
-                func.count(PacketData.id).label('total_count'),
-                func.sum(PacketData.packet_size).label('total_bytes'),
-                func.avg(PacketData.packet_size).label('avg_size'),
-                func.min(PacketData.packet_size).label('min_size'),
-                func.max(PacketData.packet_size).label('max_size')
-            ).filter(PacketData.packet_size > 0).first()
-            
             # Формируем текст статистики
             stats_text = "СТАТИСТИКА СЕТЕВЫХ ПАКЕТОВ\n"
             stats_text += "=" * 50 + "\n"
             stats_text += f"Время генерации: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
             stats_text += f"Общее количество пакетов: {total_packets}\n"
+            if stats.get('approximate'):
+                stats_text += "Значения приблизительные: оценки эскизов HyperLogLog и Space-Saving\n"
             
-            if size_stats:
-                total_count, total_bytes, avg_size, min_size, max_size = size_stats
-                stats_text += f"Общий объем трафика: {total_bytes or 0:,} байт\n"
-                stats_text += f"Средний размер пакета: {avg_size or 0:.2f} байт\n"
-                stats_text += f"Минимальный размер: {min_size or 0} байт\n"
-                stats_text += f"Максимальный размер: {max_size or 0} байт\n"
+            size_stats = stats['size']
+            stats_text += f"Общий объем трафика: {size_stats['total_bytes']:,} байт\n"
+            stats_text += f"Средний размер пакета: {size_stats['avg_size']:.2f} байт\n"
+            stats_text += f"Минимальный размер: {size_stats['min_size']} байт\n"
+            stats_text += f"Максимальный размер: {size_stats['max_size']} байт\n"
             
             stats_text += "\n" + "ТОП-10 ПРОТОКОЛОВ:\n"
             stats_text += "-" * 60 + "\n"
-            if protocol_stats:
-                for protocol, count, total_size, avg_size in protocol_stats:
-                    stats_text += f"{protocol:<20} | {count:>8} пакетов | {total_size or 0:>12} байт | {avg_size or 0:>8.2f} ср.размер\n"
+            if stats['protocols']:
+                for row in stats['protocols']:
+                    stats_text += f"{row['protocol']:<20} | {row['count']:>8} пакетов | {row['total_size']:>12} байт | {row['avg_size']:>8.2f} ср.размер\n"
             else:
                 stats_text += "Нет данных\n"
             
             stats_text += "\n" + "ТОП-10 ИСТОЧНИКОВ:\n"
             stats_text += "-" * 50 + "\n"
-            if source_ip_stats:
-                for ip, count, traffic in source_ip_stats:
-                    stats_text += f"{ip:<20} | {count:>8} пакетов | {traffic or 0:>12} байт\n"
+            if stats['top_sources']:
+                for row in stats['top_sources']:
+                    stats_text += f"{row['ip']:<20} | {row['count']:>8} пакетов | {row['traffic']:>12} байт\n"
             else:
                 stats_text += "Нет данных\n"
             
             stats_text += "\n" + "ТОП-10 ПОЛУЧАТЕЛЕЙ:\n"
             stats_text += "-" * 50 + "\n"
-            if dest_ip_stats:
-                for ip, count, traffic in dest_ip_stats:
-                    stats_text += f"{ip:<20} | {count:>8} пакетов | {traffic or 0:>12} байт\n"
+            if stats['top_destinations']:
+                for row in stats['top_destinations']:
+                    stats_text += f"{row['ip']:<20} | {row['count']:>8} пакетов | {row['traffic']:>12} байт\n"
             else:
                 stats_text += "Нет данных\n"
             
@@ -1000,59 +1992,105 @@ class DatabaseService:
             
         except Exception as e:
             return False, f"Ошибка экспорта статистики: {e}"
-        finally:
-            session.close()
 
-    def get_stats_summary(self) -> dict:
+    def get_stats_summary(self, refresh: bool = False) -> dict:
         """
-        Получение краткой статистики для отображения в UI
+        Сводная статистика для UI, автосохранения и экспорта (снимок StatsEngine).
+        Снимок пересчитывается одним запросом, только если данные менялись
+        через этот сервис или передан refresh=True. Если в приблизительном режиме
+        эскизов нет, их пересчет ставится задачей планировщика, а до его окончания
+        отдается точная сводка - полный проход по packet_data в потоке вызывающего не идет
         """
+        if self.stats_snapshot is not None and not refresh:
+            return self.stats_snapshot
+        
         try:
             session = self.get_session()
-            
-            # Основные метрики
-            total_packets = session.query(func.count(PacketData.id)).scalar() or 0
-            unique_protocols = session.query(PacketData.protocol).filter(
-                PacketData.protocol.isnot(None),
-                PacketData.protocol != '',
-                PacketData.protocol != '-'
-            ).distinct().count()
-            
-            unique_ips = session.query(PacketData.source_ip).filter(
-                PacketData.source_ip.isnot(None),
-                PacketData.source_ip != '',
-                PacketData.source_ip != '-'
-            ).distinct().count()
-            
-            total_traffic = session.query(func.sum(PacketData.packet_size)).scalar() or 0
-            
-            # Топ протоколов
-            top_protocols = session.query(
-                PacketData.protocol,
-                func.count(PacketData.id).label('count')
-            ).filter(
-                PacketData.protocol.isnot(None),
-                PacketData.protocol != '',
-                PacketData.protocol != '-'
-            ).group_by(PacketData.protocol).order_by(func.count(PacketData.id).desc()).limit(5).all()
-            
-            from datetime import datetime
-            return {
-                'total_packets': total_packets,
-                'unique_protocols': unique_protocols,
-                'unique_ips': unique_ips,
-                'total_traffic': total_traffic,
-                'top_protocols': [{'protocol': p[0], 'count': p[1]} for p in top_protocols],
-                'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
+            engine = StatsEngine(session)
+            sketches = self._stored_sketches(session) if self.approximate_stats else None
+            if sketches is not None:
+                self.stats_snapshot = engine.compute_approximate(sketches)
+            else:
+                if self.approximate_stats:
+                    self.schedule_sketch_rebuild()
+                self.stats_snapshot = engine.compute()
+            return self.stats_snapshot
             
         except Exception as e:
+            session.rollback()
             return {'error': str(e)}
         finally:
             session.close()
 
-    def create_sql_backup_manual(self, backup_path: str = None) -> Tuple[bool, str]:
-       
+    def set_approximate_stats(self, enabled: bool) -> Tuple[bool, str]:
+        """
+        Включение приблизительной сводки: число различных адресов и протоколов
+        оценивает HyperLogLog, верхние разрезы - Space-Saving. Эскизы ведутся
+        загрузками и хранятся в stats_sketches; сводка строится без чтения packet_data
+        """
+        self.approximate_stats = enabled
+        self.stats_snapshot = None
+        if not enabled:
+            return True, "Сводная статистика считается точно"
+        stats = self.get_stats_summary()
+        if 'error' in stats:
+            self.approximate_stats = False
+            return False, f"Ошибка подготовки приблизительной статистики: {stats['error']}"
+        task = self._sketch_task
+        if not stats.get('approximate') and task is not None and not task.finished.is_set():
+            return True, "Эскизы статистики пересчитываются в фоне, до окончания сводка считается точно"
+        return True, "Сводная статистика считается приблизительно (эскизы)"
+    
+    def rebuild_stats_sketches(self) -> Tuple[bool, str]:
+        """Пересчет эскизов одним потоковым проходом по packet_data"""
+        try:
+            session = self.get_session()
+            sketches = self._build_sketches(session)
+            self._write_sketches(session, sketches)
+            session.commit()
+            self.stats_snapshot = None
+            return True, f"Эскизы статистики пересчитаны ({sketches.totals['packets']} пакетов)"
+        except Exception as e:
+            session.rollback()
+            return False, f"Ошибка пересчета эскизов статистики: {e}"
+        finally:
+            session.close()
+    
+    def schedule_sketch_rebuild(self) -> Optional[Task]:
+        """
+        Пересчет эскизов (rebuild_stats_sketches) задачей 'maintenance' планировщика;
+        пока задача не завершилась, повторно не ставится. Без планировщика - None,
+        эскизы пересчитывает явный вызов rebuild_stats_sketches
+        """
+        if self.scheduler is None:
+            return None
+        with self._sketch_lock:
+            if self._sketch_task is None or self._sketch_task.finished.is_set():
+                self._sketch_task = self.scheduler.submit('maintenance', self.rebuild_stats_sketches,
+                                                          name="Пересчет эскизов статистики")
+            return self._sketch_task
+    
+    def _stored_sketches(self, session: Session) -> Optional[PacketSketches]:
+        """Сохраненные эскизы или None, если их нет (удалены upsert-ом или не велись)"""
+        records = {sketch.name: sketch.data for sketch in session.query(StatsSketch)}
+        return PacketSketches.from_records(records) if records else None
+    
+    def _build_sketches(self, session: Session, chunk_rows: int = PacketBulkLoader.CHUNK_ROWS) -> PacketSketches:
+        columns = ('source_ip', 'destination_ip', 'packet_size', 'protocol_id')
+        sketches = PacketSketches()
+        result = session.execute(select(PacketData.source_ip, PacketData.destination_ip,
+                                        PacketData.packet_size, PacketData.protocol_id
+                                        ).execution_options(yield_per=chunk_rows))
+        for partition in result.partitions():
+            sketches.add_rows(columns, [tuple(row) for row in partition])
+        return sketches
+    
+    def create_sql_backup_manual(self, backup_path: str = None,
+                                 cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str]:
+        """
+        SQL резервная копия таблиц. Отмена cancel_token проверяется между пачками
+        INSERT и прерывает выполняющийся SELECT; неполный файл копии удаляется
+        """
         try:
             if backup_path is None:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -1068,31 +2106,38 @@ class DatabaseService:
             
             session = self.get_session()
             
-            with open(backup_path, 'w', encoding='utf-8') as f:
+            with open(backup_path, 'w', encoding='utf-8') as f, self._interrupt_on_cancel(session, cancel_token):
                 # Записываем заголовок
                 f.write("-- Резервная копия базы данных Network Monitor\n")
                 f.write(f"-- Создана: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
                 f.write(f"-- База данных: network_monitor\n")
                 f.write("SET client_encoding = 'UTF8';\n\n")
                 
+                # Захваты и протоколы восстанавливаются первыми: на них ссылается packet_data
+                self._backup_table_data(session, f, 'captures', [
+                    'id', 'source_file', 'created_at'
+                ], cancel_token)
+                
+                self._backup_table_data(session, f, 'protocols', ['id', 'name'], cancel_token)
+                
                 # 1. Резервное копирование таблицы packet_data
                 self._backup_table_data(session, f, 'packet_data', [
-                    'id', 'packet_number', 'timestamp', 'source_ip', 'destination_ip',
-                    'source_port', 'destination_port', 'packet_size', 'protocol', 'created_at'
-                ])
+                    'id', 'capture_id', 'packet_number', 'timestamp', 'source_ip', 'destination_ip',
+                    'source_port', 'destination_port', 'packet_size', 'protocol_id', 'created_at'
+                ], cancel_token)
                 
                 # 2. Резервное копирование таблицы protocol_stats
                 self._backup_table_data(session, f, 'protocol_stats', [
                     'id', 'protocol_name', 'packet_count', 'total_size', 'avg_size', 'created_at'
-                ])
+                ], cancel_token)
                 
                 # 3. Резервное копирование таблицы ip_stats
                 self._backup_table_data(session, f, 'ip_stats', [
                     'id', 'ip_address', 'role', 'packet_count', 'total_traffic', 'created_at'
-                ])
+                ], cancel_token)
                 
                 f.write("\n-- Резервное копирование завершено успешно\n")
-                f.write(f"-- Всего таблиц: 3\n")
+                f.write(f"-- Всего таблиц: 5\n")
                 f.write(f"-- Время завершения: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             
             file_size = os.path.getsize(backup_path)
@@ -1101,13 +2146,20 @@ class DatabaseService:
             return True, f"SQL резервная копия создана: {backup_path} ({file_size_mb:.2f} MB)"
             
         except Exception as e:
+            if is_cancelled(cancel_token):
+                self.get_session().rollback()
+                if backup_path and os.path.exists(backup_path):
+                    os.remove(backup_path)
+                return False, "Резервное копирование отменено, неполный файл копии удален"
             return False, f"Ошибка создания резервной копии: {str(e)}"
     
-    def _backup_table_data(self, session, file_handle, table_name: str, columns: List[str]):
+    def _backup_table_data(self, session, file_handle, table_name: str, columns: List[str],
+                           cancel_token: Optional[CancelToken] = None):
         """
         Резервное копирование данных конкретной таблицы
         """
         try:
+            check_cancelled(cancel_token)
             file_handle.write(f"\n-- Резервное копирование таблицы {table_name}\n")
             file_handle.write(f"DELETE FROM {table_name};\n\n")
             
@@ -1121,6 +2173,7 @@ class DatabaseService:
             
             batch_size = 100  # Вставляем пачками по 100 записей
             for i in range(0, len(rows), batch_size):
+                check_cancelled(cancel_token)
                 batch = rows[i:i + batch_size]
                 insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES\n"
                 
@@ -1147,9 +2200,12 @@ class DatabaseService:
             file_handle.write(f"\n-- Всего записей в {table_name}: {len(rows)}\n\n")
             
         except Exception as e:
+            # Отмена прерывает всю копию, а не только текущую таблицу
+            if is_cancelled(cancel_token):
+                raise
             file_handle.write(f"-- Ошибка резервного копирования таблицы {table_name}: {str(e)}\n\n")
     
-    def auto_create_backup(self) -> Tuple[bool, str]:
+    def auto_create_backup(self, cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str]:
         """
         Автоматическое создание резервной копии (вызывается по расписанию)
         """
@@ -1157,7 +2213,7 @@ class DatabaseService:
             print(f"Запуск автоматического резервного копирования: {datetime.now()}")
             
             # Создаем SQL бэкап
-            success, message = self.create_sql_backup_manual()
+            success, message = self.create_sql_backup_manual(cancel_token=cancel_token)
             
             if success:
                 return True, f"Автоматическое резервное копирование завершено. {message}"
@@ -1222,7 +2278,23 @@ class DatabaseService:
                     except Exception as e:
                         print(f"Ошибка выполнения команды: {command[:100]}... - {e}")
             
+            # Восстановленные пакеты секционированной таблицы попали в секцию по умолчанию
+            PacketPartitions(session).split_default()
+            # Сводки в копии могли не совпадать с пакетами (старые версии пересчитывали их вручную)
+            StatsRollups(session).rebuild()
+            # Эскизов нет в копии - пересчитываются при чтении приблизительной сводки
+            session.query(StatsSketch).delete()
+            
+            # Строки восстановлены с явными id - счетчики продолжаются после них,
+            # иначе новый протокол или пакет получит уже занятый id
+            for table_name in ('captures', 'protocols', 'packet_data', 'protocol_stats', 'ip_stats'):
+                session.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), "
+                    f"COALESCE(MAX(id), 0) + 1, false) FROM {table_name}"))
+            
             session.commit()
+            self.protocol_registry.clear()
+            self._stats_changed()
             return True, f"База данных восстановлена из резервной копии: {backup_path}"
             
         except Exception as e:
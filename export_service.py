@@ -1,30 +1,100 @@
 ﻿import json
 import pandas as pd
 import openpyxl
-from datetime import datetime
+from openpyxl.utils import get_column_letter
+from datetime import date, datetime
+from decimal import Decimal
 from typing import List, Dict, Any, Tuple, Optional
 import os
 import gc
 import math
 
+from services.packet_batch import PacketBatch
+from services.task_scheduler import CancelToken, check_cancelled, is_cancelled
+
 class ExportService:
     
     @staticmethod
-    def export_to_json(data: Dict[str, Any], file_path: str, export_options: Optional[Dict] = None) -> Tuple[bool, str]:
+    def _prepare_data(data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Колоночный буфер PacketBatch в data['data'] заменяется представлением строк
+        без копирования данных в список словарей
+        """
+        rows = data.get('data')
+        if isinstance(rows, PacketBatch):
+            data = dict(data)
+            data['data'] = rows.as_export_rows()
+            if not data.get('columns'):
+                data['columns'] = list(PacketBatch.EXPORT_COLUMNS)
+        return data
+    
+    @staticmethod
+    def _excel_frame(rows, columns) -> pd.DataFrame:
+        """DataFrame для XLSX: Excel не хранит часовой пояс, время TIMESTAMPTZ записывается без него"""
+        df = pd.DataFrame(rows, columns=columns)
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.DatetimeTZDtype):
+                df[col] = df[col].dt.tz_localize(None)
+            elif df[col].dtype == 'object':
+                first = df[col].dropna().head(1)
+                if len(first) and isinstance(first.iloc[0], datetime) and first.iloc[0].tzinfo is not None:
+                    df[col] = df[col].map(lambda value: value.replace(tzinfo=None)
+                                          if isinstance(value, datetime) else value)
+        return df
+    
+    @staticmethod
+    def _excel_value(value):
+        """Значение ячейки для записи строками openpyxl: время без часового пояса, адреса строкой"""
+        if isinstance(value, datetime):
+            return value.replace(tzinfo=None)
+        if value is None or isinstance(value, (str, int, float, bool, date, Decimal)):
+            return value
+        return str(value)
+    
+    @staticmethod
+    def _row_batches(data: Dict[str, Any], batch_size: int):
+        """
+        Строки порциями: data['batches'] - итератор порций потоковой выборки
+        (DatabaseService.stream_filtered_data), иначе срезы списка data['data']
+        """
+        if data.get('batches') is not None:
+            yield from data['batches']
+            return
+        rows = data['data']
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+    
+    @staticmethod
+    def _discard_cancelled(result: Tuple[bool, str], file_path: str,
+                           cancel_token: Optional[CancelToken]) -> Tuple[bool, str]:
+        """Результат записи файла: неполный файл отмененного экспорта удаляется"""
+        if result[0] or not is_cancelled(cancel_token):
+            return result
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return False, "Экспорт отменен, неполный файл удален"
+    
+    @staticmethod
+    def export_to_json(data: Dict[str, Any], file_path: str, export_options: Optional[Dict] = None,
+                       cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str]:
         """
-        Экспорт данных в JSON формат без ограничений на количество записей
+        Экспорт данных в JSON формат без ограничений на количество записей.
+        Отмена cancel_token проверяется между порциями записи
         """
         try:
             if export_options is None:
                 export_options = {}
             
-            total_records = len(data['data'])
-            
+            data = ExportService._prepare_data(data)
+            # Порции потоковой выборки из БД записываются только потоково
+            if data.get('batches') is not None:
+                result = ExportService._export_json_streaming(data, file_path, export_options, cancel_token)
             # Для очень больших файлов используем потоковую запись
-            if export_options.get('stream_large_files', False) and total_records > 10000:
-                return ExportService._export_json_streaming(data, file_path, export_options)
+            elif export_options.get('stream_large_files', False) and len(data['data']) > 10000:
+                result = ExportService._export_json_streaming(data, file_path, export_options, cancel_token)
             else:
-                return ExportService._export_json_standard(data, file_path, export_options)
+                result = ExportService._export_json_standard(data, file_path, export_options, cancel_token)
+            return ExportService._discard_cancelled(result, file_path, cancel_token)
                 
         except Exception as e:
             error_msg = f"Ошибка при экспорте в JSON: {str(e)}"
@@ -32,7 +102,8 @@ class ExportService:
             return False, error_msg
     
     @staticmethod
-    def _export_json_standard(data: Dict[str, Any], file_path: str, export_options: Dict) -> Tuple[bool, str]:
+    def _export_json_standard(data: Dict[str, Any], file_path: str, export_options: Dict,
+                              cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str]:
         """Стандартный экспорт в JSON для небольших объемов данных"""
         try:
             export_data = {
@@ -62,6 +133,7 @@ class ExportService:
                 export_data["data"].append(row_dict)
             
             # Записываем весь файл
+            check_cancelled(cancel_token)
             with open(file_path, 'w', encoding='utf-8') as f:
                 json.dump(export_data, f, indent=2, ensure_ascii=False, default=str)
             
@@ -75,12 +147,25 @@ class ExportService:
             return False, f"Ошибка стандартного экспорта: {str(e)}"
     
     @staticmethod
-    def _export_json_streaming(data: Dict[str, Any], file_path: str, export_options: Dict) -> Tuple[bool, str]:
-        """Потоковый экспорт в JSON для больших объемов данных"""
+    def _export_json_streaming(data: Dict[str, Any], file_path: str, export_options: Dict,
+                               cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str]:
+        """
+        Потоковый экспорт в JSON для больших объемов данных. Для порций data['batches']
+        число записей заранее неизвестно - блок metadata пишется после данных
+        """
         try:
-            total_records = len(data['data'])
+            streamed = data.get('batches') is not None
+            total_records = None if streamed else len(data['data'])
             batch_size = export_options.get('batch_size', 10000)
             
+            def write_metadata(f, total, last):
+                f.write('  "metadata": {\n')
+                f.write(f'    "total_records": {total},\n')
+                f.write(f'    "export_format": "JSON",\n')
+                f.write(f'    "exported_at": "{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}",\n')
+                f.write(f'    "file_size_estimate": "large_streaming"\n')
+                f.write('  }\n' if last else '  },\n')
+            
             with open(file_path, 'w', encoding='utf-8') as f:
                 # Записываем начало файла
                 f.write('{\n')
@@ -97,40 +182,43 @@ class ExportService:
                     f.write('\n')
                 
                 f.write('  ],\n')
-                f.write('  "metadata": {\n')
-                f.write(f'    "total_records": {total_records},\n')
-                f.write(f'    "export_format": "JSON",\n')
-                f.write(f'    "exported_at": "{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}",\n')
-                f.write(f'    "file_size_estimate": "large_streaming"\n')
-                f.write('  },\n')
+                if not streamed:
+                    write_metadata(f, total_records, last=False)
                 f.write('  "data": [\n')
                 
                 # Потоковая запись данных
-                for i, row in enumerate(data['data']):
-                    row_dict = {}
-                    for j, col in enumerate(columns):
-                        value = row[j] if j < len(row) else None
-                        if hasattr(value, 'isoformat'):
-                            value = value.isoformat()
-                        elif value is None:
-                            value = ""
-                        row_dict[col] = value
-                    
-                    # Записываем строку
-                    json_line = json.dumps(row_dict, ensure_ascii=False, default=str)
-                    f.write('    ' + json_line)
+                written = 0
+                for batch in ExportService._row_batches(data, batch_size):
+                    check_cancelled(cancel_token)
+                    for row in batch:
+                        row_dict = {}
+                        for j, col in enumerate(columns):
+                            value = row[j] if j < len(row) else None
+                            if hasattr(value, 'isoformat'):
+                                value = value.isoformat()
+                            elif value is None:
+                                value = ""
+                            row_dict[col] = value
+                        
+                        # Записываем строку
+                        json_line = json.dumps(row_dict, ensure_ascii=False, default=str)
+                        if written:
+                            f.write(',\n')
+                        f.write('    ' + json_line)
+                        written += 1
                     
-                    if i < total_records - 1:
-                        f.write(',')
-                    f.write('\n')
-                    
-                    # Периодически сбрасываем буфер
-                    if i % batch_size == 0:
-                        f.flush()
-                        os.fsync(f.fileno())
+                    # Сбрасываем буфер после каждой порции
+                    f.flush()
+                    os.fsync(f.fileno())
                 
                 # Записываем конец файла
-                f.write('  ]\n')
+                if written:
+                    f.write('\n')
+                if streamed:
+                    f.write('  ],\n')
+                    write_metadata(f, written, last=True)
+                else:
+                    f.write('  ]\n')
                 f.write('}\n')
             
             return True, "Успешный потоковый экспорт"
@@ -139,21 +227,25 @@ class ExportService:
             return False, f"Ошибка потокового экспорта: {str(e)}"
     
     @staticmethod
-    def export_to_xlsx(data: Dict[str, Any], file_path: str, export_options: Optional[Dict] = None) -> Tuple[bool, str]:
+    def export_to_xlsx(data: Dict[str, Any], file_path: str, export_options: Optional[Dict] = None,
+                       cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str]:
         """
-        Экспорт данных в XLSX формат без ограничений на количество записей
+        Экспорт данных в XLSX формат без ограничений на количество записей.
+        Отмена cancel_token проверяется между порциями записи
         """
         try:
             if export_options is None:
                 export_options = {}
             
-            total_records = len(data['data'])
-            
+            data = ExportService._prepare_data(data)
+            if data.get('batches') is not None:
+                result = ExportService._export_xlsx_streaming(data, file_path, export_options, cancel_token)
             # Для очень больших файлов используем пакетную обработку
-            if export_options.get('stream_large_files', False) and total_records > 50000:
-                return ExportService._export_xlsx_batched(data, file_path, export_options)
+            elif export_options.get('stream_large_files', False) and len(data['data']) > 50000:
+                result = ExportService._export_xlsx_batched(data, file_path, export_options, cancel_token)
             else:
-                return ExportService._export_xlsx_standard(data, file_path, export_options)
+                result = ExportService._export_xlsx_standard(data, file_path, export_options, cancel_token)
+            return ExportService._discard_cancelled(result, file_path, cancel_token)
                 
         except Exception as e:
             error_msg = f"Ошибка при экспорте в XLSX: {str(e)}"
@@ -161,14 +253,13 @@ class ExportService:
             return False, error_msg
     
     @staticmethod
-    def _export_xlsx_standard(data: Dict[str, Any], file_path: str, export_options: Dict) -> Tuple[bool, str]:
+    def _export_xlsx_standard(data: Dict[str, Any], file_path: str, export_options: Dict,
+                              cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str]:
         """Стандартный экспорт в XLSX"""
         try:
             # Создаем DataFrame со всеми данными
-            df = pd.DataFrame(
-                data['data'],
-                columns=data['columns']
-            )
+            rows = data['data'] if isinstance(data['data'], list) else list(data['data'])
+            df = ExportService._excel_frame(rows, data['columns'])
             
             # Оптимизация памяти для больших DataFrame
             if len(df) > 10000:
@@ -176,6 +267,7 @@ class ExportService:
                     if df[col].dtype == 'object':
                         df[col] = df[col].astype('string')
             
+            check_cancelled(cancel_token)
             with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
                 # Лист с данными
                 df.to_excel(writer, sheet_name='Данные анализа', index=False)
@@ -244,7 +336,8 @@ class ExportService:
             return False, f"Ошибка стандартного экспорта в XLSX: {str(e)}"
     
     @staticmethod
-    def _export_xlsx_batched(data: Dict[str, Any], file_path: str, export_options: Dict) -> Tuple[bool, str]:
+    def _export_xlsx_batched(data: Dict[str, Any], file_path: str, export_options: Dict,
+                             cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str]:
         """Пакетный экспорт в XLSX для очень больших объемов данных"""
         try:
             total_records = len(data['data'])
@@ -254,15 +347,13 @@ class ExportService:
             with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
                 # Экспортируем данные пакетами
                 for batch_num in range(num_batches):
+                    check_cancelled(cancel_token)
                     start_idx = batch_num * batch_size
                     end_idx = min((batch_num + 1) * batch_size, total_records)
                     
                     batch_data = data['data'][start_idx:end_idx]
                     
-                    df_batch = pd.DataFrame(
-                        batch_data,
-                        columns=data['columns']
-                    )
+                    df_batch = ExportService._excel_frame(batch_data, data['columns'])
                     
                     sheet_name = f'Данные_{batch_num + 1}'
                     if num_batches == 1:
@@ -322,26 +413,89 @@ class ExportService:
         except Exception as e:
             return False, f"Ошибка пакетного экспорта в XLSX: {str(e)}"
     
+    @staticmethod
+    def _export_xlsx_streaming(data: Dict[str, Any], file_path: str, export_options: Dict,
+                               cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str]:
+        """
+        Экспорт порций потоковой выборки в XLSX. Книга write_only сразу пишет строки
+        во временные файлы листов, поэтому память не растет с числом записей.
+        Автоподбор ширины колонок в этом режиме недоступен - ширина задается заранее
+        """
+        sheets = []
+        try:
+            sheet_rows = export_options.get('batch_size', 100000)  # 100k записей на лист
+            columns = data['columns']
+            workbook = openpyxl.Workbook(write_only=True)
+            total_records = 0
+            
+            def new_sheet():
+                sheet = workbook.create_sheet('Данные анализа' if not sheets else f'Данные_{len(sheets) + 1}')
+                for index, col in enumerate(columns, start=1):
+                    sheet.column_dimensions[get_column_letter(index)].width = max(len(str(col)) + 2, 20)
+                sheet.append(columns)
+                sheets.append(sheet)
+                return sheet
+            
+            sheet = new_sheet()
+            sheet_count = 0
+            for batch in data['batches']:
+                check_cancelled(cancel_token)
+                for row in batch:
+                    if sheet_count >= sheet_rows:
+                        sheet = new_sheet()
+                        sheet_count = 0
+                    sheet.append([ExportService._excel_value(value) for value in row])
+                    sheet_count += 1
+                    total_records += 1
+            
+            meta_sheet = workbook.create_sheet('Метаданные')
+            meta_sheet.column_dimensions['A'].width = 35
+            meta_sheet.column_dimensions['B'].width = 50
+            meta_sheet.append(['Параметр', 'Значение'])
+            for row in [
+                ('Название анализа', data.get('name', 'Unknown')),
+                ('Время анализа', data.get('timestamp', 'Unknown')),
+                ('Время экспорта', datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+                ('Всего записей', total_records),
+                ('Количество колонок', len(columns)),
+                ('Количество листов', len(sheets)),
+                ('Записей на листе', sheet_rows)
+            ]:
+                meta_sheet.append(list(row))
+            
+            workbook.save(file_path)
+            return True, f"Успешный потоковый экспорт в XLSX ({total_records} записей, {len(sheets)} листов)"
+            
+        except Exception as e:
+            # Несохраненные листы write_only закрываются, иначе их запись падает при сборке мусора
+            for sheet in sheets:
+                sheet.close()
+            return False, f"Ошибка потокового экспорта в XLSX: {str(e)}"
+    
     @staticmethod
     def export_to_both(data: Dict[str, Any], export_dir: str, base_filename: str, 
-                      export_options: Optional[Dict] = None) -> Tuple[bool, str, str]:
+                      export_options: Optional[Dict] = None,
+                      cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str, str]:
         """
         Экспорт данных в оба формата (JSON и XLSX) без ограничений
         """
         try:
             if export_options is None:
                 export_options = {}
+            # Итератор порций потоковой выборки читается один раз
+            if data.get('batches') is not None:
+                return False, "Потоковую выборку можно экспортировать только в один формат", ""
             
             json_path = os.path.join(export_dir, f"{base_filename}.json")
             xlsx_path = os.path.join(export_dir, f"{base_filename}.xlsx")
             
             # Экспорт в JSON
-            success_json, json_msg = ExportService.export_to_json(data, json_path, export_options)
+            success_json, json_msg = ExportService.export_to_json(data, json_path, export_options, cancel_token)
             if not success_json:
                 return False, json_msg, ""
             
             # Экспорт в XLSX  
-            success_xlsx, xlsx_msg = ExportService.export_to_xlsx(data, xlsx_path, export_options)
+            success_xlsx, xlsx_msg = ExportService.export_to_xlsx(data, xlsx_path, export_options, cancel_token)
             if not success_xlsx:
                 # Удаляем частично созданный JSON файл если XLSX не удался
                 if os.path.exists(json_path):
@@ -362,6 +516,7 @@ class ExportService:
         """
         try:
             preview_limit = 10  # Показываем только первые 10 записей в превью
+            data = ExportService._prepare_data(data)
             total_records = len(data.get('data', []))
             
             preview_data = {
@@ -405,6 +560,7 @@ class ExportService:
         """
         Оценка размера файлов для экспорта
         """
+        data = ExportService._prepare_data(data)
         total_records = len(data.get('data', []))
         num_columns = len(data.get('columns', []))
         
@@ -4,6 +4,8 @@ import json
 from datetime import datetime
 import os
 
+from services.task_scheduler import CancelToken
+
 class ExportTab:
     def __init__(self, parent, app):
         self.app = app
@@ -82,6 +84,12 @@ class ExportTab:
         stats_frame = ttk.Frame(main_frame)
         stats_frame.grid(row=11, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=5)
         
+        # Приблизительная сводка по эскизам - без прохода по packet_data на больших объемах
+        self.approximate_stats_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(stats_frame, text="Приблизительная статистика (HyperLogLog / Space-Saving)",
+                        variable=self.approximate_stats_var,
+                        command=self.toggle_approximate_stats).pack(side=tk.TOP, anchor=tk.W)
+        
         # Информация о статистике
         self.stats_info_label = ttk.Label(stats_frame, text="Статистика: не загружена", 
                                          font=("Arial", 9))
@@ -257,37 +265,64 @@ class ExportTab:
             messagebox.showerror("Ошибка", error_msg)
     
     def export_all_data(self):
-        """Экспорт всех данных без ограничений"""
+        """
+        Экспорт всех данных без ограничений: строки потоковой выборки порциями
+        пишутся прямо в файл (JSON или XLSX по расширению), не загружаясь в память
+        """
         if not hasattr(self.app, 'db_service') or not self.app.db_service:
             messagebox.showwarning("Внимание", "Сервис базы данных не доступен")
             return
 
-        response = messagebox.askyesno(
-            "Подтверждение", 
-            "Эта операция загрузит ВСЕ данные из базы данных без ограничений.\n"
-            "Это может занять много времени и памяти для больших наборов данных.\n\n"
-            "Продолжить?"
+        file_path = filedialog.asksaveasfilename(
+            title="Сохранить все данные",
+            defaultextension=".json",
+            filetypes=[("JSON files", "*.json"), ("Excel files", "*.xlsx"), ("All files", "*.*")]
         )
         
-        if not response:
+        if not file_path:
             return
         
+        token = CancelToken()
+        
         def task():
-            self.app.data_management_tab.show_progress()
-            self.app.data_management_tab.update_progress_text("Загрузка всех данных...")
+            success, result = self.app.db_service.stream_all_data()
+            if not success:
+                self.app.progress_queue.put(('complete', (False, result)))
+                return
+            
+            columns, batches = result
+            exported = [0]
             
-            success, result = self.app.db_service.get_all_data()
+            def counted_batches():
+                for batch in batches:
+                    yield batch
+                    exported[0] += len(batch)
+                    self.app.call_in_main(self.app.update_progress_text, f"Экспортировано {exported[0]} записей...")
+            
+            data = {
+                'columns': columns,
+                'batches': counted_batches(),
+                'name': "Все данные из базы данных",
+                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+            export = (self.app.export_service.export_to_xlsx if file_path.lower().endswith('.xlsx')
+                      else self.app.export_service.export_to_json)
+            try:
+                success, message = export(data, file_path, {'stream_large_files': True}, token)
+            finally:
+                batches.close()
             
             if success:
-                columns, data = result
-                analysis_name = "Все данные из базы данных"
-
-                self.app.root.after(0, lambda: self.update_export_preview(columns, data, analysis_name))
-                self.app.progress_queue.put(('complete', (True, f"Загружено {len(data)} записей")))
+                file_size_mb = os.path.getsize(file_path) / (1024 * 1024) if os.path.exists(file_path) else 0
+                status_text = f"Все данные экспортированы: {file_path} ({exported[0]} записей, {file_size_mb:.2f} MB)"
+                self.app.call_in_main(self.export_status.config, {'text': status_text})
+                self.app.progress_queue.put(('complete', (True, status_text)))
             else:
-                self.app.progress_queue.put(('complete', (False, result)))
+                self.app.progress_queue.put(('complete', (False, message)))
         
-        self.app.run_in_thread(task)
+        self.app.show_progress()
+        self.app.update_progress_text("Потоковый экспорт всех данных...")
+        self.app.run_in_thread(task, category='export', token=token, progress=True)
     
     def clear_preview(self):
         self.app.last_analysis_result = None
@@ -301,10 +336,25 @@ class ExportTab:
         """Обновление информации о статистике"""
         def task():
             stats = self.app.db_service.get_stats_summary()
-            self.app.root.after(0, lambda: self.update_stats_display(stats))
+            self.app.call_in_main(self.update_stats_display, stats)
         
-        self.app.root.after(100, task)
+        # Снимок может считаться запросом по всей таблице - не в главном потоке Tk
+        self.app.run_in_thread(task, category='query', name="Сводная статистика")
 
+    def toggle_approximate_stats(self):
+        enabled = self.approximate_stats_var.get()
+        
+        def task():
+            success, message = self.app.db_service.set_approximate_stats(enabled)
+            self.app.progress_queue.put(('status', message))
+            if not success:
+                self.app.call_in_main(self.approximate_stats_var.set, False)
+            stats = self.app.db_service.get_stats_summary()
+            self.app.call_in_main(self.update_stats_display, stats)
+        
+        # Недостающие эскизы пересчитывает отдельная задача 'maintenance' (schedule_sketch_rebuild)
+        self.app.run_in_thread(task, category='query')
+    
     def update_stats_display(self, stats):
         """Обновление отображения статистики"""
         if 'error' in stats:
@@ -313,21 +363,30 @@ class ExportTab:
             self.stats_text.insert(1.0, f"Ошибка загрузки статистики: {stats['error']}")
             return
         
+        # Оценки эскизов помечаются знаком ≈
+        approx = "≈" if stats.get('approximate') else ""
         self.stats_info_label.config(
             text=f"Статистика: {stats['total_packets']} пакетов, "
-                 f"{stats['unique_protocols']} протоколов, "
-                 f"{stats['unique_ips']} IP-адресов, "
+                 f"{approx}{stats['unique_protocols']} протоколов, "
+                 f"{approx}{stats['unique_ips']} IP-адресов, "
                  f"обновлено: {stats['last_updated']}\n"
                  f"Файлы статистики сохраняются автоматически в C:\\Users\\Assa\\source\\repos\\network_stats"
         )
         
         # Формируем текст для отображения
         stats_text = f"Общая статистика сетевых данных\n"
+        if approx:
+            stats_text += "(приблизительно: уникальные значения и топы - оценки эскизов)\n"
         stats_text += f"Всего пакетов: {stats['total_packets']:,}\n"
-        stats_text += f"Уникальных протоколов: {stats['unique_protocols']}\n"
-        stats_text += f"Уникальных IP-адресов: {stats['unique_ips']}\n"
+        stats_text += f"Уникальных протоколов: {approx}{stats['unique_protocols']}\n"
+        stats_text += f"Уникальных IP-адресов: {approx}{stats['unique_ips']}\n"
         stats_text += f"Общий объем трафика: {stats['total_traffic']:,} байт\n"
         stats_text += f"Последнее обновление: {stats['last_updated']}\n"
         
+        if stats.get('top_protocols'):
+            stats_text += "\nТоп протоколов:\n"
+            for proto in stats['top_protocols']:
+                stats_text += f"  {proto['protocol']}: {approx}{proto['count']:,} пакетов\n"
+        
         self.stats_text.delete(1.0, tk.END)
         self.stats_text.insert(1.0, stats_text)
\ No newline at end of file
@@ -1,54 +1,62 @@
-﻿import re
-from typing import List, Dict, Optional, Callable
+﻿import os
+import re
+import mmap
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from operator import itemgetter
+from typing import List, Dict, Optional, Callable, Iterator, Tuple
+
+from services.packet_batch import PacketBatch
+from services.task_scheduler import CancelToken, TaskCancelled, check_cancelled, is_cancelled
+
+# Токенизатор строки пакета: одно предкомпилированное выражение извлекает
+# все девять колонок за один проход вместо split/strip/re.sub по каждому полю
+_ROW_PATTERN = re.compile(
+    r'║\s*(?P<number>\d+)\s*│'
+    r'(?P<timestamp>[^│]*)│'
+    r'(?P<source_ip>[^│]*)│'
+    r'(?P<destination_ip>[^│]*)│'
+    r'(?P<source_port>[^│]*)│'
+    r'(?P<destination_port>[^│]*)│'
+    r'(?P<size>[^│]*)│'
+    r'(?P<flags>[^│]*)│'
+    r'(?P<protocol>[^│║]*)'
+)
+
+# Таблица замены для clean_text: рамки, дефисы и пробельные символы -> пробел
+_CLEAN_TABLE = str.maketrans({ch: ' ' for ch in '║│-\t\n\r\x0b\x0c\xa0'})
+
+def _parse_byte_range(file_path: str, start: int, end: int, sort: bool = True) -> PacketBatch:
+    """
+    Разбор диапазона байт [start, end) файла лога в отдельном процессе.
+    Границы диапазона выровнены по началу строки. С sort результат отсортирован
+    по номеру пакета (для слияния частей), иначе пакеты идут в порядке файла.
+    Колоночный буфер передается между процессами значительно дешевле списка словарей
+    """
+    batch = PacketBatch.from_packets(FileParser.iter_packets_mmap(file_path, start=start, end=end))
+    return batch.sorted_by_number() if sort else batch
 
 class FileParser:
+    # Маркер строки с пакетом в байтовом представлении (символ '║' в UTF-8)
+    ROW_MARKER_BYTES = '║'.encode('utf-8')
+
+    # Параллельный разбор: файлы меньше порога разбираются в одном процессе
+    PARALLEL_MIN_BYTES = 16 * 1024 * 1024
+    PARALLEL_CHUNK_BYTES = 32 * 1024 * 1024
+
     @staticmethod
-    def parse_log_file(file_path: str, progress_callback: Optional[Callable] = None) -> List[Dict]:
+    def parse_log_file(file_path: str, progress_callback: Optional[Callable] = None,
+                       cancel_token: Optional[CancelToken] = None) -> List[Dict]:
+        """Разбор файла в список словарей. Отмена cancel_token прерывает разбор исключением TaskCancelled"""
         packets = []
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-            
             print(f"Начало парсинга файла: {file_path}")
-            
-            lines = content.split('\n')
-            packet_lines = []
-            
-            # Ищем все строки с пакетами
-            for i, line in enumerate(lines):
-                if '║' in line and '│' in line:
-                    # Проверяем, что это строка с данными пакета
-                    if re.search(r'║\s*\d+\s*│', line):
-                        packet_lines.append((i, line))
-            
-            total_lines = len(packet_lines)
-            print(f"Найдено строк с пакетами: {total_lines}")
-            
-            for idx, (line_num, line) in enumerate(packet_lines):
-                clean_line = line.replace('║', '|').strip('|')
-                parts = [part.strip() for part in clean_line.split('│')]
-                
-                if len(parts) >= 9:
-                    packet = {
-                        'number': FileParser.clean_number(parts[0]),
-                        'timestamp': FileParser.clean_text(parts[1]),
-                        'source_ip': FileParser.clean_text(parts[2]),
-                        'destination_ip': FileParser.clean_text(parts[3]),
-                        'source_port': FileParser.parse_port(parts[4]),
-                        'destination_port': FileParser.parse_port(parts[5]),
-                        'size': FileParser.clean_number(parts[6]),
-                        'flags': FileParser.clean_text(parts[7]),
-                        'protocol': FileParser.clean_text(parts[8])
-                    }
-                    packets.append(packet)
-                
-                if progress_callback and idx % 10 == 0:
-                    progress = (idx + 1) / total_lines * 100
-                    progress_callback(progress, f"Обработано {idx + 1}/{total_lines} пакетов")
-            
+
+            packets = list(FileParser.iter_packets_mmap(file_path, progress_callback, cancel_token=cancel_token))
+
             if progress_callback:
                 progress_callback(100, f"Парсинг завершен. Обработано {len(packets)} пакетов")
-            
+
             if packets:
                 protocols = set(p['protocol'] for p in packets if p['protocol'])
                 print(f"Найдено протоколов: {protocols}")
@@ -59,29 +67,315 @@ class FileParser:
                 print("Последние 5 пакетов:")
                 for i, p in enumerate(packets[-5:]):
                     print(f"  {i+1}. №{p['number']} | {p['source_ip']} -> {p['destination_ip']} | Протокол: {p['protocol']}")
-            
+
             return packets
-            
+
+        except TaskCancelled:
+            print(f"Парсинг файла отменен: {file_path}")
+            raise
         except Exception as e:
             print(f"Ошибка парсинга файла: {e}")
             import traceback
             traceback.print_exc()
             return []
-    
+
+    @staticmethod
+    def parse_log_file_batch(file_path: str, progress_callback: Optional[Callable] = None,
+                             workers: Optional[int] = None,
+                             cancel_token: Optional[CancelToken] = None) -> PacketBatch:
+        """
+        Разбор файла в колоночный буфер PacketBatch без промежуточного списка словарей.
+        Большие файлы разбираются параллельно. Отмена - как у parse_log_file
+        """
+        try:
+            print(f"Начало парсинга файла: {file_path}")
+
+            if os.path.getsize(file_path) < FileParser.PARALLEL_MIN_BYTES or workers == 1:
+                batch = PacketBatch.from_packets(FileParser.iter_packets_mmap(file_path, progress_callback,
+                                                                              cancel_token=cancel_token))
+            else:
+                batch = FileParser._parse_parallel(file_path, progress_callback, workers, cancel_token)
+
+            if progress_callback:
+                progress_callback(100, f"Парсинг завершен. Обработано {len(batch)} пакетов")
+
+            print(f"Найдено протоколов: {batch.protocols()}")
+            print(f"Всего пакетов: {len(batch)}, память буфера: {batch.nbytes / 1024 / 1024:.1f} MB")
+            return batch
+
+        except TaskCancelled:
+            print(f"Парсинг файла отменен: {file_path}")
+            raise
+        except Exception as e:
+            print(f"Ошибка парсинга файла: {e}")
+            import traceback
+            traceback.print_exc()
+            return PacketBatch()
+
+    @staticmethod
+    def parse_log_file_parallel(file_path: str, progress_callback: Optional[Callable] = None,
+                                workers: Optional[int] = None,
+                                cancel_token: Optional[CancelToken] = None) -> List[Dict]:
+        """Параллельный разбор с результатом в виде списка словарей (как у parse_log_file)"""
+        return list(FileParser.parse_log_file_batch(file_path, progress_callback, workers, cancel_token))
+
+    @staticmethod
+    def _parse_parallel(file_path: str, progress_callback: Optional[Callable] = None,
+                        workers: Optional[int] = None, cancel_token: Optional[CancelToken] = None) -> PacketBatch:
+        """
+        Параллельный разбор больших логов: файл делится на диапазоны байт, выровненные
+        по переводу строки, каждый диапазон разбирается в процессе ProcessPoolExecutor,
+        результаты сливаются в порядке номеров пакетов
+        """
+        file_size = os.path.getsize(file_path)
+        workers = workers or os.cpu_count() or 1
+        chunks_count = max(workers, -(-file_size // FileParser.PARALLEL_CHUNK_BYTES))
+        ranges = FileParser.split_file_ranges(file_path, chunks_count)
+
+        print(f"Параллельный разбор файла: {file_path} ({len(ranges)} диапазонов, процессов: {workers})")
+
+        chunk_results = []
+        parsed_bytes = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_parse_byte_range, file_path, start, end): (start, end)
+                       for start, end in ranges}
+            for future in as_completed(futures):
+                FileParser._check_cancelled(executor, cancel_token)
+                start, end = futures[future]
+                chunk_results.append((start, future.result()))
+                parsed_bytes += end - start
+
+                if progress_callback:
+                    progress_callback(parsed_bytes / file_size * 100,
+                                      f"Разобрано {len(chunk_results)}/{len(ranges)} частей файла")
+
+        # Части уже отсортированы внутри процессов - остается слияние
+        chunk_results.sort(key=itemgetter(0))
+        return PacketBatch.merge_sorted([chunk for _, chunk in chunk_results])
+
+    @staticmethod
+    def iter_batches(file_path: str, batch_size: int = 50000, progress_callback: Optional[Callable] = None,
+                     workers: Optional[int] = None, chunk_bytes: int = PARALLEL_CHUNK_BYTES,
+                     cancel_token: Optional[CancelToken] = None) -> Iterator[PacketBatch]:
+        """
+        Потоковый разбор файла порциями PacketBatch в порядке следования в файле.
+        Большие файлы (или при явном workers > 1) разбираются диапазонами по chunk_bytes
+        в процессах, порция - один диапазон. Одновременно в работе не больше workers
+        диапазонов - память ограничена независимо от размера файла. Порции отдаются
+        по порядку диапазонов: очередь ждет самый ранний диапазон, даже если более
+        поздние уже разобраны, а внутри диапазона пакеты не пересортировываются.
+        Отмена cancel_token проверяется перед каждой порцией
+        """
+        file_size = os.path.getsize(file_path)
+
+        if workers == 1 or (workers is None and file_size < FileParser.PARALLEL_MIN_BYTES):
+            batch = PacketBatch()
+            for packet in FileParser.iter_packets_mmap(file_path, progress_callback, cancel_token=cancel_token):
+                batch.append(packet)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = PacketBatch()
+            if batch:
+                yield batch
+            return
+
+        workers = workers or os.cpu_count() or 1
+        chunks_count = max(workers, -(-file_size // chunk_bytes))
+        ranges = FileParser.split_file_ranges(file_path, chunks_count)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for start, end in ranges:
+                pending.append((end, executor.submit(_parse_byte_range, file_path, start, end, False)))
+                if len(pending) < workers:
+                    continue
+                end, future = pending.popleft()
+                FileParser._check_cancelled(executor, cancel_token)
+                yield future.result()
+                if progress_callback:
+                    progress_callback(end / file_size * 100, f"Разобрано {end // 1024:,} из {file_size // 1024:,} КБ")
+
+            while pending:
+                end, future = pending.popleft()
+                FileParser._check_cancelled(executor, cancel_token)
+                yield future.result()
+                if progress_callback:
+                    progress_callback(end / file_size * 100, f"Разобрано {end // 1024:,} из {file_size // 1024:,} КБ")
+
+    @staticmethod
+    def _check_cancelled(executor: ProcessPoolExecutor, cancel_token: Optional[CancelToken]):
+        """При отмене ожидающие диапазоны снимаются с пула, выход ждет только уже начатые"""
+        if is_cancelled(cancel_token):
+            executor.shutdown(cancel_futures=True)
+            check_cancelled(cancel_token)
+
+    @staticmethod
+    def split_file_ranges(file_path: str, chunks_count: int) -> List[Tuple[int, int]]:
+        """Деление файла на диапазоны байт, границы которых приходятся на начало строки"""
+        file_size = os.path.getsize(file_path)
+        boundaries = [0]
+
+        with open(file_path, 'rb') as file:
+            for i in range(1, chunks_count):
+                file.seek(file_size * i // chunks_count)
+                file.readline()
+                position = file.tell()
+                if boundaries[-1] < position < file_size:
+                    boundaries.append(position)
+
+        boundaries.append(file_size)
+        return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)]
+
+    @staticmethod
+    def iter_packets(file_path: str, progress_callback: Optional[Callable] = None) -> Iterator[Dict]:
+        """
+        Потоковый разбор файла лога: файл читается построчно, каждый пакет
+        отдается сразу после разбора его строки. Прогресс считается по прочитанным байтам,
+        поэтому потребление памяти не зависит от размера файла.
+        """
+        total_bytes = os.path.getsize(file_path) or 1
+        bytes_read = 0
+        last_percent = -1
+        packets_count = 0
+
+        with open(file_path, 'rb') as file:
+            for raw_line in file:
+                bytes_read += len(raw_line)
+
+                # Строки без маркера '║' не декодируем вовсе
+                if FileParser.ROW_MARKER_BYTES in raw_line:
+                    line = raw_line.decode('utf-8', errors='replace').rstrip('\r\n')
+                    packet = FileParser.parse_packet_line(line)
+                    if packet is not None:
+                        packets_count += 1
+                        yield packet
+
+                if progress_callback:
+                    percent = int(bytes_read * 100 / total_bytes)
+                    if percent != last_percent:
+                        last_percent = percent
+                        progress_callback(percent, f"Прочитано {bytes_read // 1024:,} из {total_bytes // 1024:,} КБ, "
+                                                   f"найдено {packets_count} пакетов")
+
+    @staticmethod
+    def iter_packets_mmap(file_path: str, progress_callback: Optional[Callable] = None,
+                          start: int = 0, end: Optional[int] = None,
+                          cancel_token: Optional[CancelToken] = None) -> Iterator[Dict]:
+        """
+        Разбор через mmap без декодирования всего файла: маркеры строк '║' ищутся
+        как байты, в str декодируется только срез от маркера до конца строки.
+        Подходит для файлов больше объема оперативной памяти.
+        Отмена cancel_token проверяется вместе с отчетом о прогрессе - через каждый процент диапазона
+        """
+        file_size = os.path.getsize(file_path)
+        if end is None or end > file_size:
+            end = file_size
+        if start >= end:
+            return
+
+        marker = FileParser.ROW_MARKER_BYTES
+        tokenize = FileParser.tokenize_line
+        total_bytes = end - start
+        report_step = max(total_bytes // 100, 1)
+        next_report = start + report_step
+        packets_count = 0
+
+        with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            find = mm.find
+            position = start
+            while position < end:
+                row_start = find(marker, position, end)
+                if row_start < 0:
+                    break
+
+                line_end = find(b'\n', row_start, end)
+                if line_end < 0:
+                    line_end = end
+
+                packet = tokenize(mm[row_start:line_end].decode('utf-8', errors='replace'))
+                if packet is not None:
+                    packets_count += 1
+                    yield packet
+
+                position = line_end + 1
+
+                if position >= next_report:
+                    next_report = position + report_step
+                    check_cancelled(cancel_token)
+                    if progress_callback:
+                        progress_callback(min((position - start) / total_bytes * 100, 100),
+                                          f"Прочитано {(position - start) // 1024:,} из {total_bytes // 1024:,} КБ, "
+                                          f"найдено {packets_count} пакетов")
+
+    @staticmethod
+    def parse_packet_line(line: str) -> Optional[Dict]:
+        """Разбор одной строки лога. Возвращает None, если строка не содержит данных пакета"""
+        return FileParser.tokenize_line(line)
+
+    @staticmethod
+    def tokenize_line(line: str) -> Optional[Dict]:
+        """
+        Разбор строки пакета одним предкомпилированным выражением с именованными группами.
+        Поля очищаются без re.sub: strip, а str.translate - только если в поле есть что заменять
+        """
+        match = _ROW_PATTERN.search(line)
+        if match is None:
+            return None
+
+        number, timestamp, source_ip, destination_ip, source_port, destination_port, size, flags, protocol = match.groups()
+
+        return {
+            'number': int(number),
+            'timestamp': FileParser._fast_text(timestamp),
+            'source_ip': FileParser._fast_text(source_ip),
+            'destination_ip': FileParser._fast_text(destination_ip),
+            'source_port': FileParser._fast_port(source_port),
+            'destination_port': FileParser._fast_port(destination_port),
+            'size': FileParser._fast_number(size),
+            'flags': FileParser._fast_text(flags),
+            'protocol': FileParser._fast_text(protocol)
+        }
+
+    @staticmethod
+    def _fast_text(text: str) -> str:
+        cleaned = text.strip()
+        # Полная очистка (как в clean_text) нужна только для полей с дефисами и спецсимволами
+        if '-' in cleaned or '║' in cleaned or not cleaned.isprintable():
+            cleaned = cleaned.translate(_CLEAN_TABLE).strip()
+        return cleaned
+
+    @staticmethod
+    def _fast_port(text: str) -> int:
+        cleaned = FileParser._fast_text(text)
+        if not cleaned:
+            return 0
+        try:
+            return int(cleaned)
+        except ValueError:
+            return 0
+
+    @staticmethod
+    def _fast_number(text: str) -> int:
+        cleaned = text.strip()
+        if cleaned.isdecimal():
+            return int(cleaned)
+        # Редкий случай (пробелы, разделители разрядов) - прежняя медленная очистка
+        return FileParser.clean_number(text)
+
     @staticmethod
     def clean_text(text: str) -> str:
         if not text:
             return ''
         cleaned = re.sub(r'[║│\-\s]', ' ', text).strip()
         return cleaned if cleaned else ''
-    
+
     @staticmethod
     def clean_number(text: str) -> int:
         if not text or text == '-':
             return 0
         cleaned = re.sub(r'[^\d]', '', text)
         return int(cleaned) if cleaned else 0
-    
+
     @staticmethod
     def parse_port(port_text: str) -> int:
         if not port_text:
@@ -92,4 +386,4 @@ class FileParser:
         try:
             return int(cleaned)
         except:
-            return 0
\ No newline at end of file
+            return 0
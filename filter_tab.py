@@ -2,15 +2,39 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime
+import ipaddress
 import re
 
+from services.task_scheduler import CancelToken
+
+from .virtual_tree import VirtualTreeview
+from .tree_feeder import TreeFeeder
+
 class FilterTab:
+    # Сохраненные наборы фильтров: (поле, условие, значение, описание)
+    EXAMPLE_FILTERS = [
+        ("protocol", "равно", "TCP", "Только TCP пакеты"),
+        ("packet_size", "больше чем", "1000", "Крупные пакеты (>1000 байт)"),
+        ("source_ip", "начинается с", "192.168.1", "IP из сети 192.168.1.x"),
+        ("protocol", "в списке", "TCP,UDP,HTTP", "Основные протоколы"),
+        ("packet_size", "между", "100,500", "Пакеты 100-500 байт"),
+        ("destination_ip", "равно", "8.8.4.4", "Трафик к DNS серверу"),
+        ("protocol", "не равно", "ARP", "Исключить ARP пакеты"),
+        ("packet_size", "меньше чем", "100", "Мелкие пакеты (<100 байт)"),
+        ("source_ip", "в подсети", "10.0.0.0/8", "IP из сети 10.x.x.x")
+    ]
+    
     def __init__(self, parent, app):
         self.app = app
         self.frame = ttk.Frame(parent)
         self.total_records = 0
         self.current_limit = None
         self.current_offset = 0
+        # Курсоры текущей страницы (DatabaseService.get_filtered_page) для кнопок вперед/назад
+        self.page_cursors = None
+        self.current_page_rows = 0
+        # Вывод строк текущего запроса в таблицу результатов
+        self.results_feeder = None
         self.available_ips = []
         self.setup_ui()
     
@@ -227,7 +251,8 @@ class FilterTab:
         
         self.filter_condition = ttk.Combobox(filter_form_frame, values=[
             'равно', 'содержит', 'больше чем', 'меньше чем', 'больше или равно', 
-            'меньше или равно', 'не равно', 'в списке', 'между', 'начинается с', 'заканчивается на'
+            'меньше или равно', 'не равно', 'в списке', 'между', 'начинается с', 'заканчивается на',
+            'в подсети'
         ], state="readonly", width=15)
         self.filter_condition.grid(row=0, column=3, padx=5, pady=5)
         self.filter_condition.set('равно')
@@ -247,7 +272,7 @@ class FilterTab:
         ttk.Label(hints_frame, text="Подсказки:", font=("Arial", 9, "bold")).grid(row=0, column=0, sticky=tk.W)
         ttk.Label(hints_frame, text="• 'в списке': TCP,UDP,SSL", font=("Arial", 8)).grid(row=1, column=0, sticky=tk.W)
         ttk.Label(hints_frame, text="• 'между': 100,500", font=("Arial", 8)).grid(row=1, column=1, sticky=tk.W, padx=10)
-        ttk.Label(hints_frame, text="• Для IP: 192.168.1.1", font=("Arial", 8)).grid(row=1, column=2, sticky=tk.W, padx=10)
+        ttk.Label(hints_frame, text="• Для IP: 192.168.1.1 или 10.0.0.0/8", font=("Arial", 8)).grid(row=1, column=2, sticky=tk.W, padx=10)
         ttk.Label(hints_frame, text="• Для размеров: числа", font=("Arial", 8)).grid(row=1, column=3, sticky=tk.W, padx=10)
         
         # Описание текущего фильтра
@@ -263,19 +288,7 @@ class FilterTab:
         examples_frame = ttk.Frame(parent)
         examples_frame.grid(row=row+1, column=0, columnspan=4, sticky=(tk.W, tk.E), pady=5)
         
-        examples = [
-            ("protocol", "равно", "TCP", "Только TCP пакеты"),
-            ("packet_size", "больше чем", "1000", "Крупные пакеты (>1000 байт)"),
-            ("source_ip", "начинается с", "192.168.1", "IP из сети 192.168.1.x"),
-            ("protocol", "в списке", "TCP,UDP,HTTP", "Основные протоколы"),
-            ("packet_size", "между", "100,500", "Пакеты 100-500 байт"),
-            ("destination_ip", "равно", "8.8.4.4", "Трафик к DNS серверу"),
-            ("protocol", "не равно", "ARP", "Исключить ARP пакеты"),
-            ("packet_size", "меньше чем", "100", "Мелкие пакеты (<100 байт)"),
-            ("source_ip", "содержит", "10.0", "IP из сети 10.0.x.x")
-        ]
-        
-        for i, (field, condition, value, desc) in enumerate(examples):
+        for i, (field, condition, value, desc) in enumerate(self.EXAMPLE_FILTERS):
             example_frame = ttk.Frame(examples_frame)
             example_frame.grid(row=i//3, column=(i%3), sticky=tk.W, padx=5, pady=2)
             
@@ -298,6 +311,8 @@ class FilterTab:
                   command=self.next_records).grid(row=0, column=2, padx=5)
         ttk.Button(execute_frame, text="Предыдущие записи", 
                   command=self.prev_records).grid(row=0, column=3, padx=5)
+        ttk.Button(execute_frame, text="Индексы фильтров (EXPLAIN)", 
+                  command=self.show_filter_indexes).grid(row=0, column=4, padx=5)
     
     def setup_sql_section(self, parent, row):
         ttk.Label(parent, text="SQL запрос:", 
@@ -320,20 +335,10 @@ class FilterTab:
         results_container = ttk.Frame(parent)
         results_container.grid(row=row+1, column=0, columnspan=4, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
         
-        self.results_tree = ttk.Treeview(results_container, show='headings', height=8)
-        
-        # Вертикальный скроллбар
-        v_scrollbar_results = ttk.Scrollbar(results_container, orient=tk.VERTICAL, command=self.results_tree.yview)
-        self.results_tree.configure(yscrollcommand=v_scrollbar_results.set)
-        
-        # Горизонтальный скроллбар
-        h_scrollbar_results = ttk.Scrollbar(results_container, orient=tk.HORIZONTAL, command=self.results_tree.xview)
-        self.results_tree.configure(xscrollcommand=h_scrollbar_results.set)
-        
-        # Размещаем элементы
-        self.results_tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-        h_scrollbar_results.pack(side=tk.BOTTOM, fill=tk.X)
-        v_scrollbar_results.pack(side=tk.RIGHT, fill=tk.Y)
+        # Элементы создаются только для видимых строк, скроллбары - внутри VirtualTreeview
+        self.results_view = VirtualTreeview(results_container, height=8, run_in_thread=self.app.run_in_thread,
+                                            call_in_main=self.app.call_in_main, on_error=self.app.update_status)
+        self.results_view.frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
         
         # Настраиваем вес строки для правильного расширения
         parent.rowconfigure(row+1, weight=1)
@@ -363,7 +368,8 @@ class FilterTab:
             'в списке': 'любое из значений',
             'между': 'в диапазоне',
             'начинается с': 'начинается с текста',
-            'заканчивается на': 'заканчивается текстом'
+            'заканчивается на': 'заканчивается текстом',
+            'в подсети': 'адреса из подсети'
         }
         
         if field and condition:
@@ -403,6 +409,11 @@ class FilterTab:
                 ip_full_pattern = r'^(\d{1,3}\.){3}\d{1,3}$'
                 if not re.match(ip_full_pattern, value):
                     return False, "Неверный формат IP-адреса"
+            elif condition == 'в подсети':
+                try:
+                    ipaddress.ip_network(value, strict=False)
+                except ValueError:
+                    return False, "Неверный формат подсети (пример: 10.0.0.0/8)"
         
         return True, "OK"
     
@@ -443,7 +454,8 @@ class FilterTab:
             'в списке': 'в списке',
             'между': 'между',
             'начинается с': 'начинается с',
-            'заканчивается на': 'заканчивается на'
+            'заканчивается на': 'заканчивается на',
+            'в подсети': 'в подсети'
         }
         
         cond_symbol = condition_descriptions.get(condition, condition)
@@ -481,21 +493,23 @@ class FilterTab:
     
     def update_ip_list(self):
         def task():
-            self.app.data_management_tab.show_progress()
-            self.app.data_management_tab.update_progress_text("Получение списка IP-адресов...")
-            
             success, result = self.app.db_service.get_available_ips()
             
             if success:
                 self.available_ips = result
-                self.ip_combobox['values'] = self.available_ips
-                if self.available_ips:
-                    self.ip_combobox.set(self.available_ips[0])
+                self.app.call_in_main(self.show_ip_list)
                 self.app.progress_queue.put(('complete', (True, f"Получено {len(self.available_ips)} IP-адресов")))
             else:
                 self.app.progress_queue.put(('complete', (False, result)))
         
-        self.app.run_in_thread(task)
+        self.app.data_management_tab.show_progress()
+        self.app.data_management_tab.update_progress_text("Получение списка IP-адресов...")
+        self.app.run_in_thread(task, progress=True)
+    
+    def show_ip_list(self):
+        self.ip_combobox['values'] = self.available_ips
+        if self.available_ips:
+            self.ip_combobox.set(self.available_ips[0])
     
     def add_ip_filter(self):
         ip_address = self.ip_combobox.get().strip()
@@ -644,6 +658,35 @@ class FilterTab:
         self.sql_query_text.insert(1.0, query_display)
         self.filter_status.config(text=f"SQL запрос сгенерирован ({len(filters)} фильтров)")
     
+    def show_filter_indexes(self):
+        """Отчет EXPLAIN: какие индексы использует текущий набор фильтров и каждый сохраненный набор"""
+        filter_sets = []
+        current_filters = self.get_current_filters()
+        if current_filters:
+            filter_sets.append(("Текущие фильтры", current_filters))
+        filter_sets.extend((desc, [(field, condition, value)])
+                           for field, condition, value, desc in self.EXAMPLE_FILTERS)
+        limit, offset = self.get_limit_and_offset()
+        
+        def task():
+            report = "Индексы, выбранные планировщиком (EXPLAIN):\n\n"
+            for name, filters in filter_sets:
+                success, result = self.app.db_service.explain_filters(filters, limit)
+                if not success:
+                    self.app.progress_queue.put(('complete', (False, result)))
+                    return
+                
+                conditions = '; '.join(f"{field} {condition} {value}" for field, condition, value in filters)
+                indexes = ', '.join(result['indexes']) or 'нет'
+                report += f"{name} [{conditions}]\n  индексы: {indexes}\n"
+                if result['seq_scans']:
+                    report += f"  полное чтение: {', '.join(result['seq_scans'])}\n"
+            
+            self.app.call_in_main(self.set_query_text, report)
+            self.app.progress_queue.put(('complete', (True, f"Проверено наборов фильтров: {len(filter_sets)}")))
+        
+        self.app.run_in_thread(task)
+    
     def convert_to_sql_condition(self, field, condition, value):
         """Конвертирует условия фильтра в SQL"""
         conditions_map = {
@@ -678,7 +721,8 @@ class FilterTab:
             success, result = self.app.db_service.get_total_records_count()
             if success:
                 self.total_records = result
-                self.records_info_label.config(text=f"Всего записей в базе данных: {self.total_records}")
+                self.app.call_in_main(self.records_info_label.config,
+                                      {'text': f"Всего записей в базе данных: {self.total_records}"})
                 self.app.progress_queue.put(('complete', (True, f"Обновлена информация: {self.total_records} записей")))
             else:
                 self.app.progress_queue.put(('complete', (False, result)))
@@ -703,32 +747,28 @@ class FilterTab:
             return None, None
     
     def next_records(self):
-        if self.current_limit is None:
-            return
-        
-        limit, offset = self.get_limit_and_offset()
-        if limit is None:
+        # Переход по курсору последней строки страницы, без OFFSET
+        if self.current_limit is None or self.page_cursors is None:
             return
         
-        new_offset = offset + limit
-        if new_offset < self.total_records:
-            self.offset_var.set(str(new_offset))
-            self.execute_filtered_query()
+        if self.page_cursors['has_next']:
+            self.run_filtered_query(self.get_current_filters(), self.current_limit,
+                                    self.current_offset + self.current_page_rows,
+                                    after=self.page_cursors['last'])
         else:
             messagebox.showinfo("Информация", "Достигнут конец данных")
     
     def prev_records(self):
-        if self.current_limit is None:
-            return
-        
-        limit, offset = self.get_limit_and_offset()
-        if limit is None:
+        if self.current_limit is None or self.page_cursors is None:
             return
         
-        new_offset = max(0, offset - limit)
-        if new_offset != offset:
-            self.offset_var.set(str(new_offset))
-            self.execute_filtered_query()
+        if self.page_cursors['has_prev'] and self.page_cursors['first'] is not None:
+            self.run_filtered_query(self.get_current_filters(), self.current_limit,
+                                    self.current_offset, before=self.page_cursors['first'])
+        elif self.current_offset > 0:
+            # Пустая страница после перехода за конец данных - курсора нет, назад по позиции
+            self.run_filtered_query(self.get_current_filters(), self.current_limit,
+                                    max(0, self.current_offset - self.current_limit))
         else:
             messagebox.showinfo("Информация", "Уже в начале данных")
     
@@ -740,75 +780,97 @@ class FilterTab:
             if not messagebox.askyesno("Подтверждение", "Нет активных фильтров. Загрузить все данные?"):
                 return
         
+        self.run_filtered_query(filters, limit, offset)
+    
+    def run_filtered_query(self, filters, limit, offset, after=None, before=None):
+        """
+        Выполнение запроса с фильтрами. С лимитом - страница по ключу (get_filtered_page):
+        offset задает начальную позицию, а кнопки вперед/назад передают курсор
+        after/before. Для предыдущей страницы offset - позиция текущей страницы.
+        Без лимита строки не загружаются: таблица читает видимое окно из PacketRange
+        и прокручивается к offset.
+        Рабочий поток только выполняет запрос: строки выводит TreeFeeder порциями
+        по тикам главного цикла, остальной интерфейс обновляет show_filtered_results
+        """
+        feeder = TreeFeeder(self.app.root, self.results_view)
+        token = CancelToken()
+        
         def task():
-            self.app.data_management_tab.show_progress()
-            self.app.data_management_tab.update_progress_text("Выполнение запроса с фильтрами...")
-            
-            success, result = self.app.db_service.get_filtered_data(filters, limit, offset)
-            
-            if success:
-                columns, data, sql_query, params = result
-                self.display_filtered_results(columns, data)
-                
-                self.current_limit = limit
-                self.current_offset = offset
-                
-                query_display = f"SQL запрос:\n{sql_query}\n\n"
-                query_display += f"Параметры: {params}\n\n"
-                query_display += f"Найдено записей: {len(data)}\n"
-                query_display += f"Активных фильтров: {len(filters)}"
-                
-                self.sql_query_text.delete(1.0, tk.END)
-                self.sql_query_text.insert(1.0, query_display)
-                
-                self.app.current_sql_query = sql_query
-                self.app.current_query_params = params
-                self.app.last_analysis_result = {
-                    'columns': columns,
-                    'data': data,
-                    'name': 'Отфильтрованные данные пакетов',
-                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    'query': sql_query,
-                    'limit': limit,
-                    'offset': offset,
-                    'filters': filters
-                }
-                
-                self.app.export_tab.update_export_preview(columns, data, "Отфильтрованные данные пакетов")
-                
-                if limit is None:
-                    status_text = f"Найдено {len(data)} записей (все данные)"
-                else:
-                    status_text = f"Найдено {len(data)} записей (позиция: {offset + 1}-{offset + len(data)})"
-                
-                if filters:
-                    status_text += f", фильтров: {len(filters)}"
-                
-                self.filter_status.config(text=status_text)
-                self.app.progress_queue.put(('complete', (True, f"Фильтрация завершена. {status_text}")))
+            if limit is None:
+                success, result = self.app.db_service.open_packet_range(filters, cancel_token=token)
+                if success:
+                    result = (result.columns, result, result.sql, [])
+                    feeder.set_source(result.columns, result)
             else:
+                # Строки страницы выводятся порциями по мере чтения, до конца запроса
+                feeder.set_source(list(self.app.db_service.PACKET_COLUMNS))
+                success, result = self.app.db_service.get_filtered_page(filters, limit, after, before, offset,
+                                                                        cancel_token=token, on_rows=feeder.put_rows)
+            
+            if not success:
+                # Уже выведенные строки неполной страницы убираются; вывод остановится с концом задачи
+                if limit is not None:
+                    feeder.set_source(list(self.app.db_service.PACKET_COLUMNS))
+                # Отмененный запрос завершает задачу как отмененную, без окна ошибки
+                token.raise_if_cancelled()
                 self.app.progress_queue.put(('complete', (False, result)))
+                return
+            
+            feeder.finish(self.show_filtered_results, filters, limit, offset, before, result)
+        
+        self.app.data_management_tab.show_progress()
+        self.app.data_management_tab.update_progress_text("Выполнение запроса с фильтрами...")
+        # Запросы выполняются параллельно: результаты предыдущего больше не выводятся
+        if self.results_feeder is not None:
+            self.results_feeder.cancel()
+        self.results_feeder = feeder
+        feeder.start(self.app.run_in_thread(task, token=token, progress=True))
+    
+    def show_filtered_results(self, filters, limit, offset, before, result):
+        """Обновление вкладки после вывода строк запроса (главный поток)"""
+        columns, data, sql_query, params = result[:4]
+        page_offset = max(0, offset - len(data)) if before is not None else offset
+        if limit is None and offset:
+            self.results_view.scroll_to(offset)
+        
+        self.current_limit = limit
+        self.current_offset = page_offset
+        self.page_cursors = result[4] if limit is not None else None
+        self.current_page_rows = len(data)
+        self.offset_var.set(str(page_offset))
         
-        self.app.run_in_thread(task)
-    
-    def display_filtered_results(self, columns, data):
-        """Отображение отфильтрованных результатов в Treeview"""
-        # Очищаем существующие данные
-        for item in self.results_tree.get_children():
-            self.results_tree.delete(item)
+        query_display = f"SQL запрос:\n{sql_query}\n\n"
+        query_display += f"Параметры: {params}\n\n"
+        query_display += f"Найдено записей: {len(data)}\n"
+        query_display += f"Активных фильтров: {len(filters)}"
+        self.set_query_text(query_display)
+        
+        self.app.current_sql_query = sql_query
+        self.app.current_query_params = params
+        self.app.last_analysis_result = {
+            'columns': columns,
+            'data': data,
+            'name': 'Отфильтрованные данные пакетов',
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'query': sql_query,
+            'limit': limit,
+            'offset': page_offset,
+            'filters': filters
+        }
         
-        # Устанавливаем колонки
-        self.results_tree["columns"] = columns
+        self.app.export_tab.update_export_preview(columns, data, "Отфильтрованные данные пакетов")
         
-        # Настраиваем заголовки колонок
-        for col in columns:
-            self.results_tree.heading(col, text=col)
-            # Автоподбор ширины колонок
-            self.results_tree.column(col, width=120, minwidth=50, stretch=True)
+        if limit is None:
+            status_text = f"Найдено {len(data)} записей (все данные)"
+        else:
+            status_text = f"Найдено {len(data)} записей (позиция: {page_offset + 1}-{page_offset + len(data)})"
         
-        # Добавляем данные
-        for row in data:
-            self.results_tree.insert("", tk.END, values=row)
+        if filters:
+            status_text += f", фильтров: {len(filters)}"
         
-        # Обновляем отображение
-        self.results_tree.update()
\ No newline at end of file
+        self.filter_status.config(text=status_text)
+        self.app.progress_queue.put(('complete', (True, f"Фильтрация завершена. {status_text}")))
+    
+    def set_query_text(self, text):
+        self.sql_query_text.delete(1.0, tk.END)
+        self.sql_query_text.insert(1.0, text)
\ No newline at end of file
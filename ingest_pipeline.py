@@ -0,0 +1,127 @@
+﻿import os
+import threading
+from queue import Queue, Full
+from typing import Iterator, Optional, Callable, Tuple
+
+from services.file_parser import FileParser
+from services.packet_batch import PacketBatch
+from services.task_scheduler import CancelToken, check_cancelled
+
+class IngestPipeline:
+    """
+    Конвейер "разбор -> загрузка" в один проход.
+
+    Поток-производитель разбирает файл порциями PacketBatch и кладет их в очередь
+    ограниченной глубины, вызывающий поток сразу записывает каждую порцию в БД.
+    На многоядерной машине разбор идет в отдельных процессах небольшими диапазонами
+    файла, чтобы не конкурировать с загрузкой за GIL и быстрее отдать первую порцию.
+    Разбор и загрузка идут одновременно, поэтому общее время близко к большему из них,
+    а в памяти одновременно находится не больше queue_depth порций.
+    Отмена cancel_token останавливает разбор и откатывает загрузку целиком.
+    """
+
+    BATCH_SIZE = 50000
+    QUEUE_DEPTH = 4
+    CHUNK_BYTES = 4 * 1024 * 1024
+
+    # Признак конца потока порций
+    _DONE = None
+
+    def __init__(self, db_service, batch_size: int = BATCH_SIZE, queue_depth: int = QUEUE_DEPTH,
+                 workers: Optional[int] = None):
+        self.db_service = db_service
+        self.batch_size = batch_size
+        self.queue_depth = queue_depth
+        # None - число процессов выбирается по размеру файла (parse_workers)
+        self.workers = workers
+
+        self.parse_error: Optional[Exception] = None
+        self.packets_count = 0
+
+    def run(self, file_path: str, progress_callback: Optional[Callable] = None,
+            load_mode: str = 'replace', cancel_token: Optional[CancelToken] = None) -> Tuple[bool, str]:
+        """Разбор файла и загрузка в packet_data. Возвращает (успех, сообщение) как DatabaseService"""
+        print(f"Конвейерная загрузка файла: {file_path} (порция {self.batch_size}, очередь {self.queue_depth})")
+
+        self.parse_error = None
+        self.packets_count = 0
+        batches: Queue = Queue(maxsize=self.queue_depth)
+        stop_event = threading.Event()
+
+        producer = threading.Thread(target=self._produce, args=(file_path, batches, stop_event, cancel_token))
+        producer.daemon = True
+        producer.start()
+
+        try:
+            return self.db_service.load_packet_stream(
+                self._consume(batches, progress_callback, cancel_token),
+                load_mode=load_mode,
+                source_file=file_path,
+                cancel_token=cancel_token
+            )
+        finally:
+            # Загрузка могла прерваться раньше разбора - останавливаем производителя
+            stop_event.set()
+            producer.join()
+
+    def parse_workers(self, file_path: str) -> Optional[int]:
+        """
+        Процессы разбора для iter_batches. Явное значение workers передается как есть.
+        Иначе файл меньше FileParser.PARALLEL_MIN_BYTES разбирается в потоке-производителе
+        порциями batch_size (None), а больший - процессами: одно ядро остается потоку
+        загрузки, на одноядерной машине разбор идет в потоке
+        """
+        if self.workers is not None or os.path.getsize(file_path) < FileParser.PARALLEL_MIN_BYTES:
+            return self.workers
+        return max((os.cpu_count() or 1) - 1, 1)
+
+    def _produce(self, file_path: str, batches: Queue, stop_event: threading.Event,
+                 cancel_token: Optional[CancelToken] = None):
+        # Процент разбора запоминается и передается вместе с порцией: прогресс
+        # показывается, когда порция уже загружена, а не только разобрана
+        parsed_percent = [0]
+
+        def on_parse_progress(progress, text):
+            parsed_percent[0] = progress
+
+        try:
+            for batch in FileParser.iter_batches(file_path, self.batch_size, on_parse_progress,
+                                                 self.parse_workers(file_path), self.CHUNK_BYTES, cancel_token):
+                if not self._put(batches, (batch, parsed_percent[0]), stop_event):
+                    return
+        except Exception as e:
+            print(f"Ошибка разбора файла в конвейере: {e}")
+            self.parse_error = e
+        finally:
+            self._put(batches, self._DONE, stop_event)
+
+    @staticmethod
+    def _put(batches: Queue, item, stop_event: threading.Event) -> bool:
+        """Запись в очередь с ожиданием места; прерывается, если загрузка остановлена"""
+        while not stop_event.is_set():
+            try:
+                batches.put(item, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _consume(self, batches: Queue, progress_callback: Optional[Callable] = None,
+                 cancel_token: Optional[CancelToken] = None) -> Iterator[PacketBatch]:
+        while True:
+            item = batches.get()
+            check_cancelled(cancel_token)
+            if item is self._DONE:
+                break
+
+            batch, parsed_percent = item
+            yield batch
+
+            self.packets_count += len(batch)
+            if progress_callback:
+                progress_callback(parsed_percent, f"Разобрано и загружено {self.packets_count} пакетов, "
+                                                  f"в очереди {batches.qsize()} порций")
+
+        # Ошибка разбора откатывает всю загрузку, а не оставляет часть файла в БД
+        if self.parse_error is not None:
+            raise RuntimeError(f"Ошибка разбора файла: {self.parse_error}")
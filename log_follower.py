@@ -0,0 +1,120 @@
+﻿import os
+import mmap
+import threading
+from typing import Callable, Iterator, Optional
+
+from services.file_parser import FileParser
+from services.packet_batch import PacketBatch
+
+class LogFollower:
+    """
+    Слежение за растущим файлом лога (режим tail -f).
+
+    Запоминает смещение в байтах, до которого файл уже разобран, и номер
+    последнего обработанного пакета. При каждом опросе разбираются только
+    дописанные целиком строки; незавершенная последняя строка ждет следующего опроса.
+    Номера пакетов в логе возрастают, поэтому строки с номером не больше
+    запомненного пропускаются - повторный разбор после сбоя не дублирует данные.
+    Без offset слежение начинается с конца файла: уже записанные строки не
+    разбираются и не дописываются повторно. Чтобы догрузить файл с начала,
+    передается offset=0 вместе с last_packet_number последнего загруженного пакета.
+    Вместе со смещением запоминается идентификатор файла (st_dev, st_ino):
+    после ротации (переименование и новый файл под тем же именем) или усечения
+    разбор начинается с начала нового файла, а generation увеличивается -
+    номера пакетов в новом файле начинаются заново, и потребитель пишет их
+    в новый захват (DatabaseService.create_capture).
+    """
+
+    def __init__(self, file_path: str, last_packet_number: int = 0, offset: Optional[int] = None,
+                 batch_size: int = 5000, poll_interval: float = 1.0):
+        self.file_path = file_path
+        self.last_packet_number = last_packet_number
+        # None - смещение конца файла определит первый опрос
+        self.offset = offset
+        self.file_id = None
+        # Номер файла под этим именем: растет при каждой ротации или усечении
+        self.generation = 0
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+
+    def _complete_end(self, start: int, file_size: int) -> int:
+        """Граница последней полностью записанной после start строки (позиция после '\\n')"""
+        with open(self.file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            last_newline = mm.rfind(b'\n', start, file_size)
+        return last_newline + 1 if last_newline >= 0 else start
+
+    def poll(self) -> Iterator[PacketBatch]:
+        """
+        Разбор новых строк файла микропакетами по batch_size пакетов.
+        После обработки микропакета потребитель вызывает mark_processed(batch);
+        смещение сдвигается, когда весь дописанный фрагмент разобран
+        """
+        stat = os.stat(self.file_path)
+        file_size = stat.st_size
+        file_id = (stat.st_dev, stat.st_ino)
+
+        if self.offset is None:
+            self.offset = self._complete_end(0, file_size) if file_size else 0
+        elif self.file_id is not None and file_id != self.file_id:
+            # Под тем же именем новый файл, который мог уже вырасти больше смещения
+            print(f"Файл {self.file_path} заменен новым (ротация), разбор начинается сначала")
+            self._restart()
+        elif file_size < self.offset:
+            # Файл стал короче - его перезаписали или начали новый захват
+            print(f"Файл {self.file_path} был усечен, разбор начинается сначала")
+            self._restart()
+        self.file_id = file_id
+
+        if file_size == self.offset:
+            return
+
+        end = self._complete_end(self.offset, file_size)
+        if end <= self.offset:
+            return
+
+        last_packet_number = self.last_packet_number
+        batch = PacketBatch()
+        for packet in FileParser.iter_packets_mmap(self.file_path, start=self.offset, end=end):
+            if packet['number'] <= last_packet_number:
+                continue
+            batch.append(packet)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = PacketBatch()
+
+        if batch:
+            yield batch
+
+        self.offset = end
+
+    def _restart(self):
+        self.offset = 0
+        self.last_packet_number = 0
+        self.generation += 1
+
+    def mark_processed(self, batch: PacketBatch):
+        """Запоминание номера последнего пакета микропакета, который уже сохранен"""
+        if batch:
+            self.last_packet_number = max(self.last_packet_number, batch.numbers[-1])
+
+    def follow(self, on_batch: Callable[[PacketBatch], None], stop_event: threading.Event,
+               on_error: Optional[Callable[[Exception], None]] = None):
+        """Цикл опроса файла до установки stop_event. Каждый микропакет передается в on_batch"""
+        print(f"Слежение за файлом: {self.file_path} (с позиции {self.offset}, "
+              f"после пакета №{self.last_packet_number})")
+
+        while not stop_event.is_set():
+            try:
+                for batch in self.poll():
+                    on_batch(batch)
+                    self.mark_processed(batch)
+                    if stop_event.is_set():
+                        break
+            except Exception as e:
+                print(f"Ошибка слежения за файлом: {e}")
+                if on_error:
+                    on_error(e)
+
+            stop_event.wait(self.poll_interval)
+
+        print(f"Слежение за файлом остановлено: {self.file_path}")
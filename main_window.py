@@ -11,6 +11,7 @@ from models.database import DatabaseManager
 from services.database_service import DatabaseService
 from services.file_parser import FileParser
 from services.export_service import ExportService
+from services.task_scheduler import TaskScheduler
 
 from .data_management_tab import DataManagementTab
 from .filter_tab import FilterTab
@@ -30,8 +31,12 @@ class NetworkMonitorGUI:
         
         # Состояние приложения
         self.packets = []
-        self.current_thread = None
         self.progress_queue = Queue()
+        # Фоновые задачи вкладок: категории, лимиты параллельности и приоритеты - в TaskScheduler
+        self.scheduler = TaskScheduler(on_finish=self._on_task_finished)
+        self.db_service.scheduler = self.scheduler
+        # Задача, ход которой показывает прогресс: ее отменяет кнопка "Отменить"
+        self.progress_task = None
         self.last_analysis_result = None
         self.current_sql_query = None
         self.current_query_params = None
@@ -69,8 +74,16 @@ class NetworkMonitorGUI:
                         self.on_task_complete(success, message)
                     elif message_type == 'hide_progress':
                         self.data_management_tab.hide_progress()
+                    elif message_type == 'status':
+                        self.data_management_tab.update_status(data)
+                    elif message_type == 'call':
+                        func, args = data
+                        func(*args)
             except:
                 pass
+            # Чтения главного потока не держат транзакцию между тиками:
+            # открытая транзакция блокирует TRUNCATE и DDL задач
+            self.db_manager.release_session()
             self.root.after(100, check_queue)
         
         self.root.after(100, check_queue)
@@ -92,9 +105,12 @@ class NetworkMonitorGUI:
                 schedule.run_pending()
                 time.sleep(60)  # Проверяем каждую минуту
         
-        schedule.every().day.at("02:00").do(backup_job)
+        def submit_backup():
+            self.scheduler.submit('maintenance', backup_job, name="Автоматическое резервное копирование")
+        
+        schedule.every().day.at("02:00").do(submit_backup)
 
-        schedule.every().sunday.at("03:00").do(backup_job)
+        schedule.every().sunday.at("03:00").do(submit_backup)
 
         schedule_thread = threading.Thread(target=schedule_checker, daemon=True)
         schedule_thread.start()
@@ -113,22 +129,45 @@ class NetworkMonitorGUI:
         else:
             messagebox.showerror("Ошибка", message)
     
-    def run_in_thread(self, target, *args):
-        """Запуск функции в отдельном потоке"""
-        if self.current_thread and self.current_thread.is_alive():
-            messagebox.showwarning("Предупреждение", "Пожалуйста, дождитесь завершения текущей операции")
-            return False
-        
-        def thread_wrapper():
-            try:
-                target(*args)
-            except Exception as e:
-                self.progress_queue.put(('complete', (False, f"Ошибка потока: {e}")))
-        
-        self.current_thread = threading.Thread(target=thread_wrapper)
-        self.current_thread.daemon = True
-        self.current_thread.start()
-        return True
+    def run_in_thread(self, target, *args, category='query', priority=None, token=None, name=None, progress=False):
+        """
+        Запуск функции в рабочем потоке TaskScheduler. category задает лимит
+        одновременных задач: 'ingest' (загрузка и изменение таблиц - по одной),
+        'query' (запросы вкладок), 'export', 'maintenance' (резервные копии, индексы).
+        Задача сверх лимита ждет в очереди по приоритету. progress - ход задачи
+        показывает прогресс, и кнопка "Отменить" отменяет ее. Возвращает Task
+        """
+        if self.scheduler.is_full(category):
+            self.data_management_tab.update_status("Операция поставлена в очередь и начнется после текущих")
+        task = self.scheduler.submit(category, target, *args, name=name, priority=priority, token=token)
+        if progress:
+            self.progress_task = task
+        return task
+    
+    def cancel_progress_task(self):
+        """
+        Отмена операции, которую показывает прогресс (кнопка "Отменить"). Остальные
+        задачи - автоматическая резервная копия, начальная статистика, запросы
+        других вкладок - продолжают работу
+        """
+        task = self.progress_task
+        if task is not None:
+            task.cancel()
+    
+    def _on_task_finished(self, task):
+        """Завершение задачи (рабочий поток): сессия потока закрывается, ошибка показывается"""
+        self.db_manager.release_session()
+        if self.progress_task is task:
+            self.progress_task = None
+        if task.state == 'failed':
+            self.progress_queue.put(('complete', (False, f"Ошибка потока: {task.error}")))
+        elif task.state == 'cancelled':
+            self.progress_queue.put(('hide_progress', None))
+            self.progress_queue.put(('status', f"Операция отменена: {task.name}"))
+    
+    def call_in_main(self, func, *args):
+        """Вызов func(*args) в главном потоке: рабочие потоки не обращаются к виджетам Tk напрямую"""
+        self.progress_queue.put(('call', (func, args)))
     
     # Методы для доступа к прогрессу из других компонентов
     def show_progress(self):
@@ -138,12 +177,19 @@ class NetworkMonitorGUI:
     def update_progress_text(self, text):
         """Обновить текст прогресса"""
         self.data_management_tab.update_progress_text(text)
+    
+    def update_status(self, message):
+        """Обновить строку состояния"""
+        self.data_management_tab.update_status(message)
 
     def create_initial_stats(self):
         """Создание начальной статистики при запуске приложения"""
         def task():
             # Проверяем есть ли данные в базе
             success, count = self.db_service.get_total_records_count()
+            # Статистика после загрузок пересчитывается в фоне, не чаще раза в StatsWorker.INTERVAL
+            if success:
+                print(self.db_service.start_stats_worker()[1])
             if success and count > 0:
                 # Создаем начальную статистику
                 self.db_service.auto_save_stats()
@@ -151,7 +197,5 @@ class NetworkMonitorGUI:
                 # Создаем начальную резервную копию
                 self.db_service.auto_create_backup()
         
-        # Запускаем в фоновом режиме
-        thread = threading.Thread(target=task)
-        thread.daemon = True
-        thread.start()
\ No newline at end of file
+        # Запускаем в фоновом режиме: интерактивные запросы вкладок идут раньше
+        self.scheduler.submit('maintenance', task, name="Начальная статистика")
\ No newline at end of file
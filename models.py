@@ -1,37 +1,85 @@
-﻿from sqlalchemy import Column, Integer, String, DateTime, DECIMAL, Text
+﻿from sqlalchemy import Column, Integer, SmallInteger, BigInteger, String, DateTime, DECIMAL, Text, ForeignKey, Index, CheckConstraint, LargeBinary
+from sqlalchemy.dialects.postgresql import INET
 from sqlalchemy.sql import func
 from .database import Base
 
+# IP-адрес: INET в PostgreSQL (проверка формата, поиск по подсетям), строка в остальных СУБД
+IPAddress = String(45).with_variant(INET(), 'postgresql')
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    
+    version = Column(Integer, primary_key=True)
+    applied_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class Capture(Base):
+    __tablename__ = "captures"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    source_file = Column(String(500), unique=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class Protocol(Base):
+    __tablename__ = "protocols"
+    
+    # SQLite выдает автоинкремент только для INTEGER PRIMARY KEY
+    id = Column(SmallInteger().with_variant(Integer(), 'sqlite'), primary_key=True)
+    name = Column(String(20), unique=True, nullable=False)
+
 class PacketData(Base):
     __tablename__ = "packet_data"
+    __table_args__ = (
+        # Ключ режима upsert: номер пакета уникален в пределах захвата
+        Index('uq_packet_data_capture_number', 'capture_id', 'packet_number', unique=True),
+        # SMALLINT в PostgreSQL знаковый и не вмещает порты выше 32767 - диапазон задан проверкой
+        CheckConstraint('source_port BETWEEN 0 AND 65535', name='ck_packet_data_source_port'),
+        CheckConstraint('destination_port BETWEEN 0 AND 65535', name='ck_packet_data_destination_port'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
+    capture_id = Column(Integer, ForeignKey('captures.id', ondelete='CASCADE'), index=True)
     packet_number = Column(Integer, index=True)
-    timestamp = Column(String(50))
-    source_ip = Column(String(20))
-    destination_ip = Column(String(20))
+    timestamp = Column(DateTime(timezone=True))
+    source_ip = Column(IPAddress)
+    destination_ip = Column(IPAddress)
     source_port = Column(Integer)
     destination_port = Column(Integer)
     packet_size = Column(Integer)
-    protocol = Column(String(20))
+    protocol_id = Column(SmallInteger, ForeignKey('protocols.id'), index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class ProtocolStats(Base):
     __tablename__ = "protocol_stats"
+    __table_args__ = (
+        # Ключ слияния сводки при загрузке (StatsRollups): одна строка на протокол
+        Index('uq_protocol_stats_protocol_name', 'protocol_name', unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     protocol_name = Column(String(20))
-    packet_count = Column(Integer)
-    total_size = Column(Integer)
+    # Счетчики накапливаются загрузками и выходят за пределы INTEGER
+    packet_count = Column(BigInteger)
+    total_size = Column(BigInteger)
     avg_size = Column(DECIMAL(10, 2))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class IPStats(Base):
     __tablename__ = "ip_stats"
+    __table_args__ = (
+        Index('uq_ip_stats_address_role', 'ip_address', 'role', unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    ip_address = Column(String(20))
+    ip_address = Column(String(45))
     role = Column(String(15))
-    packet_count = Column(Integer)
-    total_traffic = Column(Integer)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    packet_count = Column(BigInteger)
+    total_traffic = Column(BigInteger)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class StatsSketch(Base):
+    __tablename__ = "stats_sketches"
+    
+    # Имя эскиза PacketSketches (totals, source_ips, top_sources, ...) и его сериализованное состояние
+    name = Column(String(30), primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
\ No newline at end of file
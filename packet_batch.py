@@ -0,0 +1,311 @@
+﻿import heapq
+import socket
+from array import array
+from collections.abc import Sequence
+from itertools import islice
+from typing import List, Dict, Iterable, Iterator, Tuple
+
+class PacketBatch:
+    """
+    Колоночный буфер разобранных пакетов вместо списка словарей.
+
+    Числовые поля хранятся в array('I'), IPv4-адреса упакованы в uint32,
+    протокол и флаги закодированы словарем в малые целые, время - одним
+    байтовым буфером со смещениями. Миллион пакетов занимает десятки МБ.
+    Итерация и индексация по-прежнему отдают словари с ключами парсера,
+    поэтому буфер можно передавать туда, где ожидался List[Dict].
+    """
+
+    FIELDS = ('number', 'timestamp', 'source_ip', 'destination_ip', 'source_port',
+              'destination_port', 'size', 'flags', 'protocol')
+
+    # Колонки для экспорта - те же, что возвращают запросы DatabaseService
+    EXPORT_COLUMNS = ['номер_пакета', 'время', 'исходный_ip', 'целевой_ip',
+                      'исходный_порт', 'целевой_порт', 'размер', 'протокол']
+    EXPORT_FIELDS = ('number', 'timestamp', 'source_ip', 'destination_ip', 'source_port',
+                     'destination_port', 'size', 'protocol')
+
+    def __init__(self):
+        self.numbers = array('I')
+        self.source_ports = array('I')
+        self.destination_ports = array('I')
+        self.sizes = array('I')
+        self.source_ips = array('I')
+        self.destination_ips = array('I')
+        self.flags_codes = array('H')
+        self.protocol_codes = array('H')
+
+        self._timestamps = bytearray()
+        self._timestamp_offsets = array('Q', [0])
+
+        # Словари кодирования протоколов и флагов: код -> строка и строка -> код
+        self._protocols: List[str] = []
+        self._protocol_index: Dict[str, int] = {}
+        self._flags: List[str] = []
+        self._flags_index: Dict[str, int] = {}
+
+        # Адреса, которые не являются IPv4 (пустые, '-', IPv6, MAC): номер строки -> исходный текст
+        self._source_ip_text: Dict[int, str] = {}
+        self._destination_ip_text: Dict[int, str] = {}
+
+    # --- Заполнение ---
+
+    @classmethod
+    def from_packets(cls, packets: Iterable[Dict]) -> 'PacketBatch':
+        batch = cls()
+        batch.extend(packets)
+        return batch
+
+    def extend(self, packets: Iterable[Dict]):
+        append = self.append
+        for packet in packets:
+            append(packet)
+
+    def append(self, packet: Dict):
+        index = len(self.numbers)
+
+        self.numbers.append(packet['number'])
+        self.source_ports.append(packet['source_port'])
+        self.destination_ports.append(packet['destination_port'])
+        self.sizes.append(packet['size'])
+
+        self._timestamps += packet['timestamp'].encode('utf-8')
+        self._timestamp_offsets.append(len(self._timestamps))
+
+        self.source_ips.append(self._pack_ip(packet['source_ip'], index, self._source_ip_text))
+        self.destination_ips.append(self._pack_ip(packet['destination_ip'], index, self._destination_ip_text))
+
+        self.flags_codes.append(self._encode(packet['flags'], self._flags, self._flags_index))
+        self.protocol_codes.append(self._encode(packet['protocol'], self._protocols, self._protocol_index))
+
+    @staticmethod
+    def _encode(value: str, values: List[str], index: Dict[str, int]) -> int:
+        code = index.get(value)
+        if code is None:
+            code = len(values)
+            values.append(value)
+            index[value] = code
+        return code
+
+    @staticmethod
+    def _pack_ip(ip: str, row: int, text_overrides: Dict[int, str]) -> int:
+        if ip.count('.') == 3:
+            try:
+                packed = socket.inet_aton(ip)
+                # inet_aton принимает и нестандартные записи - сохраняем только точные IPv4
+                if socket.inet_ntoa(packed) == ip:
+                    return int.from_bytes(packed, 'big')
+            except OSError:
+                pass
+        text_overrides[row] = ip
+        return 0
+
+    # --- Чтение ---
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def __bool__(self) -> bool:
+        return len(self.numbers) > 0
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self.numbers)):
+            yield self._packet(i)
+
+    def __getitem__(self, key):
+        # Срез, как и у списка словарей, отдает список словарей
+        if isinstance(key, slice):
+            return [self._packet(i) for i in range(*key.indices(len(self.numbers)))]
+        if key < 0:
+            key += len(self.numbers)
+        if not 0 <= key < len(self.numbers):
+            raise IndexError("PacketBatch index out of range")
+        return self._packet(key)
+
+    def _packet(self, i: int) -> Dict:
+        return {
+            'number': self.numbers[i],
+            'timestamp': self.timestamp(i),
+            'source_ip': self.source_ip(i),
+            'destination_ip': self.destination_ip(i),
+            'source_port': self.source_ports[i],
+            'destination_port': self.destination_ports[i],
+            'size': self.sizes[i],
+            'flags': self._flags[self.flags_codes[i]],
+            'protocol': self._protocols[self.protocol_codes[i]]
+        }
+
+    def timestamp(self, i: int) -> str:
+        return self._timestamps[self._timestamp_offsets[i]:self._timestamp_offsets[i + 1]].decode('utf-8')
+
+    def source_ip(self, i: int) -> str:
+        text = self._source_ip_text.get(i)
+        return text if text is not None else socket.inet_ntoa(self.source_ips[i].to_bytes(4, 'big'))
+
+    def destination_ip(self, i: int) -> str:
+        text = self._destination_ip_text.get(i)
+        return text if text is not None else socket.inet_ntoa(self.destination_ips[i].to_bytes(4, 'big'))
+
+    def protocol(self, i: int) -> str:
+        return self._protocols[self.protocol_codes[i]]
+
+    def protocols(self) -> set:
+        """Множество непустых протоколов, встречающихся в буфере"""
+        used = set(self.protocol_codes)
+        return {self._protocols[code] for code in used if self._protocols[code]}
+
+    def iter_rows(self, fields: Tuple[str, ...] = FIELDS) -> Iterator[tuple]:
+        """
+        Построчный обход кортежами без создания словарей. Колонки обходятся
+        целиком и склеиваются через zip - без вызова функции на каждое поле
+        """
+        return zip(*(self._iter_column(field) for field in fields))
+
+    def _iter_column(self, field: str) -> Iterator:
+        if field in ('number', 'source_port', 'destination_port', 'size'):
+            return iter({'number': self.numbers, 'source_port': self.source_ports,
+                         'destination_port': self.destination_ports, 'size': self.sizes}[field])
+        if field == 'timestamp':
+            offsets = self._timestamp_offsets
+            if self._timestamps.isascii():
+                text = self._timestamps.decode('ascii')
+                return (text[start:end] for start, end in zip(offsets, islice(offsets, 1, None)))
+            return (self.timestamp(i) for i in range(len(self.numbers)))
+        if field in ('source_ip', 'destination_ip'):
+            if field == 'source_ip':
+                values, overrides = self.source_ips, self._source_ip_text
+            else:
+                values, overrides = self.destination_ips, self._destination_ip_text
+            return self._iter_ips(values, overrides)
+        if field == 'flags':
+            return map(self._flags.__getitem__, self.flags_codes)
+        return map(self._protocols.__getitem__, self.protocol_codes)
+
+    @staticmethod
+    def _iter_ips(values: array, overrides: Dict[int, str]) -> Iterator[str]:
+        # Адреса в логе сильно повторяются - строковое представление кэшируется
+        cache: Dict[int, str] = {}
+        ntoa = socket.inet_ntoa
+        for i, value in enumerate(values):
+            text = overrides.get(i) if overrides else None
+            if text is None:
+                text = cache.get(value)
+                if text is None:
+                    text = cache[value] = ntoa(value.to_bytes(4, 'big'))
+            yield text
+
+    def _field_getter(self, field: str):
+        getters = {
+            'number': self.numbers.__getitem__,
+            'timestamp': self.timestamp,
+            'source_ip': self.source_ip,
+            'destination_ip': self.destination_ip,
+            'source_port': self.source_ports.__getitem__,
+            'destination_port': self.destination_ports.__getitem__,
+            'size': self.sizes.__getitem__,
+            'flags': lambda i: self._flags[self.flags_codes[i]],
+            'protocol': self.protocol
+        }
+        return getters[field]
+
+    def as_export_rows(self) -> 'PacketRowsView':
+        """Представление буфера в виде строк для ExportService (колонки EXPORT_COLUMNS)"""
+        return PacketRowsView(self, self.EXPORT_FIELDS)
+
+    @property
+    def nbytes(self) -> int:
+        """Приблизительный объем памяти, занимаемый колонками"""
+        columns = (self.numbers, self.source_ports, self.destination_ports, self.sizes,
+                   self.source_ips, self.destination_ips, self.flags_codes, self.protocol_codes,
+                   self._timestamp_offsets)
+        return (sum(column.itemsize * len(column) for column in columns) + len(self._timestamps)
+                + sum(len(text) for text in self._source_ip_text.values())
+                + sum(len(text) for text in self._destination_ip_text.values()))
+
+    # --- Перестановка и слияние ---
+
+    def _take(self, indices: Iterable[int]) -> 'PacketBatch':
+        result = PacketBatch()
+        append = result.append
+        for i in indices:
+            append(self._packet(i))
+        return result
+
+    def is_sorted_by_number(self) -> bool:
+        numbers = self.numbers
+        return all(numbers[i] <= numbers[i + 1] for i in range(len(numbers) - 1))
+
+    def sorted_by_number(self) -> 'PacketBatch':
+        if self.is_sorted_by_number():
+            return self
+        order = sorted(range(len(self.numbers)), key=self.numbers.__getitem__)
+        return self._take(order)
+
+    @classmethod
+    def merge_sorted(cls, batches: List['PacketBatch']) -> 'PacketBatch':
+        """Слияние буферов, каждый из которых отсортирован по номеру пакета"""
+        batches = [batch for batch in batches if len(batch)]
+        if not batches:
+            return cls()
+
+        # Частый случай: части файла идут подряд и не перекрываются - достаточно склеить
+        if all(batches[i].numbers[-1] <= batches[i + 1].numbers[0] for i in range(len(batches) - 1)):
+            result = cls()
+            for batch in batches:
+                result._append_batch(batch)
+            return result
+
+        result = cls()
+        result.extend(heapq.merge(*batches, key=lambda packet: packet['number']))
+        return result
+
+    def _append_batch(self, other: 'PacketBatch'):
+        """Дописывание колонок другого буфера без обхода по строкам"""
+        row_offset = len(self.numbers)
+
+        self.numbers.extend(other.numbers)
+        self.source_ports.extend(other.source_ports)
+        self.destination_ports.extend(other.destination_ports)
+        self.sizes.extend(other.sizes)
+        self.source_ips.extend(other.source_ips)
+        self.destination_ips.extend(other.destination_ips)
+
+        base = len(self._timestamps)
+        self._timestamps += other._timestamps
+        self._timestamp_offsets.extend(offset + base for offset in other._timestamp_offsets[1:])
+
+        # Коды словарей другого буфера перекодируются в словари этого
+        protocol_map = [self._encode(value, self._protocols, self._protocol_index) for value in other._protocols]
+        self.protocol_codes.extend(protocol_map[code] for code in other.protocol_codes)
+        flags_map = [self._encode(value, self._flags, self._flags_index) for value in other._flags]
+        self.flags_codes.extend(flags_map[code] for code in other.flags_codes)
+
+        self._source_ip_text.update((row + row_offset, text) for row, text in other._source_ip_text.items())
+        self._destination_ip_text.update((row + row_offset, text) for row, text in other._destination_ip_text.items())
+
+class PacketRowsView(Sequence):
+    """Легковесное представление PacketBatch в виде последовательности кортежей"""
+
+    def __init__(self, batch: PacketBatch, fields: Tuple[str, ...]):
+        self.batch = batch
+        self.fields = fields
+        self._getters = [batch._field_getter(field) for field in fields]
+
+    def __len__(self) -> int:
+        return len(self.batch)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._row(i) for i in range(*key.indices(len(self.batch)))]
+        if key < 0:
+            key += len(self.batch)
+        if not 0 <= key < len(self.batch):
+            raise IndexError("PacketRowsView index out of range")
+        return self._row(key)
+
+    def __iter__(self):
+        for i in range(len(self.batch)):
+            yield self._row(i)
+
+    def _row(self, i: int) -> tuple:
+        return tuple(getter(i) for getter in self._getters)
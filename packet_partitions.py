@@ -0,0 +1,280 @@
+﻿from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from models.models import PacketData
+
+class PacketPartitions:
+    """
+    Декларативное секционирование packet_data в PostgreSQL.
+
+    Режимы (MODES):
+      day     - RANGE по времени пакета, секция на сутки (packet_data_dГГГГММДД):
+                условия на время отсекают лишние секции при планировании запроса;
+      capture - LIST по capture_id, секция на захват (packet_data_cN).
+    Ключ секционирования входит в первичный ключ и уникальный индекс - так требует
+    PostgreSQL. Строки, для которых секции нет (NULL в ключе, восстановление из копии),
+    попадают в секцию по умолчанию packet_data_default. Перед созданием секции
+    ее строки переносятся из packet_data_default, иначе PostgreSQL не даст ее создать.
+    Старые секции удаляются (DROP TABLE) или отсоединяются (DETACH PARTITION) без
+    построчного DELETE. Объект создается на одну операцию, коммит делает вызывающий код.
+    """
+
+    MODES = {
+        'none': 'Без секционирования',
+        'day': 'По дням захвата',
+        'capture': 'По захватам'
+    }
+
+    TABLE = PacketData.__tablename__
+    DEFAULT_PARTITION = f"{TABLE}_default"
+
+    # Ключ секционирования и стратегия для каждого режима
+    KEYS = {'day': 'timestamp', 'capture': 'capture_id'}
+    STRATEGIES = {'day': 'RANGE (timestamp)', 'capture': 'LIST (capture_id)'}
+
+    # Длина меток времени, которые формирует TimestampResolver: без долей секунды и с ними
+    _RESOLVED_LENGTHS = (19, 26)
+
+    def __init__(self, session: Session):
+        self.session = session
+        self.mode = self.detect(session)
+        self._known: Optional[Set[str]] = None
+
+    @classmethod
+    def detect(cls, session: Session) -> str:
+        """Текущий режим секционирования packet_data: 'none', 'day' или 'capture'"""
+        if session.get_bind().dialect.name != 'postgresql':
+            return 'none'
+        key = session.execute(text(
+            "SELECT pg_get_partkeydef(to_regclass(:name))"), {'name': cls.TABLE}).scalar()
+        if not key:
+            return 'none'
+        return 'day' if key.upper().startswith('RANGE') else 'capture'
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'none'
+
+    def create_table(self, mode: str):
+        """
+        Создание секционированной packet_data с индексами модели и секцией по умолчанию.
+        Таблицы captures и protocols должны уже существовать - на них ссылаются внешние ключи
+        """
+        if mode not in self.KEYS:
+            raise ValueError(f"Неизвестный режим секционирования: {mode}")
+
+        table = PacketData.__table__
+        key = self.KEYS[mode]
+        dialect = self.session.get_bind().dialect
+
+        ddl = str(CreateTable(table).compile(dialect=dialect)).strip()
+        primary_key = 'PRIMARY KEY (id)'
+        if primary_key not in ddl:
+            raise RuntimeError("Не найден первичный ключ в описании packet_data")
+        ddl = ddl.replace(primary_key, f"PRIMARY KEY (id, {key})")
+        self.session.execute(text(f"{ddl} PARTITION BY {self.STRATEGIES[mode]}"))
+
+        for index in table.indexes:
+            if index.unique:
+                # Уникальный индекс секционированной таблицы обязан содержать ключ секционирования
+                columns = [column.name for column in index.columns]
+                if key not in columns:
+                    columns.append(key)
+                self.session.execute(text(
+                    f"CREATE UNIQUE INDEX {index.name} ON {self.TABLE} ({', '.join(columns)})"))
+            else:
+                self.session.execute(CreateIndex(index))
+
+        self.session.execute(text(f"CREATE TABLE {self.DEFAULT_PARTITION} PARTITION OF {self.TABLE} DEFAULT"))
+        self.mode = mode
+        self._known = {self.DEFAULT_PARTITION}
+
+    def conflict_columns(self) -> List[str]:
+        """Столбцы уникального ключа пакета для ON CONFLICT"""
+        columns = ['capture_id', 'packet_number']
+        if self.mode == 'day':
+            columns.append('timestamp')
+        return columns
+
+    def partition_names(self) -> Set[str]:
+        if self._known is None:
+            self._known = {row['name'] for row in self.list_partitions(with_sizes=False)}
+        return self._known
+
+    def list_partitions(self, with_sizes: bool = True) -> List[Dict]:
+        """Секции packet_data: имя, границы, оценка числа строк и размер"""
+        if not self.enabled:
+            return []
+        size = 'pg_total_relation_size(c.oid)' if with_sizes else '0'
+        result = self.session.execute(text(f"""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint, {size}
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:name)
+            ORDER BY c.relname
+        """), {'name': self.TABLE})
+        return [{'name': name, 'bounds': bounds, 'rows': max(rows, 0), 'size': size_bytes}
+                for name, bounds, rows, size_bytes in result]
+
+    def prepare_rows(self, columns: Iterable[str], rows: List[tuple]):
+        """Создание секций по дням для порции строк загрузки (вызывается перед COPY)"""
+        if self.mode != 'day':
+            return
+        position = list(columns).index('timestamp')
+        values = {row[position] for row in rows}
+        values.discard(None)
+
+        days = set()
+        for value in values:
+            day = date.fromisoformat(value[:10])
+            days.add(day)
+            if len(value) not in self._RESOLVED_LENGTHS:
+                # Время с часовым поясом может попасть в соседние сутки часового пояса сессии
+                days.add(day - timedelta(days=1))
+                days.add(day + timedelta(days=1))
+        self.ensure_days(days)
+
+    def ensure_days(self, days: Iterable[date]):
+        for day in sorted(set(days)):
+            name = f"{self.TABLE}_d{day:%Y%m%d}"
+            if name in self.partition_names():
+                continue
+            start, end = day.isoformat(), (day + timedelta(days=1)).isoformat()
+            self._create_partition(name, f"FROM ('{start}') TO ('{end}')",
+                                   f"timestamp >= '{start}' AND timestamp < '{end}'")
+
+    def ensure_capture(self, capture_id: int):
+        if self.mode != 'capture':
+            return
+        name = f"{self.TABLE}_c{int(capture_id)}"
+        if name not in self.partition_names():
+            self._create_partition(name, f"IN ({int(capture_id)})", f"capture_id = {int(capture_id)}")
+
+    def _create_partition(self, name: str, bounds: str, condition: str):
+        moved = self.session.execute(text(
+            f"SELECT EXISTS (SELECT 1 FROM {self.DEFAULT_PARTITION} WHERE {condition})")).scalar()
+        if not moved:
+            self.session.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {self.TABLE} "
+                                      f"FOR VALUES {bounds}"))
+        else:
+            # Строки этой секции уже лежат в секции по умолчанию: переносим их и присоединяем таблицу
+            self.session.execute(text(f"CREATE TABLE {name} (LIKE {self.TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+            self.session.execute(text(f"""
+                WITH moved AS (DELETE FROM {self.DEFAULT_PARTITION} WHERE {condition} RETURNING *)
+                INSERT INTO {name} SELECT * FROM moved
+            """))
+            self.session.execute(text(f"ALTER TABLE {self.TABLE} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+        self.partition_names().add(name)
+
+    def split_default(self, source_table: str = DEFAULT_PARTITION) -> int:
+        """
+        Создание секций по дням или захватам для строк source_table. Для секции
+        по умолчанию это перенос ее строк в свои секции. Возвращает число ключей
+        """
+        if self.mode == 'day':
+            keys = [value.date() for value in self.session.execute(text(
+                f"SELECT DISTINCT date_trunc('day', timestamp) FROM {source_table} "
+                f"WHERE timestamp IS NOT NULL")).scalars()]
+            self.ensure_days(keys)
+        elif self.mode == 'capture':
+            keys = list(self.session.execute(text(
+                f"SELECT DISTINCT capture_id FROM {source_table} WHERE capture_id IS NOT NULL")).scalars())
+            for capture_id in keys:
+                self.ensure_capture(capture_id)
+        else:
+            keys = []
+        return len(keys)
+
+    def convert(self, mode: str):
+        """
+        Перевод существующей несекционированной packet_data в секционированную:
+        данные копируются в новую таблицу одним INSERT ... SELECT, старая удаляется.
+        Индексы старой таблицы переименовываются, чтобы освободить имена
+        """
+        if self.mode != 'none':
+            raise RuntimeError("Таблица packet_data уже секционирована")
+
+        old_table = f"{self.TABLE}_unpartitioned"
+        sequence = self.session.execute(text(
+            f"SELECT pg_get_serial_sequence('{self.TABLE}', 'id')")).scalar()
+
+        self.session.execute(text(f"ALTER TABLE {self.TABLE} RENAME TO {old_table}"))
+        if sequence:
+            self.session.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO {self.TABLE}_id_seq_unpartitioned"))
+        index_names = self.session.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :name"),
+            {'name': old_table}).scalars().all()
+        for index_name in index_names:
+            self.session.execute(text(f"ALTER INDEX {index_name} RENAME TO {index_name}_old"))
+
+        self.create_table(mode)
+        # Секции создаются до копирования, чтобы строки сразу легли в свои секции
+        self.split_default(old_table)
+
+        columns = [column.name for column in PacketData.__table__.columns]
+        column_list = ', '.join(columns)
+        self.session.execute(text(
+            f"INSERT INTO {self.TABLE} ({column_list}) SELECT {column_list} FROM {old_table}"))
+        self.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{self.TABLE}', 'id'), "
+            f"COALESCE(MAX(id), 0) + 1, false) FROM {self.TABLE}"))
+        self.session.execute(text(f"DROP TABLE {old_table}"))
+
+    def detach(self, name: str) -> str:
+        """
+        Отсоединение секции: данные остаются в отдельной архивной таблице, имя которой
+        возвращается. Таблица отвязывается от счетчика id и внешних ключей, чтобы не мешать
+        очистке и удалению packet_data, и переименовывается - имя секции освобождается
+        """
+        self.check_partition(name)
+        self.session.execute(text(f"ALTER TABLE {self.TABLE} DETACH PARTITION {name}"))
+        self.partition_names().discard(name)
+
+        archive_name = f"{name}_detached_{datetime.now():%Y%m%d%H%M%S}"
+        self.session.execute(text(f"ALTER TABLE {name} ALTER COLUMN id DROP DEFAULT"))
+        foreign_keys = self.session.execute(text(
+            "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:name) AND contype = 'f'"),
+            {'name': name}).scalars().all()
+        for constraint in foreign_keys:
+            self.session.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {constraint}"))
+        self.session.execute(text(f"ALTER TABLE {name} RENAME TO {archive_name}"))
+        return archive_name
+
+    def drop(self, name: str):
+        """Удаление секции вместе с данными - без построчного DELETE и раздувания таблицы"""
+        self.check_partition(name)
+        self.session.execute(text(f"DROP TABLE {name}"))
+        self.partition_names().discard(name)
+        if self.mode == 'capture':
+            # Захват без пакетов больше не нужен: его секция была единственным местом данных
+            self.session.execute(text("DELETE FROM captures WHERE id = :id"),
+                                 {'id': int(name[len(self.TABLE) + 2:])})
+
+    def drop_all(self):
+        """Удаление всех секций, кроме секции по умолчанию (очистка перед загрузкой в режиме замены)"""
+        for name in sorted(self.partition_names() - {self.DEFAULT_PARTITION}):
+            self.drop(name)
+
+    def old_partitions(self, before: datetime) -> List[str]:
+        """Секции с данными до момента before: по дате в имени или по дате создания захвата"""
+        if self.mode == 'day':
+            prefix = f"{self.TABLE}_d"
+            cutoff = f"{prefix}{before:%Y%m%d}"
+            return sorted(name for name in self.partition_names()
+                          if name.startswith(prefix) and name < cutoff)
+        if self.mode == 'capture':
+            capture_ids = self.session.execute(text(
+                "SELECT id FROM captures WHERE created_at < :before"), {'before': before}).scalars()
+            names = {f"{self.TABLE}_c{capture_id}" for capture_id in capture_ids}
+            return sorted(names & self.partition_names())
+        return []
+
+    def check_partition(self, name: str):
+        if name == self.DEFAULT_PARTITION:
+            raise ValueError("Секцию по умолчанию нельзя отсоединить или удалить")
+        if name not in self.partition_names():
+            raise ValueError(f"{name} не является секцией {self.TABLE}")
@@ -0,0 +1,84 @@
+﻿import threading
+from bisect import bisect_right, insort
+from typing import Callable, Dict, List, Optional, Tuple
+
+class PacketRange:
+    """
+    Выборка packet_data с доступом к строкам по позиции без OFFSET от начала.
+
+    При открытии (DatabaseService.open_packet_range) считается только число строк.
+    Ключи (packet_number, id) каждой step-й строки - якоря - запоминаются по ходу
+    чтения: окно [start, start + count) читается поиском по индексу от ближайшего
+    известного якоря и попутно отмечает якоря внутри себя и сразу после себя.
+    Поэтому прокрутка и чтение подряд пропускают меньше step строк, а переход
+    далеко за известные якоря - один запрос с пропуском строк от ближайшего
+    из них, после которого окна рядом снова дешевые.
+    Ведет себя как последовательность только для чтения (len, индекс, срез,
+    итерация порциями): ее принимают VirtualTreeview и ExportService, в том
+    числе из рабочих потоков. Строки, добавленные после открытия, в выборку не попадают
+    """
+
+    # Якорей на порцию при итерации: порции начинаются с якорей и читаются без пропуска строк
+    ITER_ANCHORS = 10
+
+    def __init__(self, fetch: Callable[[Optional[Tuple[int, int]], int, int], List[Tuple[Tuple[int, int], tuple]]],
+                 columns: List[str], total: int, step: int, sql: str = ''):
+        # fetch(ключ якоря или None - начало выборки, пропуск строк, количество) -> [(ключ, строка)]
+        self.fetch = fetch
+        self.columns = columns
+        self.total = total
+        self.step = step
+        self.sql = sql
+        # Номер якоря -> ключ строки номер * step; якорь 0 - начало выборки, его ключ не нужен
+        self.anchors: Dict[int, Tuple[int, int]] = {}
+        self._numbers: List[int] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.total
+
+    def rows(self, start: int, count: int) -> List[tuple]:
+        start = max(start, 0)
+        count = min(count, self.total - start)
+        if count <= 0:
+            return []
+        number, anchor = self._nearest_anchor(start // self.step)
+        skip = start - number * self.step
+        # Строка сразу после окна тоже читается: с нее может начинаться следующая порция
+        keyed_rows = self.fetch(anchor, skip, count + 1)
+        for offset, (key, _) in enumerate(keyed_rows):
+            if (start + offset) % self.step == 0:
+                self._remember((start + offset) // self.step, key)
+        return [row for _, row in keyed_rows[:count]]
+
+    def _nearest_anchor(self, number: int) -> Tuple[int, Optional[Tuple[int, int]]]:
+        """Ближайший известный якорь не дальше number: (номер, ключ)"""
+        with self._lock:
+            index = bisect_right(self._numbers, number)
+            if index == 0:
+                return 0, None
+            known = self._numbers[index - 1]
+            return known, self.anchors[known]
+
+    def _remember(self, number: int, key: Tuple[int, int]):
+        with self._lock:
+            if number and number not in self.anchors:
+                self.anchors[number] = key
+                insort(self._numbers, number)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, stride = index.indices(self.total)
+            if stride == 1:
+                return self.rows(start, stop - start)
+            return [self[position] for position in range(start, stop, stride)]
+        if index < 0:
+            index += self.total
+        if not 0 <= index < self.total:
+            raise IndexError("PacketRange index out of range")
+        return self.rows(index, 1)[0]
+
+    def __iter__(self):
+        batch_rows = self.step * self.ITER_ANCHORS
+        for start in range(0, self.total, batch_rows):
+            yield from self.rows(start, batch_rows)
@@ -0,0 +1,72 @@
+﻿from typing import Dict, Iterable, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models.models import Protocol
+
+class ProtocolRegistry:
+    """
+    Кэш справочника протоколов в памяти процесса: название -> protocol_id.
+
+    Справочник читается из БД при первом обращении, новые протоколы добавляются
+    во время загрузки одним INSERT ... ON CONFLICT DO NOTHING на порцию и сразу
+    попадают в кэш, так что строки пакетов получают id без запросов к БД.
+    Добавление идет в транзакции загрузки: после отката или очистки таблиц
+    кэш нужно сбросить (clear), иначе в нем останутся несуществующие id.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._names: Dict[int, str] = {}
+        self._loaded = False
+
+    def clear(self):
+        self._ids.clear()
+        self._names.clear()
+        self._loaded = False
+
+    def ids_for(self, session: Session, names: Iterable[str]) -> Dict[str, int]:
+        """Словарь название -> id, в котором есть все переданные названия"""
+        if not self._loaded:
+            self._load(session)
+
+        missing = {name for name in names if name not in self._ids}
+        if missing:
+            self._insert(session, missing)
+        return self._ids
+
+    def get_id(self, session: Session, name: str) -> int:
+        protocol_id = self._ids.get(name)
+        if protocol_id is None:
+            protocol_id = self.ids_for(session, [name])[name]
+        return protocol_id
+
+    def get_name(self, session: Session, protocol_id: Optional[int]) -> Optional[str]:
+        if protocol_id is None:
+            return None
+        if not self._loaded or protocol_id not in self._names:
+            self._load(session)
+        return self._names.get(protocol_id)
+
+    def _load(self, session: Session):
+        self._ids = {name: protocol_id for protocol_id, name in session.query(Protocol.id, Protocol.name)}
+        self._names = {protocol_id: name for name, protocol_id in self._ids.items()}
+        self._loaded = True
+
+    def _insert(self, session: Session, names: set):
+        values = [{'name': name} for name in sorted(names)]
+        dialect = session.get_bind().dialect.name
+        # Тот же протокол мог добавить другой процесс - конфликт по названию пропускается
+        if dialect == 'postgresql':
+            statement = postgresql.insert(Protocol).values(values).on_conflict_do_nothing(index_elements=['name'])
+        elif dialect == 'sqlite':
+            statement = sqlite.insert(Protocol).values(values).on_conflict_do_nothing(index_elements=['name'])
+        else:
+            statement = insert(Protocol).values(values)
+        session.execute(statement)
+
+        for protocol_id, name in session.query(Protocol.id, Protocol.name).filter(Protocol.name.in_(names)):
+            self._ids[name] = protocol_id
+            self._names[protocol_id] = name
@@ -0,0 +1,201 @@
+﻿import hashlib
+import heapq
+import json
+import math
+from collections import Counter
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+class HyperLogLog:
+    """
+    Оценка числа различных значений (HyperLogLog) в 2**precision байтах.
+    При precision=14 это 16 КБ и относительная ошибка около 0.8%.
+    Хэш - первые 8 байт BLAKE2b: он не зависит от процесса (в отличие от hash()),
+    поэтому эскиз можно сохранить в БД и дополнить в другом запуске.
+    Повторное добавление значения оценку не меняет
+    """
+
+    def __init__(self, precision: int = 14, registers: Optional[bytes] = None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+
+    def add_all(self, values: Iterable[str]):
+        registers = self.registers
+        precision = self.precision
+        rest_bits = 64 - precision
+        rest_mask = (1 << rest_bits) - 1
+        for value in values:
+            hashed = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+            index = hashed >> rest_bits
+            # Позиция первой единицы в оставшихся битах
+            rank = rest_bits - (hashed & rest_mask).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        # Малые мощности точнее оцениваются по числу пустых регистров (linear counting)
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        return cls(data[0], data[1:])
+
+
+class SpaceSaving:
+    """
+    Верхние значения по частоте (Space-Saving) в capacity счетчиках.
+    Каждый счетчик хранит количество, верхнюю границу его завышения (error)
+    и накопленный вес (байты трафика). Значение с истинной частотой больше
+    N / capacity гарантированно есть в эскизе. Порция добавляется целиком:
+    ее частоты складываются со счетчиками, новое значение при заполненном
+    эскизе получает завышение на минимальный счетчик, лишние отбрасываются
+    """
+
+    def __init__(self, capacity: int = 100, counters: Optional[Dict] = None):
+        self.capacity = capacity
+        # значение -> [количество, завышение, вес]
+        self.counters: Dict = counters if counters is not None else {}
+
+    def update(self, counts: Dict, weights: Optional[Dict] = None):
+        counters = self.counters
+        floor = min(counter[0] for counter in counters.values()) if len(counters) >= self.capacity else 0
+        for item, count in counts.items():
+            weight = weights.get(item, 0) if weights else 0
+            counter = counters.get(item)
+            if counter is None:
+                counters[item] = [floor + count, floor, weight]
+            else:
+                counter[0] += count
+                counter[2] += weight
+        if len(counters) > self.capacity:
+            kept = heapq.nlargest(self.capacity, counters.items(), key=lambda entry: entry[1][0])
+            self.counters = dict(kept)
+
+    def top(self, limit: int) -> List[Tuple]:
+        """Кортежи (значение, количество, вес, завышение) по убыванию количества"""
+        entries = sorted(self.counters.items(), key=lambda entry: (-entry[1][0], str(entry[0])))
+        return [(item, count, weight, error) for item, (count, error, weight) in entries[:limit]]
+
+    def to_bytes(self) -> bytes:
+        return json.dumps({'capacity': self.capacity,
+                           'counters': [[item, *counter] for item, counter in self.counters.items()]}).encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'SpaceSaving':
+        state = json.loads(data.decode())
+        return cls(state['capacity'], {item: [count, error, weight]
+                                       for item, count, error, weight in state['counters']})
+
+
+class PacketSketches:
+    """
+    Набор эскизов для приблизительной сводной статистики packet_data.
+
+    Дополняется строками загрузки (add_rows вызывает PacketBulkLoader перед
+    записью порции): счетчики и суммы размеров, HyperLogLog по адресам-источникам
+    и протоколам, Space-Saving по источникам, получателям и протоколам.
+    Сводка строится без чтения packet_data в формате снимка StatsEngine.
+    Эскизы только растут: строки, замененные upsert-ом, учитываются повторно
+    (кроме числа различных значений), после удаления данных набор нужно
+    пересчитать заново. Хранится в таблице stats_sketches по строке на эскиз
+    """
+
+    TOP_CAPACITY = 100
+
+    def __init__(self):
+        self.totals = {'packets': 0, 'traffic': 0, 'sized_count': 0, 'sized_bytes': 0,
+                       'min_size': None, 'max_size': None}
+        self.source_ips = HyperLogLog()
+        self.protocols = HyperLogLog()
+        self.top_sources = SpaceSaving(self.TOP_CAPACITY)
+        self.top_destinations = SpaceSaving(self.TOP_CAPACITY)
+        self.top_protocols = SpaceSaving(self.TOP_CAPACITY)
+
+    @property
+    def empty(self) -> bool:
+        return self.totals['packets'] == 0
+
+    def add_rows(self, columns: Sequence[str], rows: List[tuple]):
+        """Порция строк загрузки: кортежи значений колонок packet_data в порядке columns"""
+        if not rows:
+            return
+        source_of = itemgetter(columns.index('source_ip'))
+        destination_of = itemgetter(columns.index('destination_ip'))
+        protocol_of = itemgetter(columns.index('protocol_id'))
+        size_of = itemgetter(columns.index('packet_size'))
+
+        sizes = [size or 0 for size in map(size_of, rows)]
+        sized = [size for size in sizes if size > 0]
+        totals = self.totals
+        totals['packets'] += len(rows)
+        totals['traffic'] += sum(sizes)
+        if sized:
+            totals['sized_count'] += len(sized)
+            totals['sized_bytes'] += sum(sized)
+            totals['min_size'] = min(sized) if totals['min_size'] is None else min(totals['min_size'], min(sized))
+            totals['max_size'] = max(sized) if totals['max_size'] is None else max(totals['max_size'], max(sized))
+
+        source_counts = self._tally(self.top_sources, list(map(source_of, rows)), sizes)
+        self._tally(self.top_destinations, list(map(destination_of, rows)), sizes)
+        protocol_counts = self._tally(self.top_protocols, list(map(protocol_of, rows)), sizes)
+        self.source_ips.add_all(source_counts)
+        self.protocols.add_all(str(protocol_id) for protocol_id in protocol_counts)
+
+    @staticmethod
+    def _tally(top: SpaceSaving, keys: List, sizes: List[int]) -> Counter:
+        """Частоты и объемы значений порции (пустые адреса пропускаются) в эскиз top"""
+        counts = Counter(keys)
+        counts.pop(None, None)
+        weights = Counter()
+        for key, size in zip(keys, sizes):
+            weights[key] += size
+        top.update(counts, weights)
+        return counts
+
+    def snapshot(self, protocol_name: Callable[[int], Optional[str]], top: int) -> Tuple:
+        """Аргументы StatsEngine._snapshot: итоги, размеры, верхние разрезы и оценки числа различных"""
+        totals = self.totals
+        total = (totals['packets'], totals['traffic'])
+        sized_avg = totals['sized_bytes'] / totals['sized_count'] if totals['sized_count'] else 0
+        size = (totals['sized_count'], totals['sized_bytes'], sized_avg, totals['min_size'], totals['max_size'])
+        protocols = [(protocol_name(int(protocol_id)), count, weight, weight / count if count else 0)
+                     for protocol_id, count, weight, error in self.top_protocols.top(top)]
+        sources = [(ip, count, weight) for ip, count, weight, error in self.top_sources.top(top)]
+        destinations = [(ip, count, weight) for ip, count, weight, error in self.top_destinations.top(top)]
+        return total, size, protocols, sources, destinations, self.protocols.count(), self.source_ips.count()
+
+    def to_records(self) -> Dict[str, bytes]:
+        return {
+            'totals': json.dumps(self.totals).encode(),
+            'source_ips': self.source_ips.to_bytes(),
+            'protocols': self.protocols.to_bytes(),
+            'top_sources': self.top_sources.to_bytes(),
+            'top_destinations': self.top_destinations.to_bytes(),
+            'top_protocols': self.top_protocols.to_bytes()
+        }
+
+    @classmethod
+    def from_records(cls, records: Dict[str, bytes]) -> 'PacketSketches':
+        sketches = cls()
+        if not records:
+            return sketches
+        sketches.totals = json.loads(bytes(records['totals']).decode())
+        sketches.source_ips = HyperLogLog.from_bytes(bytes(records['source_ips']))
+        sketches.protocols = HyperLogLog.from_bytes(bytes(records['protocols']))
+        sketches.top_sources = SpaceSaving.from_bytes(bytes(records['top_sources']))
+        sketches.top_destinations = SpaceSaving.from_bytes(bytes(records['top_destinations']))
+        sketches.top_protocols = SpaceSaving.from_bytes(bytes(records['top_protocols']))
+        return sketches
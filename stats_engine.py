@@ -0,0 +1,178 @@
+﻿from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import text, func, desc
+from sqlalchemy.orm import Session
+
+from models.models import PacketData, Protocol
+from services.stats_views import StatsViews
+from services.sketches import PacketSketches
+
+class StatsEngine:
+    """
+    Сводная статистика packet_data за один проход по таблице.
+
+    В PostgreSQL все разрезы считаются одним запросом с
+    GROUPING SETS ((), (protocol_id), (source_ip), (destination_ip)): таблица
+    читается один раз, для каждого набора группировки строится свой хэш-агрегат.
+    Оконные функции оставляют top строк каждого набора и дают число уникальных
+    протоколов и адресов, так что в Python приходит несколько десятков строк.
+    Если в базе есть материализованное представление StatsViews, те же строки
+    читаются из него по индексу, без прохода по packet_data (снимок отражает
+    последнее обновление представления).
+    Другие СУБД (SQLite в бенчмарках) GROUPING SETS не поддерживают - для них
+    разрезы считаются отдельными запросами.
+
+    Результат compute - словарь-снимок, общий для автосохранения статистики,
+    экспорта в TXT и вкладки экспорта:
+      total_packets, total_traffic, unique_protocols, unique_ips (источники),
+      size - количество, объем, средний, минимальный и максимальный размер пакетов > 0,
+      protocols, top_sources, top_destinations - верхние top разрезов по числу пакетов,
+      top_protocols - первые пять протоколов (формат прежней сводки), last_updated,
+      approximate - только у снимка compute_approximate по эскизам.
+    """
+
+    TOP = 10
+    SUMMARY_TOP = 5
+
+    # GROUPING(protocol_id, source_ip, destination_ip): бит равен 1 для столбца вне группировки
+    TOTAL = 7
+    BY_PROTOCOL = 3
+    BY_SOURCE = 5
+    BY_DESTINATION = 6
+
+    def __init__(self, session: Session, top: int = TOP):
+        self.session = session
+        self.top = top
+
+    def compute(self) -> dict:
+        if self.session.get_bind().dialect.name == 'postgresql':
+            return self._compute_postgresql()
+        return self._compute_generic()
+
+    def compute_approximate(self, sketches: PacketSketches) -> dict:
+        """Снимок того же формата по эскизам PacketSketches, без чтения packet_data"""
+        names = dict(self.session.query(Protocol.id, Protocol.name))
+        snapshot = self._snapshot(*sketches.snapshot(names.get, self.top))
+        snapshot['approximate'] = True
+        return snapshot
+
+    def _query_grouping_sets(self) -> List[tuple]:
+        return self.session.execute(text("""
+            WITH totals AS (
+                SELECT GROUPING(protocol_id, source_ip, destination_ip) AS grouping_set,
+                       protocol_id, source_ip, destination_ip,
+                       count(*) AS packet_count,
+                       sum(packet_size) AS total_size,
+                       avg(packet_size) AS avg_size,
+                       count(*) FILTER (WHERE packet_size > 0) AS sized_count,
+                       sum(packet_size) FILTER (WHERE packet_size > 0) AS sized_bytes,
+                       avg(packet_size) FILTER (WHERE packet_size > 0) AS sized_avg,
+                       min(packet_size) FILTER (WHERE packet_size > 0) AS min_size,
+                       max(packet_size) FILTER (WHERE packet_size > 0) AS max_size
+                FROM packet_data
+                GROUP BY GROUPING SETS ((), (protocol_id), (source_ip), (destination_ip))
+            ),
+            ranked AS (
+                SELECT totals.*,
+                       row_number() OVER (PARTITION BY grouping_set
+                                          ORDER BY packet_count DESC, protocol_id, source_ip, destination_ip) AS position,
+                       count(*) OVER (PARTITION BY grouping_set) AS group_count
+                FROM totals
+                WHERE grouping_set = :total
+                   OR (grouping_set = :by_protocol AND protocol_id IS NOT NULL)
+                   OR (grouping_set = :by_source AND source_ip IS NOT NULL)
+                   OR (grouping_set = :by_destination AND destination_ip IS NOT NULL)
+            )
+            SELECT r.grouping_set, pr.name, host(r.source_ip), host(r.destination_ip),
+                   r.packet_count, r.total_size, r.avg_size, r.group_count,
+                   r.sized_count, r.sized_bytes, r.sized_avg, r.min_size, r.max_size
+            FROM ranked r
+            LEFT JOIN protocols pr ON pr.id = r.protocol_id
+            WHERE r.position <= :top
+            ORDER BY r.grouping_set, r.position
+        """), {'total': self.TOTAL, 'by_protocol': self.BY_PROTOCOL, 'by_source': self.BY_SOURCE,
+               'by_destination': self.BY_DESTINATION, 'top': self.top}).all()
+
+    def _compute_postgresql(self) -> dict:
+        views = StatsViews(self.session)
+        rows = views.top_rows(self.top) if views.exists() else self._query_grouping_sets()
+
+        total = size = None
+        protocols, sources, destinations = [], [], []
+        unique_protocols = unique_ips = 0
+        for (grouping_set, protocol, source_ip, destination_ip, packet_count, total_size, avg_size,
+             group_count, sized_count, sized_bytes, sized_avg, min_size, max_size) in rows:
+            if grouping_set == self.TOTAL:
+                total = (packet_count, total_size)
+                size = (sized_count, sized_bytes, sized_avg, min_size, max_size)
+            elif grouping_set == self.BY_PROTOCOL:
+                protocols.append((protocol, packet_count, total_size, avg_size))
+                unique_protocols = group_count
+            elif grouping_set == self.BY_SOURCE:
+                sources.append((source_ip, packet_count, total_size))
+                unique_ips = group_count
+            elif grouping_set == self.BY_DESTINATION:
+                destinations.append((destination_ip, packet_count, total_size))
+
+        return self._snapshot(total, size, protocols, sources, destinations, unique_protocols, unique_ips)
+
+    def _compute_generic(self) -> dict:
+        session = self.session
+        total = session.query(func.count(PacketData.id), func.sum(PacketData.packet_size)).one()
+        size = session.query(
+            func.count(PacketData.id), func.sum(PacketData.packet_size), func.avg(PacketData.packet_size),
+            func.min(PacketData.packet_size), func.max(PacketData.packet_size)
+        ).filter(PacketData.packet_size > 0).one()
+
+        protocol_totals = session.query(
+            PacketData.protocol_id.label('protocol_id'),
+            func.count(PacketData.id).label('packet_count'),
+            func.sum(PacketData.packet_size).label('total_size'),
+            func.avg(PacketData.packet_size).label('avg_size')
+        ).filter(PacketData.protocol_id.isnot(None)).group_by(PacketData.protocol_id).subquery()
+        protocols = session.query(
+            Protocol.name, protocol_totals.c.packet_count, protocol_totals.c.total_size, protocol_totals.c.avg_size
+        ).join(protocol_totals, protocol_totals.c.protocol_id == Protocol.id).order_by(
+            desc('packet_count'), Protocol.id).limit(self.top).all()
+        unique_protocols = session.query(func.count(func.distinct(PacketData.protocol_id))).scalar() or 0
+
+        ip_totals = {}
+        for role, field in (('source', PacketData.source_ip), ('destination', PacketData.destination_ip)):
+            ip_totals[role] = session.query(
+                field, func.count(PacketData.id).label('packet_count'), func.sum(PacketData.packet_size)
+            ).filter(field.isnot(None)).group_by(field).order_by(desc('packet_count'), field).limit(self.top).all()
+        unique_ips = session.query(func.count(func.distinct(PacketData.source_ip))).scalar() or 0
+
+        return self._snapshot(tuple(total), tuple(size), protocols, ip_totals['source'],
+                              ip_totals['destination'], unique_protocols, unique_ips)
+
+    @classmethod
+    def _snapshot(cls, total: Optional[tuple], size: Optional[tuple], protocols: List[tuple],
+                  sources: List[tuple], destinations: List[tuple],
+                  unique_protocols: int, unique_ips: int) -> Dict:
+        total_packets, total_traffic = total or (0, 0)
+        sized_count, sized_bytes, sized_avg, min_size, max_size = size or (0, 0, 0, 0, 0)
+        protocol_rows = [{'protocol': name, 'count': count, 'total_size': total_size or 0,
+                          'avg_size': float(avg_size or 0)} for name, count, total_size, avg_size in protocols]
+        return {
+            'total_packets': total_packets or 0,
+            'unique_protocols': unique_protocols,
+            'unique_ips': unique_ips,
+            'total_traffic': total_traffic or 0,
+            'size': {
+                'count': sized_count or 0,
+                'total_bytes': sized_bytes or 0,
+                'avg_size': float(sized_avg or 0),
+                'min_size': min_size or 0,
+                'max_size': max_size or 0
+            },
+            'protocols': protocol_rows,
+            'top_protocols': [{'protocol': row['protocol'], 'count': row['count']}
+                              for row in protocol_rows[:cls.SUMMARY_TOP]],
+            'top_sources': [{'ip': str(ip), 'count': count, 'traffic': traffic or 0}
+                            for ip, count, traffic in sources],
+            'top_destinations': [{'ip': str(ip), 'count': count, 'traffic': traffic or 0}
+                                 for ip, count, traffic in destinations],
+            'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
@@ -0,0 +1,101 @@
+﻿from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+class StatsRollups:
+    """
+    Инкрементальное ведение сводок protocol_stats и ip_stats (PostgreSQL).
+
+    Вместо удаления сводок и GROUP BY по всей packet_data агрегаты только
+    загруженных (или удаляемых) строк сливаются со сводками через
+    INSERT ... ON CONFLICT DO UPDATE по ключам protocol_name и (ip_address, role):
+    количество и объем складываются, средний размер пересчитывается из них.
+    Вычитание (sign=-1) используется для строк, замененных upsert-ом, и для
+    удаляемых секций; записи с нулевым количеством после него удаляются.
+    Источник строк - таблица или подзапрос со столбцами protocol_id,
+    source_ip, destination_ip, packet_size. Коммит делает вызывающий код.
+    """
+
+    # Пространство ключей pg_advisory_xact_lock(пространство, номер захвата) для загрузок
+    CAPTURE_LOCK_SPACE = 7301
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def merge(self, source: str, params: Optional[Dict] = None, sign: int = 1):
+        self.merge_protocols(source, params, sign)
+        self.merge_ips(source, params, sign)
+
+    def merge_protocols(self, source: str, params: Optional[Dict] = None, sign: int = 1):
+        params = dict(params or {}, sign=sign)
+        self.session.execute(text(f"""
+            INSERT INTO protocol_stats AS ps (protocol_name, packet_count, total_size, avg_size)
+            SELECT pr.name, :sign * count(*), :sign * COALESCE(sum(s.packet_size), 0),
+                   round(avg(s.packet_size), 2)
+            FROM {source} s
+            JOIN protocols pr ON pr.id = s.protocol_id
+            GROUP BY pr.name
+            ON CONFLICT (protocol_name) DO UPDATE SET
+                packet_count = ps.packet_count + EXCLUDED.packet_count,
+                total_size = ps.total_size + EXCLUDED.total_size,
+                avg_size = round((ps.total_size + EXCLUDED.total_size)::numeric
+                                 / NULLIF(ps.packet_count + EXCLUDED.packet_count, 0), 2)
+        """), params)
+        if sign < 0:
+            self.session.execute(text("DELETE FROM protocol_stats WHERE packet_count <= 0"))
+
+    def merge_ips(self, source: str, params: Optional[Dict] = None, sign: int = 1):
+        # Источники и получатели считаются за один проход по строкам
+        params = dict(params or {}, sign=sign)
+        self.session.execute(text(f"""
+            INSERT INTO ip_stats AS st (ip_address, role, packet_count, total_traffic)
+            SELECT host(CASE WHEN GROUPING(s.source_ip) = 0 THEN s.source_ip ELSE s.destination_ip END),
+                   CASE WHEN GROUPING(s.source_ip) = 0 THEN 'src' ELSE 'dst' END,
+                   :sign * count(*), :sign * COALESCE(sum(s.packet_size), 0)
+            FROM {source} s
+            GROUP BY GROUPING SETS ((s.source_ip), (s.destination_ip))
+            HAVING (CASE WHEN GROUPING(s.source_ip) = 0 THEN s.source_ip ELSE s.destination_ip END) IS NOT NULL
+            ON CONFLICT (ip_address, role) DO UPDATE SET
+                packet_count = st.packet_count + EXCLUDED.packet_count,
+                total_traffic = st.total_traffic + EXCLUDED.total_traffic
+        """), params)
+        if sign < 0:
+            self.session.execute(text("DELETE FROM ip_stats WHERE packet_count <= 0"))
+
+    def lock_capture(self, capture_id: int):
+        """
+        Блокировка загрузок захвата до конца транзакции: загрузки одного захвата
+        идут по очереди, разных захватов - параллельно. Берется до watermark
+        """
+        self.session.execute(text("SELECT pg_advisory_xact_lock(:space, :capture_id)"),
+                             {'space': self.CAPTURE_LOCK_SPACE, 'capture_id': capture_id})
+
+    def merge_since(self, capture_id: int, watermark: int):
+        """
+        Добавление строк захвата с id больше watermark - строк текущей загрузки.
+        id выдаются не в порядке коммитов, поэтому строки параллельных загрузок
+        других захватов отсекаются по capture_id, а того же захвата - lock_capture
+        """
+        self.merge("(SELECT protocol_id, source_ip, destination_ip, packet_size FROM packet_data "
+                   "WHERE capture_id = :capture_id AND id > :watermark)",
+                   {'capture_id': capture_id, 'watermark': watermark})
+
+    def watermark(self) -> int:
+        """Наибольший id в packet_data до загрузки (читается под lock_capture)"""
+        return self.session.execute(text("SELECT COALESCE(MAX(id), 0) FROM packet_data")).scalar()
+
+    def rebuild_protocols(self):
+        """Полный пересчет protocol_stats по packet_data"""
+        self.session.execute(text("DELETE FROM protocol_stats"))
+        self.merge_protocols("packet_data")
+
+    def rebuild_ips(self):
+        """Полный пересчет ip_stats по packet_data"""
+        self.session.execute(text("DELETE FROM ip_stats"))
+        self.merge_ips("packet_data")
+
+    def rebuild(self):
+        """Полный пересчет обеих сводок (восстановление из копии, миграция, ручное обновление)"""
+        self.rebuild_protocols()
+        self.rebuild_ips()
@@ -0,0 +1,93 @@
+﻿from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+class StatsViews:
+    """
+    Материализованное представление packet_stats_mv со сводками для панели
+    статистики и экспорта (только PostgreSQL).
+
+    Представление хранит все группы того же запроса GROUPING SETS, что и
+    StatsEngine: итог, протоколы, источники и получатели с числом групп
+    каждого набора. Чтение верхних строк идет по индексу
+    (grouping_set, packet_count DESC, ...) и не зависит от размера packet_data.
+    Обновление - REFRESH MATERIALIZED VIEW CONCURRENTLY (нужен уникальный индекс
+    по group_key): читатели не блокируются на время пересчета.
+    Коммит делает вызывающий код.
+    """
+
+    NAME = 'packet_stats_mv'
+
+    # Коды GROUPING(protocol_id, source_ip, destination_ip) - как в StatsEngine
+    TOTAL = 7
+    BY_PROTOCOL = 3
+    BY_SOURCE = 5
+    BY_DESTINATION = 6
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def exists(self) -> bool:
+        return self.session.execute(text("SELECT 1 FROM pg_matviews WHERE matviewname = :name"),
+                                    {'name': self.NAME}).first() is not None
+
+    def create(self):
+        self.session.execute(text(f"""
+            CREATE MATERIALIZED VIEW IF NOT EXISTS {self.NAME} AS
+            SELECT totals.*,
+                   COALESCE(protocol_id::text, host(source_ip), host(destination_ip), '') AS group_key,
+                   count(*) OVER (PARTITION BY grouping_set) AS group_count
+            FROM (
+                SELECT GROUPING(protocol_id, source_ip, destination_ip) AS grouping_set,
+                       protocol_id, source_ip, destination_ip,
+                       count(*) AS packet_count,
+                       sum(packet_size) AS total_size,
+                       avg(packet_size) AS avg_size,
+                       count(*) FILTER (WHERE packet_size > 0) AS sized_count,
+                       sum(packet_size) FILTER (WHERE packet_size > 0) AS sized_bytes,
+                       avg(packet_size) FILTER (WHERE packet_size > 0) AS sized_avg,
+                       min(packet_size) FILTER (WHERE packet_size > 0) AS min_size,
+                       max(packet_size) FILTER (WHERE packet_size > 0) AS max_size
+                FROM packet_data
+                GROUP BY GROUPING SETS ((), (protocol_id), (source_ip), (destination_ip))
+            ) totals
+            WHERE grouping_set = {self.TOTAL}
+               OR (grouping_set = {self.BY_PROTOCOL} AND protocol_id IS NOT NULL)
+               OR (grouping_set = {self.BY_SOURCE} AND source_ip IS NOT NULL)
+               OR (grouping_set = {self.BY_DESTINATION} AND destination_ip IS NOT NULL)
+        """))
+        self.session.execute(text(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_{self.NAME}_group ON {self.NAME} (grouping_set, group_key);
+            CREATE INDEX IF NOT EXISTS ix_{self.NAME}_top
+                ON {self.NAME} (grouping_set, packet_count DESC, protocol_id, source_ip, destination_ip)
+        """))
+
+    def refresh(self):
+        self.session.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {self.NAME}"))
+
+    def drop(self):
+        self.session.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {self.NAME}"))
+
+    def top_rows(self, top: int) -> List[tuple]:
+        """
+        Верхние top строк каждого набора группировки в формате строк
+        StatsEngine._compute_postgresql: по одному индексному чтению на набор
+        """
+        return self.session.execute(text(f"""
+            SELECT r.grouping_set, pr.name, host(r.source_ip), host(r.destination_ip),
+                   r.packet_count, r.total_size, r.avg_size, r.group_count,
+                   r.sized_count, r.sized_bytes, r.sized_avg, r.min_size, r.max_size
+            FROM (VALUES ({self.TOTAL}), ({self.BY_PROTOCOL}), ({self.BY_SOURCE}), ({self.BY_DESTINATION})) g (grouping_set)
+            CROSS JOIN LATERAL (
+                SELECT m.*, row_number() OVER () AS position
+                FROM (
+                    SELECT * FROM {self.NAME} v
+                    WHERE v.grouping_set = g.grouping_set
+                    ORDER BY v.packet_count DESC, v.protocol_id, v.source_ip, v.destination_ip
+                    LIMIT :top
+                ) m
+            ) r
+            LEFT JOIN protocols pr ON pr.id = r.protocol_id
+            ORDER BY r.grouping_set, r.position
+        """), {'top': top}).all()
@@ -0,0 +1,152 @@
+﻿import select
+import threading
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from services.stats_engine import StatsEngine
+from services.stats_views import StatsViews
+
+class StatsWorker:
+    """
+    Фоновый пересчет сводной статистики с подавлением дребезга.
+
+    Изменения packet_data только отмечают статистику устаревшей: загрузки этого
+    процесса вызывают mark_dirty, а в PostgreSQL поток еще слушает канал
+    packet_data_changed, в который пишет триггер auto_update_stats_trigger
+    (NOTIFY доставляется при коммите, повторы внутри транзакции склеиваются).
+    Отметки копятся, и представление StatsViews обновляется, а снимок
+    StatsEngine считается не чаще раза в interval секунд и не раньше settle
+    секунд после первой отметки - загрузка миллиона строк порциями дает
+    один пересчет, а не тысячу.
+    Готовый снимок передается в on_snapshot (кэш и файл автостатистики).
+
+    Поток работает на собственных соединениях (NullPool): общая сессия
+    DatabaseManager в это время может быть занята загрузкой. Исключение -
+    БД SQLite в памяти: она существует только в соединении движка
+    DatabaseManager (StaticPool), новое соединение открыло бы пустую базу,
+    поэтому используется сам этот движок.
+    """
+
+    CHANNEL = 'packet_data_changed'
+    INTERVAL = 30.0
+    SETTLE = 1.0
+    # Шаг ожидания уведомлений и проверки остановки
+    POLL = 0.5
+
+    def __init__(self, engine: Engine, on_snapshot: Callable[[dict], None],
+                 interval: float = INTERVAL, settle: float = SETTLE):
+        self._own_engine = not self._in_memory(engine)
+        self.engine = create_engine(engine.url, poolclass=NullPool) if self._own_engine else engine
+        self.Session = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.on_snapshot = on_snapshot
+        self.interval = interval
+        self.settle = settle
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._dirty_since: Optional[float] = None
+        self._last_run = 0.0
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _in_memory(engine: Engine) -> bool:
+        return engine.dialect.name == 'sqlite' and engine.url.database in (None, '', ':memory:')
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty_since is not None
+
+    def mark_dirty(self):
+        """Отметка, что packet_data изменилась и снимок нужно пересчитать"""
+        with self._lock:
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+        self._wake.set()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stats-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._own_engine:
+            self.engine.dispose()
+
+    def _run(self):
+        listener = self._listen()
+        try:
+            while not self._stop.is_set():
+                self._wait(listener)
+                if self._due():
+                    self._refresh()
+        finally:
+            if listener is not None:
+                listener.close()
+
+    def _listen(self):
+        """Отдельное соединение в режиме автокоммита для LISTEN (только psycopg2)"""
+        if self.engine.dialect.name != 'postgresql':
+            return None
+        try:
+            connection = self.engine.raw_connection()
+            if not hasattr(connection.dbapi_connection, 'notifies'):
+                connection.close()
+                return None
+            connection.dbapi_connection.autocommit = True
+            connection.cursor().execute(f"LISTEN {self.CHANNEL}")
+            return connection
+        except Exception as e:
+            print(f"Уведомления {self.CHANNEL} недоступны, пересчет только по загрузкам: {e}")
+            return None
+
+    def _wait(self, listener):
+        if listener is None:
+            self._wake.wait(self.POLL)
+            self._wake.clear()
+            return
+        connection = listener.dbapi_connection
+        if select.select([connection], [], [], self.POLL)[0]:
+            connection.poll()
+            if connection.notifies:
+                connection.notifies.clear()
+                self.mark_dirty()
+
+    def _due(self) -> bool:
+        with self._lock:
+            if self._dirty_since is None:
+                return False
+            now = time.monotonic()
+            return now >= max(self._last_run + self.interval, self._dirty_since + self.settle)
+
+    def _refresh(self):
+        with self._lock:
+            # Отметки, пришедшие во время пересчета, вызовут следующий
+            self._dirty_since = None
+            self._last_run = time.monotonic()
+
+        session = self.Session()
+        try:
+            if self.engine.dialect.name == 'postgresql':
+                views = StatsViews(session)
+                if views.exists():
+                    views.refresh()
+                    session.commit()
+            snapshot = StatsEngine(session).compute()
+        except Exception as e:
+            print(f"Ошибка фонового пересчета статистики: {e}")
+            return
+        finally:
+            session.close()
+        self.on_snapshot(snapshot)
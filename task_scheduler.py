@@ -0,0 +1,207 @@
+﻿import heapq
+import itertools
+import threading
+from typing import Callable, Dict, List, Optional
+
+class TaskCancelled(Exception):
+    """Задача остановлена по флагу CancelToken"""
+
+
+class CancelToken:
+    """
+    Флаг отмены задачи: задача сама проверяет его между порциями работы.
+    Обработчики add_callback вызываются в момент отмены - ими прерывается
+    то, что между проверками не заканчивается (выполняющийся запрос SQL)
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Ошибка обработчика отмены: {e}")
+
+    def add_callback(self, callback: Callable[[], None]):
+        """callback() выполнится в потоке, вызвавшем cancel(); у отмененного токена - сразу"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TaskCancelled("Операция отменена")
+
+
+def is_cancelled(token: Optional[CancelToken]) -> bool:
+    return token is not None and token.cancelled
+
+
+def check_cancelled(token: Optional[CancelToken]):
+    """Проверка между порциями работы в функциях, где токен необязателен"""
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+class Task:
+    """Задача TaskScheduler: state - pending, running, done, failed или cancelled"""
+
+    def __init__(self, name: str, category: str, priority: int, target: Callable, args: tuple,
+                 token: CancelToken, sequence: int):
+        self.name = name
+        self.category = category
+        self.priority = priority
+        self.target = target
+        self.args = args
+        self.token = token
+        self.sequence = sequence
+        self.state = 'pending'
+        self.error: Optional[Exception] = None
+        self.finished = threading.Event()
+
+    def cancel(self):
+        """Ожидающая задача не запустится, выполняющаяся увидит флаг токена"""
+        self.token.cancel()
+
+
+class TaskScheduler:
+    """
+    Пул рабочих потоков для фоновых задач GUI с категориями, приоритетами и отменой.
+
+    Категория задачи (CATEGORIES) ограничивает число одновременно выполняемых
+    задач: загрузка и изменение схемы - по одной, запросы вкладок - несколько
+    параллельно. Свободный поток берет из ожидающих задачу с наименьшим
+    значением приоритета (INTERACTIVE раньше BACKGROUND), категория которой не
+    исчерпала лимит, при равном приоритете - раньше поставленную. Поэтому
+    запрос фильтра не ждет резервного копирования, а вторая загрузка ждет первую.
+    Отмена - через CancelToken: ожидающая задача снимается, выполняющаяся
+    проверяет токен сама. on_finish(task) вызывается в рабочем потоке после
+    каждой задачи - в том числе отмененной до запуска
+    """
+
+    INTERACTIVE = 0
+    NORMAL = 5
+    BACKGROUND = 10
+
+    # Категория -> (одновременно выполняемых задач, приоритет по умолчанию)
+    CATEGORIES = {
+        'ingest': (1, NORMAL),          # загрузка, очистка и пересоздание таблиц
+        'query': (4, INTERACTIVE),      # запросы вкладок: фильтры, списки, просмотр таблиц
+        'export': (2, NORMAL),          # экспорт в файлы
+        'maintenance': (1, BACKGROUND)  # резервные копии, индексы, пересчет сводок
+    }
+    WORKERS = 6
+
+    def __init__(self, workers: int = WORKERS, on_finish: Optional[Callable[[Task], None]] = None):
+        self.on_finish = on_finish
+        self._condition = threading.Condition()
+        # Куча (приоритет, порядковый номер, задача)
+        self._pending = []
+        self._running: Dict[str, List[Task]] = {category: [] for category in self.CATEGORIES}
+        self._sequence = itertools.count()
+        self._shutdown = False
+        self._threads = [threading.Thread(target=self._work, name=f'task-worker-{number}', daemon=True)
+                         for number in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, category: str, target: Callable, *args, name: Optional[str] = None,
+               priority: Optional[int] = None, token: Optional[CancelToken] = None) -> Task:
+        if category not in self.CATEGORIES:
+            raise ValueError(f"Неизвестная категория задачи: {category}")
+        default_priority = self.CATEGORIES[category][1]
+        task = Task(name or getattr(target, '__qualname__', str(target)), category,
+                    default_priority if priority is None else priority,
+                    target, args, token or CancelToken(), next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._pending, (task.priority, task.sequence, task))
+            self._condition.notify_all()
+        return task
+
+    def tasks(self, category: Optional[str] = None) -> List[Task]:
+        """Ожидающие и выполняющиеся задачи (не отмененные до запуска)"""
+        with self._condition:
+            active = [task for tasks in self._running.values() for task in tasks]
+            active += [task for _, _, task in sorted(self._pending) if not task.token.cancelled]
+        return [task for task in active if category is None or task.category == category]
+
+    def is_full(self, category: str) -> bool:
+        """Новая задача категории будет ждать: лимит одновременных задач исчерпан"""
+        with self._condition:
+            return len(self._running[category]) >= self.CATEGORIES[category][0]
+
+    def cancel_all(self, category: Optional[str] = None):
+        for task in self.tasks(category):
+            task.cancel()
+
+    def shutdown(self):
+        self.cancel_all()
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+
+    def _take(self) -> Optional[Task]:
+        """Следующая задача под блокировкой: отмененные снимаются, лимиты категорий соблюдаются"""
+        for entry in sorted(self._pending):
+            task = entry[2]
+            if task.token.cancelled or len(self._running[task.category]) < self.CATEGORIES[task.category][0]:
+                self._pending.remove(entry)
+                heapq.heapify(self._pending)
+                return task
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                task = self._take()
+                while task is None:
+                    if self._shutdown:
+                        return
+                    self._condition.wait()
+                    task = self._take()
+                if not task.token.cancelled:
+                    task.state = 'running'
+                    self._running[task.category].append(task)
+
+            if task.state == 'running':
+                try:
+                    task.target(*task.args)
+                    task.state = 'done'
+                except TaskCancelled:
+                    task.state = 'cancelled'
+                except Exception as e:
+                    task.state = 'failed'
+                    task.error = e
+                finally:
+                    with self._condition:
+                        self._running[task.category].remove(task)
+                        self._condition.notify_all()
+            else:
+                task.state = 'cancelled'
+
+            if self.on_finish is not None:
+                try:
+                    self.on_finish(task)
+                except Exception as e:
+                    print(f"Ошибка обработчика завершения задачи {task.name}: {e}")
+            task.finished.set()
@@ -0,0 +1,52 @@
+﻿import pytest
+
+from services.file_parser import FileParser
+from services.packet_batch import PacketBatch
+from benchmarks.bench_tokenizer import legacy_parse_lines
+from benchmarks.log_generator import write_synthetic_log
+
+
+@pytest.fixture(scope='module')
+def log_and_reference(tmp_path_factory):
+    """Синтетический лог и его разбор прежним алгоритмом на регулярных выражениях"""
+    file_path = str(tmp_path_factory.mktemp('parser') / 'capture.log')
+    write_synthetic_log(file_path, 3000, seed=7)
+    with open(file_path, encoding='utf-8') as f:
+        return file_path, legacy_parse_lines(line.rstrip('\n') for line in f)
+
+
+def test_iter_packets_matches_regex_parse(log_and_reference):
+    file_path, reference = log_and_reference
+    assert len(reference) == 3000
+    assert list(FileParser.iter_packets(file_path)) == reference
+
+
+def test_iter_packets_mmap_matches_regex_parse(log_and_reference):
+    file_path, reference = log_and_reference
+    assert list(FileParser.iter_packets_mmap(file_path)) == reference
+
+
+def test_mmap_byte_ranges_cover_file(log_and_reference):
+    file_path, reference = log_and_reference
+    packets = []
+    for start, end in FileParser.split_file_ranges(file_path, 7):
+        packets.extend(FileParser.iter_packets_mmap(file_path, start=start, end=end))
+    assert packets == reference
+
+
+def test_parse_parallel_matches_regex_parse(log_and_reference):
+    file_path, reference = log_and_reference
+    batch = FileParser._parse_parallel(file_path, workers=2)
+    assert list(batch) == sorted(reference, key=lambda packet: packet['number'])
+
+
+@pytest.mark.parametrize('workers, chunk_bytes', [(1, FileParser.PARALLEL_CHUNK_BYTES), (2, 64 * 1024)])
+def test_iter_batches_keep_file_order(log_and_reference, workers, chunk_bytes):
+    file_path, reference = log_and_reference
+    batches = list(FileParser.iter_batches(file_path, batch_size=1000, workers=workers, chunk_bytes=chunk_bytes))
+    assert all(isinstance(batch, PacketBatch) for batch in batches)
+    assert [packet for batch in batches for packet in batch] == reference
+    if workers == 1:
+        assert [len(batch) for batch in batches] == [1000, 1000, 1000]
+    else:
+        assert len(batches) > 1
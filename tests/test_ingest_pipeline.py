@@ -0,0 +1,30 @@
+﻿import services.file_parser
+from services.file_parser import FileParser
+from services.ingest_pipeline import IngestPipeline
+
+
+def test_small_file_is_parsed_in_thread_by_batch_size(db_service, synthetic_log, monkeypatch):
+    file_path, packets = synthetic_log
+
+    def no_processes(*args, **kwargs):
+        raise AssertionError("малый файл не должен разбираться процессами")
+
+    monkeypatch.setattr(services.file_parser, 'ProcessPoolExecutor', no_processes)
+    pipeline = IngestPipeline(db_service, batch_size=1000)
+    assert pipeline.parse_workers(file_path) is None
+
+    progress = []
+    success, message = pipeline.run(file_path, lambda percent, text: progress.append(text))
+    assert success, message
+    assert pipeline.packets_count == len(packets)
+    assert len(progress) == len(packets) // 1000
+
+
+def test_parse_workers(synthetic_log, monkeypatch):
+    file_path, _ = synthetic_log
+    assert IngestPipeline(None, workers=3).parse_workers(file_path) == 3
+    monkeypatch.setattr(FileParser, 'PARALLEL_MIN_BYTES', 0)
+    monkeypatch.setattr('os.cpu_count', lambda: 8)
+    assert IngestPipeline(None).parse_workers(file_path) == 7
+    monkeypatch.setattr('os.cpu_count', lambda: 1)
+    assert IngestPipeline(None).parse_workers(file_path) == 1
@@ -0,0 +1,28 @@
+﻿from models.models import PacketData
+
+
+def packet_sizes(db_service, number):
+    session = db_service.get_session()
+    try:
+        return [size for size, in session.query(PacketData.packet_size).filter(PacketData.packet_number == number)]
+    finally:
+        session.close()
+
+
+def test_upsert_keeps_last_duplicate_in_file(db_service, synthetic_log):
+    file_path, packets = synthetic_log
+    first, second = packets[0], packets[1]
+    success, message = db_service.insert_packet_data(packets, source_file=file_path)
+    assert success, message
+
+    versions = [dict(first, size=100), dict(second, size=150), dict(first, size=200), dict(first, size=300)]
+    success, message = db_service.insert_packet_data(versions, load_mode='upsert', source_file=file_path)
+    assert success, message
+    assert packet_sizes(db_service, first['number']) == [300]
+    assert packet_sizes(db_service, second['number']) == [150]
+
+    # Версии в разных порциях потока: последняя порция заменяет предыдущие
+    success, message = db_service.load_packet_stream([[dict(first, size=400)], [dict(first, size=500)]],
+                                                     load_mode='upsert', source_file=file_path)
+    assert success, message
+    assert packet_sizes(db_service, first['number']) == [500]
@@ -0,0 +1,80 @@
+﻿import os
+
+from sqlalchemy import func
+
+from models.models import Capture, PacketData
+from services.log_follower import LogFollower
+from benchmarks.log_generator import write_synthetic_log
+
+
+def append_packet_line(file_path, number, newline=True):
+    with open(file_path, 'a', encoding='utf-8') as f:
+        f.write(f"║ {number:<6} │ 10:30:00.000001 │ 10.0.0.1        │ 10.0.0.2        │ 443   │ 50000 │ 60     "
+                f"│ ACK     │ TCP      ║" + ('\n' if newline else ''))
+
+
+def poll_into_db(db_service, follower, capture):
+    """Один опрос слежения так же, как DataManagementTab.toggle_follow: новое поколение файла - новый захват"""
+    for batch in follower.poll():
+        if follower.generation != capture['generation']:
+            success, capture_id = db_service.create_capture(follower.file_path)
+            assert success, capture_id
+            capture.update(generation=follower.generation, id=capture_id)
+        success, message = db_service.append_packet_data(batch, source_file=follower.file_path,
+                                                         capture_id=capture['id'])
+        assert success, message
+        follower.mark_processed(batch)
+
+
+def packets_per_capture(db_service):
+    session = db_service.get_session()
+    try:
+        rows = session.query(Capture.id, func.count(PacketData.id), func.max(PacketData.packet_number)).join(
+            PacketData, PacketData.capture_id == Capture.id).group_by(Capture.id).order_by(Capture.id).all()
+        return [(count, last_number) for _, count, last_number in rows]
+    finally:
+        session.close()
+
+
+def test_rotation_and_truncation_start_new_captures(db_service, tmp_path):
+    file_path = str(tmp_path / 'capture.log')
+    write_synthetic_log(file_path, 300, seed=1)
+    follower = LogFollower(file_path, offset=0, batch_size=100)
+    capture = {'generation': 0, 'id': None}
+
+    poll_into_db(db_service, follower, capture)
+    append_packet_line(file_path, 301)
+    poll_into_db(db_service, follower, capture)
+    assert packets_per_capture(db_service) == [(301, 301)]
+
+    # Ротация: прежний файл переименован, под тем же именем новый с номерами с начала
+    os.replace(file_path, file_path + '.1')
+    write_synthetic_log(file_path, 400, seed=2)
+    poll_into_db(db_service, follower, capture)
+    poll_into_db(db_service, follower, capture)
+    assert follower.generation == 1
+    assert packets_per_capture(db_service) == [(301, 301), (400, 400)]
+
+    # Усечение: тот же файл перезаписан более коротким
+    write_synthetic_log(file_path, 50, seed=3)
+    poll_into_db(db_service, follower, capture)
+    assert follower.generation == 2
+    assert packets_per_capture(db_service) == [(301, 301), (400, 400), (50, 50)]
+
+    success, last_number = db_service.get_last_packet_number(source_file=file_path)
+    assert success and last_number == 301
+
+
+def test_follower_waits_for_complete_lines(tmp_path):
+    file_path = str(tmp_path / 'capture.log')
+    write_synthetic_log(file_path, 10)
+    follower = LogFollower(file_path)
+    assert list(follower.poll()) == []
+    assert follower.offset == os.path.getsize(file_path)
+
+    append_packet_line(file_path, 11, newline=False)
+    assert list(follower.poll()) == []
+    with open(file_path, 'a', encoding='utf-8') as f:
+        f.write('\n')
+    assert [list(batch.numbers) for batch in follower.poll()] == [[11]]
+    assert follower.generation == 0
@@ -0,0 +1,43 @@
+﻿from services.packet_batch import PacketBatch
+
+
+def packet(number, source_ip='10.0.0.1', destination_ip='10.0.0.2', protocol='TCP', flags='ACK'):
+    return {'number': number, 'timestamp': f'10:25:{number % 60:02d}.000001', 'source_ip': source_ip,
+            'destination_ip': destination_ip, 'source_port': 443, 'destination_port': 50000 + number,
+            'size': 60 + number, 'flags': flags, 'protocol': protocol}
+
+
+def test_round_trip_keeps_every_field():
+    packets = [packet(1), packet(2, source_ip='', destination_ip='-', flags=''),
+               packet(3, source_ip='fe80::1', destination_ip='00:11:22:33:44:55', protocol='ARP'),
+               packet(4, source_ip='010.0.0.1', protocol='TLSv1.3'), packet(5, destination_ip='255.255.255.255')]
+    batch = PacketBatch.from_packets(packets)
+
+    assert len(batch) == len(packets)
+    assert list(batch) == packets
+    assert batch[2] == packets[2] and batch[-1] == packets[-1]
+    assert batch[1:3] == packets[1:3]
+    assert batch.protocols() == {'TCP', 'ARP', 'TLSv1.3'}
+    assert list(batch.iter_rows(('number', 'source_ip'))) == [(p['number'], p['source_ip']) for p in packets]
+    assert list(batch.as_export_rows()) == [tuple(p[field] for field in PacketBatch.EXPORT_FIELDS) for p in packets]
+
+
+def test_sorted_by_number():
+    batch = PacketBatch.from_packets([packet(3), packet(1, source_ip='-'), packet(2, protocol='DNS')])
+    assert [p['number'] for p in batch.sorted_by_number()] == [1, 2, 3]
+    assert batch.sorted_by_number()[0] == packet(1, source_ip='-')
+
+
+def test_merge_sorted_concatenates_adjacent_batches():
+    first = PacketBatch.from_packets([packet(1), packet(2, source_ip='', protocol='DNS')])
+    second = PacketBatch.from_packets([packet(3, protocol='ARP', flags='-'), packet(4, destination_ip='fe80::2')])
+    merged = PacketBatch.merge_sorted([first, PacketBatch(), second])
+    assert list(merged) == list(first) + list(second)
+
+
+def test_merge_sorted_interleaves_overlapping_batches():
+    odd = [packet(number, protocol='UDP') for number in (1, 3, 5)]
+    even = [packet(number, source_ip='') for number in (2, 4, 6)]
+    merged = PacketBatch.merge_sorted([PacketBatch.from_packets(odd), PacketBatch.from_packets(even)])
+    assert list(merged) == sorted(odd + even, key=lambda p: p['number'])
+    assert len(PacketBatch.merge_sorted([])) == 0
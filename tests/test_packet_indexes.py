@@ -0,0 +1,35 @@
+﻿from sqlalchemy import text
+
+from models.models import PacketData
+
+
+def explain_keyset_page(db_service, after):
+    """Диалект и план запроса следующей страницы get_filtered_page после курсора after"""
+    session = db_service.get_session()
+    try:
+        query = db_service._build_filtered_query(session, []).add_columns(PacketData.id)
+        query = db_service._seek_filter(query, after, '>').limit(101)
+        dialect = session.get_bind().dialect
+        sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+        if dialect.name == 'postgresql':
+            return dialect.name, '\n'.join(session.execute(text(f"EXPLAIN {sql}")).scalars())
+        return dialect.name, '\n'.join(row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+    finally:
+        session.close()
+
+
+def test_keyset_page_reads_composite_index(db_service, synthetic_log):
+    file_path, packets = synthetic_log
+    success, message = db_service.insert_packet_data(packets, source_file=file_path)
+    assert success, message
+    success, message = db_service.ensure_indexes()
+    assert success, message
+
+    dialect, plan = explain_keyset_page(db_service, (2500, 2500))
+    if dialect == 'postgresql':
+        assert 'ix_packet_data_number_id' in plan
+    else:
+        # В SQLite любой индекс заканчивается rowid (= id), индекс packet_number тоже упорядочен по ключу
+        assert 'USING INDEX ix_packet_data_number_id' in plan or 'USING INDEX ix_packet_data_packet_number' in plan
+    # Строки идут из индекса в порядке ключа - без сортировки всей выборки
+    assert 'Sort' not in plan and 'TEMP B-TREE' not in plan
@@ -0,0 +1,52 @@
+﻿from services.packet_range import PacketRange
+
+
+class KeyedRows:
+    """Выборка в памяти с чтением как у DatabaseService._packet_range_rows: от ключа с пропуском строк"""
+
+    def __init__(self, total):
+        self.keyed = [((number // 3, number), ('row', number)) for number in range(total)]
+        self.calls = []
+
+    def __call__(self, anchor, skip, count):
+        self.calls.append((anchor, skip, count))
+        start = 0 if anchor is None else self.keyed.index(next(entry for entry in self.keyed if entry[0] == anchor))
+        return self.keyed[start + skip:start + skip + count]
+
+
+def test_rows_read_from_nearest_anchor():
+    fetch = KeyedRows(1000)
+    packets = PacketRange(fetch, ['номер_пакета'], len(fetch.keyed), step=100)
+
+    assert packets.rows(0, 50) == [('row', number) for number in range(50)]
+    assert fetch.calls[-1] == (None, 0, 51)
+    assert packets.anchors == {}
+
+    assert packets.rows(50, 100) == [('row', number) for number in range(50, 150)]
+    assert packets.anchors == {1: fetch.keyed[100][0]}
+
+    # Окно за известными якорями читается от ближайшего из них с пропуском строк
+    assert packets.rows(200, 10) == [('row', number) for number in range(200, 210)]
+    assert fetch.calls[-1] == (fetch.keyed[100][0], 100, 11)
+    assert packets.anchors[2] == fetch.keyed[200][0]
+
+    assert packets.rows(730, 5) == [('row', number) for number in range(730, 735)]
+    assert fetch.calls[-1] == (fetch.keyed[200][0], 530, 6)
+    assert packets.rows(695, 10) == [('row', number) for number in range(695, 705)]
+    assert packets.anchors[7] == fetch.keyed[700][0]
+    assert packets.rows(760, 5) == [('row', number) for number in range(760, 765)]
+    assert fetch.calls[-1] == (fetch.keyed[700][0], 60, 6)
+
+
+def test_sequence_protocol():
+    fetch = KeyedRows(250)
+    packets = PacketRange(fetch, ['номер_пакета'], len(fetch.keyed), step=20)
+
+    assert len(packets) == 250
+    assert packets[-1] == ('row', 249)
+    assert packets[10:13] == [('row', 10), ('row', 11), ('row', 12)]
+    assert packets[0:9:4] == [('row', 0), ('row', 4), ('row', 8)]
+    assert packets.rows(240, 100) == [('row', number) for number in range(240, 250)]
+    assert packets.rows(300, 10) == []
+    assert list(packets) == [('row', number) for number in range(250)]
+    assert all(skip == 0 for anchor, skip, count in fetch.calls[-2:])
@@ -0,0 +1,46 @@
+﻿import random
+from collections import Counter
+
+import pytest
+
+from services.sketches import HyperLogLog, SpaceSaving
+
+
+@pytest.mark.parametrize('distinct', [100, 5000, 100000])
+def test_hyperloglog_error_bound(distinct):
+    sketch = HyperLogLog()
+    values = [f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}' for i in range(distinct)]
+    sketch.add_all(values)
+    # Стандартная ошибка при precision=14 около 0.8% - граница в четыре ошибки
+    assert sketch.count() == pytest.approx(distinct, rel=0.033)
+
+    # Повторы и сохранение не меняют оценку, слияние с частью - тоже
+    sketch.add_all(values[:distinct // 2])
+    restored = HyperLogLog.from_bytes(sketch.to_bytes())
+    part = HyperLogLog()
+    part.add_all(values[::3])
+    restored.merge(part)
+    assert restored.count() == sketch.count()
+
+
+def test_space_saving_error_bound():
+    rnd = random.Random(1)
+    items = [f'host{min(int(rnd.paretovariate(1.2)), 500)}' for _ in range(50000)]
+    capacity = 20
+    sketch = SpaceSaving(capacity)
+    exact = Counter()
+    for start in range(0, len(items), 1000):
+        counts = Counter(items[start:start + 1000])
+        exact.update(counts)
+        sketch.update(counts, {item: count * 100 for item, count in counts.items()})
+
+    sketch = SpaceSaving.from_bytes(sketch.to_bytes())
+    assert len(sketch.counters) == capacity
+    entries = {item: (count, error) for item, count, weight, error in sketch.top(capacity)}
+    for item, (count, error) in entries.items():
+        # Счетчик завышен не больше чем на свою границу error
+        assert count - error <= exact[item] <= count
+    for item, count in exact.items():
+        if count > len(items) / capacity:
+            assert item in entries
+    assert [item for item, *_ in sketch.top(3)] == [item for item, _ in exact.most_common(3)]
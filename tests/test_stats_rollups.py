@@ -0,0 +1,48 @@
+﻿import threading
+
+import pytest
+from sqlalchemy import text
+
+
+def rollups_and_exact(db_service):
+    session = db_service.get_session()
+    try:
+        rollups = sorted(session.execute(text("SELECT protocol_name, packet_count, total_size FROM protocol_stats")))
+        exact = sorted(session.execute(text("""
+            SELECT pr.name, count(*), sum(p.packet_size)
+            FROM packet_data p JOIN protocols pr ON pr.id = p.protocol_id
+            GROUP BY pr.name
+        """)))
+        ips = session.execute(text("SELECT sum(packet_count) FROM ip_stats WHERE role = 'src'")).scalar()
+        exact_ips = session.execute(text("SELECT count(source_ip) FROM packet_data")).scalar()
+        return rollups, exact, ips, exact_ips
+    finally:
+        session.close()
+
+
+def test_concurrent_loads_count_rows_once(db_service, synthetic_log):
+    if db_service.db_manager.engine.dialect.name != 'postgresql':
+        pytest.skip("сводки ведутся инкрементально только в PostgreSQL")
+    file_path, packets = synthetic_log
+    success, message = db_service.insert_packet_data(packets[:1000], source_file=file_path)
+    assert success, message
+
+    # Пока первая загрузка идет (отметка id уже прочитана), вторая - другого захвата - завершается
+    other_load = []
+
+    def load_other_capture(percent, text):
+        if not other_load:
+            thread = threading.Thread(target=lambda: other_load.append(
+                db_service.append_packet_data(packets[2000:3000], source_file=file_path + '.1')))
+            thread.start()
+            thread.join(30)
+
+    success, message = db_service.load_packet_stream([packets[1000:1500], packets[1500:2000]], progress_callback=
+                                                     load_other_capture, load_mode='append', source_file=file_path)
+    assert success, message
+    assert other_load and other_load[0][0], other_load
+
+    rollups, exact, ips, exact_ips = rollups_and_exact(db_service)
+    assert sum(count for _, count, _ in exact) == 3000
+    assert rollups == exact
+    assert ips == exact_ips
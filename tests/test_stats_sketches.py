@@ -0,0 +1,56 @@
+﻿import pytest
+
+from services.task_scheduler import TaskScheduler
+
+
+@pytest.fixture
+def scheduler(db_service):
+    db_service.scheduler = TaskScheduler()
+    yield db_service.scheduler
+    db_service.scheduler.shutdown()
+
+
+def exact_and_approximate(db_service):
+    db_service.set_approximate_stats(False)
+    exact = db_service.get_stats_summary(refresh=True)
+    success, message = db_service.set_approximate_stats(True)
+    assert success, message
+    return exact, db_service.get_stats_summary(refresh=True)
+
+
+def test_upsert_keeps_approximate_summary_exact(db_service, synthetic_log, scheduler):
+    file_path, packets = synthetic_log
+    db_service.set_approximate_stats(True)
+    for load_mode in ('replace', 'upsert', 'upsert'):
+        success, message = db_service.insert_packet_data(packets, load_mode=load_mode, source_file=file_path)
+        assert success, message
+
+    # Upsert удалил эскизы: сводка точная, пересчет поставлен задачей планировщика
+    summary = db_service.get_stats_summary(refresh=True)
+    assert 'error' not in summary and not summary.get('approximate')
+    rebuild = db_service.schedule_sketch_rebuild()
+    assert rebuild.category == 'maintenance'
+    assert rebuild.finished.wait(30) and rebuild.state == 'done'
+
+    exact, approximate = exact_and_approximate(db_service)
+    assert 'error' not in exact and 'error' not in approximate
+    assert approximate['approximate']
+    assert approximate['total_packets'] == exact['total_packets'] == len(packets)
+    assert approximate['total_traffic'] == exact['total_traffic']
+    assert approximate['size'] == pytest.approx(exact['size'])
+    assert approximate['top_protocols'] == exact['top_protocols']
+    assert approximate['unique_ips'] == pytest.approx(exact['unique_ips'], rel=0.05)
+
+
+def test_missing_sketches_are_not_rebuilt_by_caller(db_service, synthetic_log):
+    file_path, packets = synthetic_log
+    db_service.set_approximate_stats(True)
+    success, message = db_service.insert_packet_data(packets, load_mode='upsert', source_file=file_path)
+    assert success, message
+
+    # Без планировщика сводка точная, а эскизы пересчитывает только явный вызов
+    assert not db_service.get_stats_summary(refresh=True).get('approximate')
+    assert not db_service.get_stats_summary(refresh=True).get('approximate')
+    success, message = db_service.rebuild_stats_sketches()
+    assert success, message
+    assert db_service.get_stats_summary()['approximate']
@@ -0,0 +1,104 @@
+﻿import threading
+
+import pytest
+
+from services.task_scheduler import TaskScheduler, check_cancelled
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def scheduler():
+    finished = []
+    scheduler = TaskScheduler(on_finish=finished.append)
+    scheduler.finished = finished
+    yield scheduler
+    scheduler.shutdown()
+
+
+def blocking(started, release):
+    started.release()
+    assert release.wait(TIMEOUT)
+
+
+def test_category_limits(scheduler):
+    started = threading.Semaphore(0)
+    release = threading.Event()
+    queries = [scheduler.submit('query', blocking, started, release) for _ in range(5)]
+    ingests = [scheduler.submit('ingest', blocking, started, release) for _ in range(2)]
+
+    for _ in range(5):
+        assert started.acquire(timeout=TIMEOUT)
+    assert not started.acquire(timeout=0.2)
+
+    assert sorted(task.state for task in queries) == ['pending'] + ['running'] * 4
+    assert sorted(task.state for task in ingests) == ['pending', 'running']
+    assert scheduler.is_full('query') and scheduler.is_full('ingest') and not scheduler.is_full('export')
+
+    release.set()
+    for task in queries + ingests:
+        assert task.finished.wait(TIMEOUT)
+        assert task.state == 'done'
+
+
+def test_priority_order_within_category(scheduler):
+    started = threading.Semaphore(0)
+    release = threading.Event()
+    order = []
+    blocker = scheduler.submit('maintenance', blocking, started, release)
+    assert started.acquire(timeout=TIMEOUT)
+    tasks = [scheduler.submit('maintenance', order.append, name, priority=priority)
+             for name, priority in (('background', TaskScheduler.BACKGROUND), ('interactive', TaskScheduler.INTERACTIVE),
+                                    ('normal', TaskScheduler.NORMAL))]
+    release.set()
+    for task in [blocker] + tasks:
+        assert task.finished.wait(TIMEOUT)
+    assert order == ['interactive', 'normal', 'background']
+
+
+def test_cancel_before_start(scheduler):
+    started = threading.Semaphore(0)
+    release = threading.Event()
+    ran = []
+    blocker = scheduler.submit('ingest', blocking, started, release)
+    assert started.acquire(timeout=TIMEOUT)
+
+    waiting = scheduler.submit('ingest', ran.append, 'waiting')
+    waiting.cancel()
+    assert waiting.finished.wait(TIMEOUT)
+    assert waiting.state == 'cancelled' and waiting in scheduler.finished
+    assert waiting not in scheduler.tasks('ingest')
+    assert blocker.state == 'running'
+
+    release.set()
+    assert blocker.finished.wait(TIMEOUT)
+    assert scheduler.submit('ingest', ran.append, 'next').finished.wait(TIMEOUT)
+    assert ran == ['next']
+
+
+def test_running_task_sees_cancel(scheduler):
+    started = threading.Semaphore(0)
+
+    def work(token_ready):
+        started.release()
+        assert token_ready.wait(TIMEOUT)
+        check_cancelled(task.token)
+
+    token_ready = threading.Event()
+    task = scheduler.submit('export', work, token_ready)
+    assert started.acquire(timeout=TIMEOUT)
+    task.cancel()
+    token_ready.set()
+    assert task.finished.wait(TIMEOUT)
+    assert task.state == 'cancelled' and task.error is None
+
+
+def test_failed_task_keeps_error(scheduler):
+    def fail():
+        raise ValueError('нет данных')
+
+    task = scheduler.submit('query', fail)
+    assert task.finished.wait(TIMEOUT)
+    assert task.state == 'failed' and isinstance(task.error, ValueError)
+    with pytest.raises(ValueError):
+        scheduler.submit('unknown', fail)
@@ -0,0 +1,26 @@
+﻿from datetime import datetime
+
+from services.bulk_loader import TimestampResolver
+
+
+def test_midnight_rollover_advances_date():
+    resolver = TimestampResolver(datetime(2025, 11, 10, 0, 30))
+    values = ['23:59:58.500000', '23:59:59.999999', '00:00:00.000001', '0:00:01.5', '00:15:00']
+    assert [resolver.resolve(value) for value in values] == [
+        '2025-11-09 23:59:58.500000', '2025-11-09 23:59:59.999999',
+        '2025-11-10 00:00:00.000001', '2025-11-10 00:00:01.5', '2025-11-10 00:15:00']
+
+
+def test_small_step_back_keeps_date():
+    resolver = TimestampResolver(datetime(2025, 11, 9, 12, 0))
+    assert resolver.resolve('10:25:01.000002') == '2025-11-09 10:25:01.000002'
+    assert resolver.resolve('10:25:01.000001') == '2025-11-09 10:25:01.000001'
+    assert resolver.resolve('01:00:00') == '2025-11-09 01:00:00'
+
+
+def test_dates_and_garbage():
+    resolver = TimestampResolver(datetime(2025, 11, 9, 12, 0))
+    assert resolver.resolve('2025-11-01 08:00:00') == '2025-11-01 08:00:00'
+    assert resolver.resolve('') is None
+    assert resolver.resolve('-') is None
+    assert resolver.resolve('25 декабря') is None
@@ -0,0 +1,77 @@
+﻿import time
+from queue import Queue, Empty
+
+class TreeFeeder:
+    """
+    Вывод результатов рабочего потока в VirtualTreeview без обращений к Tk из потока.
+
+    Рабочий поток только кладет сообщения в очередь: источник строк (set_source),
+    порции строк (put_rows) и завершение (finish). Главный цикл по root.after
+    забирает сообщения, пока не исчерпан бюджет времени тика, дописывает порции
+    в таблицу и вызывает обработчик завершения - интерфейс не замирает, пока
+    приходят большие результаты. cancel() останавливает вывод, когда запрос
+    заменен новым. Задача производителя передается в start(task): если она
+    закончилась без finish (ошибка, отмена), вывод останавливается сам
+    """
+
+    BATCH_ROWS = 500
+    TICK_MS = 10
+    # Время тика, после которого оставшиеся порции ждут следующего тика (секунды)
+    TIME_BUDGET = 0.008
+
+    def __init__(self, root, view):
+        self.root = root
+        self.view = view
+        self.queue = Queue()
+        self.active = False
+        self.task = None
+
+    # Рабочий поток
+
+    def set_source(self, columns, rows=None):
+        """Новые колонки и источник строк целиком (список или PacketRange); без rows - пустая таблица"""
+        self.queue.put(('source', (columns, [] if rows is None else rows)))
+
+    def put_rows(self, rows):
+        """Порция строк по мере получения (например, on_rows запроса страницы)"""
+        for start in range(0, len(rows), self.BATCH_ROWS):
+            self.queue.put(('rows', rows[start:start + self.BATCH_ROWS]))
+
+    def finish(self, callback=None, *args):
+        """callback(*args) выполнится в главном потоке после вывода всех порций"""
+        self.queue.put(('done', (callback, args)))
+
+    # Главный поток
+
+    def start(self, task=None):
+        self.task = task
+        self.active = True
+        self.root.after(self.TICK_MS, self._tick)
+
+    def cancel(self):
+        self.active = False
+
+    def _tick(self):
+        if not self.active:
+            return
+        deadline = time.perf_counter() + self.TIME_BUDGET
+        while time.perf_counter() < deadline:
+            try:
+                kind, payload = self.queue.get_nowait()
+            except Empty:
+                # Все сообщения задачи кладутся до ее завершения: после него очередь не пополнится
+                if self.task is not None and self.task.finished.is_set() and self.queue.empty():
+                    self.active = False
+                    return
+                break
+            if kind == 'source':
+                self.view.set_rows(*payload)
+            elif kind == 'rows':
+                self.view.append_rows(payload)
+            elif kind == 'done':
+                self.active = False
+                callback, args = payload
+                if callback is not None:
+                    callback(*args)
+                return
+        self.root.after(self.TICK_MS, self._tick)
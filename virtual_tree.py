@@ -0,0 +1,208 @@
+﻿import tkinter as tk
+from tkinter import ttk
+
+class VirtualTreeview:
+    """
+    Таблица на ttk.Treeview, в которой элементы создаются только для видимых строк.
+
+    Источник строк - последовательность с len() и срезами: список или PacketRange
+    (строки читаются из БД по позиции). Treeview всегда содержит столько элементов,
+    сколько строк помещается по высоте, прокрутка только меняет их значения.
+    Строки берутся у источника окном вокруг видимых с запасом prefetch в обе
+    стороны; новое окно читается, когда видимые строки выходят за кэш. Поэтому
+    показ 10 млн строк стоит столько же, сколько показ 50.
+
+    Окна источника из БД читаются в рабочем потоке: run_in_thread(target, *args,
+    category=..., name=...) - запуск задачи ('query'), call_in_main(func, *args) -
+    возврат строк в главный поток. Пока окно читается, вместо его строк видны
+    заглушки, ошибка чтения передается в on_error(message) (строка состояния).
+    Список и источник без run_in_thread читаются сразу
+    """
+
+    ROW_HEIGHT = 20
+    PREFETCH = 200
+    # Строк за один шаг колеса мыши
+    WHEEL_ROWS = 3
+    # Значение первой колонки строки, окно которой еще читается
+    PLACEHOLDER = '…'
+
+    def __init__(self, parent, height: int = 10, prefetch: int = PREFETCH, column_width: int = 120,
+                 run_in_thread=None, call_in_main=None, on_error=None):
+        self.frame = ttk.Frame(parent)
+        self.prefetch = prefetch
+        self.column_width = column_width
+        self.run_in_thread = run_in_thread
+        self.call_in_main = call_in_main
+        self.on_error = on_error
+
+        self.tree = ttk.Treeview(self.frame, show='headings', height=height)
+        self.v_scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.h_scrollbar = ttk.Scrollbar(self.frame, orient=tk.HORIZONTAL, command=self.tree.xview)
+        self.tree.configure(xscrollcommand=self.h_scrollbar.set)
+
+        self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.v_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.h_scrollbar.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        self.frame.rowconfigure(0, weight=1)
+        self.frame.columnconfigure(0, weight=1)
+
+        self.rows = []
+        self.first = 0
+        self.visible = height
+        self._cache_start = 0
+        self._cache = []
+        self._placeholder = ()
+        # Номер источника: окно, прочитанное для прежнего источника, отбрасывается
+        self._generation = 0
+        # Задача чтения окна; отмененная до запуска не вернет строк
+        self._fetch_task = None
+
+        self.tree.bind('<Configure>', self.on_resize)
+        self.tree.bind('<MouseWheel>', lambda event: self.scroll(-(event.delta // 120) * self.WHEEL_ROWS))
+        self.tree.bind('<Button-4>', lambda event: self.scroll(-self.WHEEL_ROWS))
+        self.tree.bind('<Button-5>', lambda event: self.scroll(self.WHEEL_ROWS))
+        for key, rows in (('<Up>', -1), ('<Down>', 1)):
+            self.tree.bind(key, lambda event, rows=rows: self.scroll(rows))
+        self.tree.bind('<Prior>', lambda event: self.scroll(-self.visible))
+        self.tree.bind('<Next>', lambda event: self.scroll(self.visible))
+        self.tree.bind('<Home>', lambda event: self.scroll_to(0))
+        self.tree.bind('<End>', lambda event: self.scroll_to(len(self.rows)))
+
+    @property
+    def row_count(self) -> int:
+        return len(self.rows)
+
+    def set_rows(self, columns, rows):
+        """Новый источник строк: список или PacketRange"""
+        self.tree["columns"] = list(columns)
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=self.column_width, minwidth=50, stretch=True)
+        self.rows = rows
+        self.first = 0
+        self._cache_start = 0
+        self._cache = []
+        self._placeholder = (self.PLACEHOLDER,) + ('',) * (len(columns) - 1) if columns else ()
+        self._generation += 1
+        self._fetch_task = None
+        self.render()
+
+    def clear(self):
+        self.set_rows([], [])
+    
+    def append_rows(self, rows):
+        """Дописать строки в конец источника-списка (вывод порциями через TreeFeeder)"""
+        if not isinstance(self.rows, list):
+            self.rows = list(self.rows)
+        self.rows.extend(rows)
+        self.render()
+
+    def scroll(self, rows: int):
+        self.scroll_to(self.first + rows)
+        return 'break'
+
+    def scroll_to(self, first: int):
+        first = max(0, min(first, len(self.rows) - self.visible))
+        if first != self.first or not self.tree.get_children():
+            self.first = first
+            self.render()
+        return 'break'
+
+    def on_scrollbar(self, action, value, unit=None):
+        """Протокол команды ttk.Scrollbar: moveto доля | scroll n units/pages"""
+        if action == 'moveto':
+            self.scroll_to(int(float(value) * len(self.rows)))
+        elif action == 'scroll':
+            self.scroll(int(value) * (self.visible if unit == 'pages' else 1))
+
+    def on_resize(self, event):
+        row_height = self._row_height()
+        # Заголовок колонок занимает примерно одну строку
+        visible = max(1, (event.height - row_height - 4) // row_height)
+        if visible != self.visible:
+            self.visible = visible
+            self.first = max(0, min(self.first, len(self.rows) - self.visible))
+            self.render()
+
+    def render(self):
+        total = len(self.rows)
+        count = max(0, min(self.visible, total - self.first))
+        rows = self._window(self.first, count)
+
+        items = self.tree.get_children()
+        if len(items) > len(rows):
+            self.tree.delete(*items[len(rows):])
+        for position, row in enumerate(rows):
+            if position < len(items):
+                self.tree.item(items[position], values=row)
+            else:
+                self.tree.insert("", tk.END, values=row)
+
+        if total:
+            self.v_scrollbar.set(self.first / total, (self.first + len(rows)) / total)
+        else:
+            self.v_scrollbar.set(0, 1)
+
+    def _window(self, first: int, count: int):
+        """
+        Строки [first, first + count) из кэша, при промахе - чтение окна с запасом prefetch.
+        Окно из БД читается в фоне: пока его нет, строки вне кэша - заглушки
+        """
+        cache_end = self._cache_start + len(self._cache)
+        if not (self._cache_start <= first and first + count <= cache_end):
+            start = max(0, first - self.prefetch)
+            stop = min(len(self.rows), first + count + self.prefetch)
+            if self.run_in_thread is None or isinstance(self.rows, list):
+                self._cache, error = self._read(self.rows, start, stop)
+                self._cache_start = start
+                if error:
+                    self._report(error)
+            else:
+                # Следующее окно запросит render после прихода текущего
+                if self._fetch_task is None or self._fetch_task.state in ('cancelled', 'failed'):
+                    self._fetch_task = self.run_in_thread(self._fetch, self.rows, self._generation, start, stop,
+                                                          category='query', name='Чтение строк таблицы')
+                return [self._cached(position) for position in range(first, first + count)]
+        offset = first - self._cache_start
+        return self._cache[offset:offset + count]
+
+    def _cached(self, position: int):
+        offset = position - self._cache_start
+        return self._cache[offset] if 0 <= offset < len(self._cache) else self._placeholder
+
+    @staticmethod
+    def _read(rows, start: int, stop: int):
+        try:
+            return list(rows[start:stop]), None
+        except Exception as e:
+            return [], f"Ошибка чтения строк {start}-{stop}: {e}"
+
+    def _fetch(self, rows, generation: int, start: int, stop: int):
+        """Чтение окна (рабочий поток)"""
+        window, error = self._read(rows, start, stop)
+        self.call_in_main(self._apply, generation, start, stop, window, error)
+
+    def _apply(self, generation: int, start: int, stop: int, window, error):
+        """Прочитанное окно (главный поток)"""
+        if generation != self._generation:
+            return
+        self._fetch_task = None
+        if error:
+            # Окно остается заглушками до следующей прокрутки, а не запрашивается снова сразу
+            window = [self._placeholder] * (stop - start)
+            self._report(error)
+        self._cache = window
+        self._cache_start = start
+        self.render()
+
+    def _report(self, message: str):
+        if self.on_error is not None:
+            self.on_error(message)
+        else:
+            print(message)
+
+    def _row_height(self) -> int:
+        try:
+            return int(ttk.Style().lookup('Treeview', 'rowheight') or self.ROW_HEIGHT)
+        except (tk.TclError, ValueError):
+            return self.ROW_HEIGHT